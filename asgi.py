@@ -0,0 +1,9 @@
+from dotenv import load_dotenv
+from project import create_app
+from project.asgi import AsgiApp
+
+load_dotenv()
+
+# ASGI entry point, e.g. `uvicorn asgi:app --workers 4`. Views run as they do under
+# app.py, on a thread pool; /events streams wait on the event loop without a thread
+app = AsgiApp(create_app())
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from statistics import median, quantiles
+
+# Benchmark: concurrent connections one worker can hold, as a threaded WSGI
+# worker (app.py under e.g. gunicorn --threads) and as asgi.py, both with
+# `threads` threads. For each count of open /events streams it measures how
+# many streams actually got connected, how many of the events published
+# meanwhile reached them, and how `clients` users loading /messages back to
+# back fare for `seconds`: loads/s, latency including the wait for a thread,
+# and loads still waiting a second after time ran out. Everything runs in-process
+# against a throwaway SQLite database, so no server or network is involved.
+#   python bench_asgi.py [threads] [seconds] [clients]
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+CLIENTS = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+STREAMS = (THREADS // 2, THREADS, THREADS * 4, THREADS * 32)
+PUBLISH_EVERY = 0.5
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+os.environ['SSE_HEARTBEAT'] = '1'  # so streams notice the end of a round quickly
+os.environ['SSE_MAX_DURATION'] = '3600'
+
+from werkzeug.test import EnvironBuilder
+
+from project import create_app, db
+from project.asgi import AsgiApp
+from project.events import broker
+from project.models import User
+
+
+def percentile(values, q):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return quantiles(values, n=100)[q - 1]
+
+
+class Round:
+    def __init__(self, streams):
+        self.streams = streams
+        self.connected = 0
+        self.delivered = 0
+        self.published = 0
+        self.loads = []
+        self.stalled = 0
+
+    def report(self, mode):
+        expected = self.streams * self.published
+        loads = self.loads or [0.0]
+        print(f"{mode:>5} {self.streams:6d} streams: {self.connected:5d} connected, "
+              f"{self.delivered / expected if expected else 0:6.1%} of events delivered | "
+              f"{len(self.loads) / SECONDS:7.1f} loads/s, p50 {median(loads) * 1000:7.1f} ms "
+              f"p95 {percentile(loads, 95) * 1000:7.1f} ms, {self.stalled} stalled")
+
+
+def environ(path, cookie):
+    return EnvironBuilder(path=path, headers={'Cookie': cookie}).get_environ()
+
+
+def run_wsgi(app, user_id, cookie, streams):
+    """A threaded WSGI worker: every request, streams included, holds one of THREADS threads."""
+    result = Round(streams)
+    pool = ThreadPoolExecutor(THREADS)
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def stream():
+        body = app(environ('/events', cookie), lambda status, headers, exc_info=None: None)
+        try:
+            with lock:
+                result.connected += 1
+            for chunk in body:
+                if b'event: message' in chunk:
+                    with lock:
+                        result.delivered += 1
+                if stop.is_set():
+                    break
+        finally:
+            body.close()
+
+    def load():
+        body = app(environ('/messages', cookie), lambda status, headers, exc_info=None: None)
+        b''.join(body)
+        body.close()
+
+    def client(deadline):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                pool.submit(load).result(timeout=deadline - start + 1)
+            except TimeoutError:
+                result.stalled += 1
+                return
+            result.loads.append(time.perf_counter() - start)
+
+    for _ in range(streams):
+        pool.submit(stream)
+    time.sleep(1)
+    deadline = time.perf_counter() + SECONDS
+    clients = [threading.Thread(target=client, args=(deadline,)) for _ in range(CLIENTS)]
+    for t in clients:
+        t.start()
+    while time.perf_counter() < deadline:
+        broker.publish_to_user(user_id, 'message', {'n': result.published})
+        result.published += 1
+        time.sleep(PUBLISH_EVERY)
+    for t in clients:
+        t.join()
+    stop.set()
+    pool.shutdown(wait=True, cancel_futures=True)
+    return result
+
+
+async def call(asgi, path, cookie, disconnect=None, on_chunk=None):
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+             'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+             'server': ('localhost', 80), 'client': ('127.0.0.1', 50000), 'scheme': 'http'}
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await (disconnect.wait() if disconnect else asyncio.Event().wait())
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if on_chunk and message['type'] == 'http.response.body':
+            on_chunk(message['body'])
+
+    await asgi(scope, receive, send)
+
+
+async def run_asgi_round(asgi, user_id, cookie, streams):
+    result = Round(streams)
+    disconnect = asyncio.Event()
+
+    def on_stream_chunk(chunk):
+        if chunk.startswith(b'retry:'):
+            result.connected += 1
+        if b'event: message' in chunk:
+            result.delivered += 1
+
+    tasks = [asyncio.ensure_future(call(asgi, '/events', cookie, disconnect, on_stream_chunk)) for _ in range(streams)]
+    await asyncio.sleep(1)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SECONDS
+
+    async def client():
+        while loop.time() < deadline:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(call(asgi, '/messages', cookie), deadline - loop.time() + 1)
+            except asyncio.TimeoutError:
+                result.stalled += 1
+                return
+            result.loads.append(time.perf_counter() - start)
+
+    clients = [asyncio.ensure_future(client()) for _ in range(CLIENTS)]
+    while loop.time() < deadline:
+        broker.publish_to_user(user_id, 'message', {'n': result.published})
+        result.published += 1
+        await asyncio.sleep(PUBLISH_EVERY)
+    await asyncio.gather(*clients)
+    disconnect.set()
+    await asyncio.gather(*tasks)
+    return result
+
+
+if __name__ == '__main__':
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        user = User(username='writer', email='writer@example.com', is_verified=True)
+        user.set_password('secret1')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    client = app.test_client()
+    client.post('/login', data={'email': 'writer@example.com', 'password': 'secret1'})
+    cookie = f"session={client.get_cookie('session').value}"
+
+    print(f"{THREADS} threads per worker, {CLIENTS} page clients for {SECONDS:.0f}s per round, "
+          f"an event every {PUBLISH_EVERY}s, on {os.cpu_count()} CPUs")
+    asgi = AsgiApp(app, threads=THREADS)
+    for streams in STREAMS:
+        run_wsgi(app, user_id, cookie, streams).report('wsgi')
+        asyncio.run(run_asgi_round(asgi, user_id, cookie, streams)).report('asgi')
@@ -0,0 +1,124 @@
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Benchmark: streaming export and bulk import at 1M messages.
+# Each phase runs in its own process so its peak RSS is its own:
+#   seed     - users, posts and messages via executemany
+#   naive    - what an export with .all() would do: ORM objects, then JSON
+#   stream   - export_lines() for the whole instance to NDJSON (and zip)
+#   user     - personal export of the busiest user
+#   import   - ImportJob loading the NDJSON into an empty database
+# Uses throwaway SQLite databases in a temp directory.
+#   python bench_export.py [messages] [users]
+
+MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 1000000
+USERS = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 2000
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def app_for(path):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    from project import create_app
+    return create_app()
+
+
+def seed(path):
+    from project import db
+    from project.models import User, Post, Message
+    app = app_for(path)
+    rng = random.Random(3)
+    start = datetime(2025, 1, 1)
+    with app.app_context(), db.engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {'id': i, 'username': f'writer{i}', 'email': f'writer{i}@example.com', 'image_file': 'default.jpg',
+             'follower_count': 0, 'following_count': 0} for i in range(1, USERS + 1)])
+        conn.execute(Post.__table__.insert(), [
+            {'id': i, 'title': f'Post {i}', 'body': 'words ' * 200, 'author_name': 'Bench', 'excerpt': 'words',
+             'user_id': rng.randint(1, USERS)} for i in range(1, USERS * 5 + 1)])
+        chunk = []
+        for i in range(1, MESSAGES + 1):
+            # User 1 is a hub who takes part in a fifth of all conversations
+            sender = 1 if rng.random() < 0.1 else rng.randint(2, USERS)
+            recipient = 1 if sender != 1 and rng.random() < 0.1 else rng.randint(2, USERS)
+            chunk.append({'id': i, 'sender_id': sender, 'recipient_id': recipient,
+                          'body': f'message {i} ' + 'lorem ipsum ' * rng.randint(1, 10),
+                          'timestamp': start + timedelta(seconds=i), 'is_edited': False})
+            if len(chunk) == 20000:
+                conn.execute(Message.__table__.insert(), chunk)
+                chunk = []
+        if chunk:
+            conn.execute(Message.__table__.insert(), chunk)
+
+
+def naive(path, out):
+    import json
+    from project.models import Message
+    app = app_for(path)
+    with app.app_context(), open(out, 'w') as f:
+        for m in Message.query.all():
+            f.write(json.dumps({'type': 'message', 'id': m.id, 'sender_id': m.sender_id,
+                                'recipient_id': m.recipient_id, 'body': m.body,
+                                'timestamp': m.timestamp.isoformat()}) + '\n')
+
+
+def stream(path, out, user_id=None, as_zip=False):
+    from project.export import export_lines, zip_stream
+    app = app_for(path)
+    with app.app_context(), open(out, 'wb') as f:
+        lines = export_lines(user_id, include_secrets=user_id is None)
+        for chunk in (zip_stream(lines) if as_zip else lines):
+            f.write(chunk)
+
+
+def load(path, source):
+    from project.export import ImportJob, read_records
+    app = app_for(path)
+    with app.app_context(), open(source, 'rb') as f:
+        ImportJob(chunk_size=5000, echo=lambda line: None).run(read_records(f))
+
+
+def phase(*args):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, __file__, *map(str, args)], capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, float(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and not sys.argv[1].isdigit():
+        name, args = sys.argv[1], sys.argv[2:]
+        MESSAGES, USERS = int(os.environ['BENCH_MESSAGES']), int(os.environ['BENCH_USERS'])
+        {'seed': seed, 'naive': naive, 'stream': lambda p, o, *rest: stream(p, o, int(rest[0]) or None, rest[1] == 'zip'),
+         'import': load}[name](*args)
+        print(peak_rss_mib())
+        sys.exit(0)
+
+    os.environ['BENCH_MESSAGES'], os.environ['BENCH_USERS'] = str(MESSAGES), str(USERS)
+    tmp = tempfile.mkdtemp()
+    source, target = os.path.join(tmp, 'source.db'), os.path.join(tmp, 'target.db')
+    ndjson, zipped = os.path.join(tmp, 'all.ndjson'), os.path.join(tmp, 'all.zip')
+    total_rows = USERS * 6 + MESSAGES
+
+    elapsed, rss = phase('seed', source)
+    print(f"Seeded {USERS} users, {USERS * 5} posts, {MESSAGES} messages in {elapsed:.1f}s")
+
+    elapsed, rss = phase('naive', source, os.path.join(tmp, 'naive.ndjson'))
+    print(f"{'.all() messages only':>24}: {elapsed:6.1f}s, {MESSAGES / elapsed:9.0f} rows/s, peak RSS {rss:6.0f} MiB")
+    elapsed, rss = phase('stream', source, ndjson, 0, 'plain')
+    print(f"{'streamed NDJSON':>24}: {elapsed:6.1f}s, {total_rows / elapsed:9.0f} rows/s, peak RSS {rss:6.0f} MiB, "
+          f"{os.path.getsize(ndjson) / 2**20:.0f} MiB")
+    elapsed, rss = phase('stream', source, zipped, 0, 'zip')
+    print(f"{'streamed zip':>24}: {elapsed:6.1f}s, {total_rows / elapsed:9.0f} rows/s, peak RSS {rss:6.0f} MiB, "
+          f"{os.path.getsize(zipped) / 2**20:.0f} MiB")
+    elapsed, rss = phase('stream', source, os.path.join(tmp, 'user1.ndjson'), 1, 'plain')
+    print(f"{'personal export (hub)':>24}: {elapsed:6.1f}s, peak RSS {rss:6.0f} MiB")
+    elapsed, rss = phase('import', target, ndjson)
+    print(f"{'import NDJSON':>24}: {elapsed:6.1f}s, {total_rows / elapsed:9.0f} rows/s, peak RSS {rss:6.0f} MiB")
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import tempfile
+from statistics import median
+
+from markupsafe import escape
+
+# Benchmark: bytes read from the database and HTML sent for a feed of long posts,
+# loading full bodies versus excerpts with the body column deferred. The HTML is
+# the logged-in /explore feed (logged-out visitors get no post cards).
+# Runs against a throwaway SQLite database unless DATABASE_URL is set.
+#   python bench_feed_payload.py [posts] [words_per_post]
+
+POSTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+WORDS = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+RUNS = 20
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+from project import create_app, db
+from project.models import User, Post
+
+app = create_app()
+app.config['WTF_CSRF_ENABLED'] = False
+
+VOCAB = 'the quiet river carried lanterns past sleeping houses while an old poet counted stars'.split()
+
+
+def value_size(value):
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes)):
+        return len(value.encode() if isinstance(value, str) else value)
+    return 8
+
+
+def measure(query):
+    # Size every column value the feed query actually returns, like the driver has to
+    with db.engine.connect() as conn:
+        rows = conn.execute(query.statement).all()
+        size = sum(value_size(v) for row in rows for v in row)
+        timings = []
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            conn.execute(query.statement).all()
+            timings.append(time.perf_counter() - start)
+    return len(rows), size, median(timings)
+
+
+with app.app_context():
+    author = User.query.filter_by(username='bench_writer').first()
+    if author is None:
+        author = User(username='bench_writer', email='bench_writer@example.com', is_verified=True)
+        db.session.add(author)
+    author.set_password('bench-password')
+    db.session.commit()
+    if Post.query.filter_by(user_id=author.id).count() < POSTS:
+        for i in range(POSTS):
+            body = '\n\n'.join(' '.join(VOCAB[(i + j + k) % len(VOCAB)] for k in range(100)) for j in range(WORDS // 100))
+            db.session.add(Post(title=f'Long read {i}', body=body, author_name='Bench', user_id=author.id))
+        db.session.commit()
+
+    print(f"Feed of {POSTS} posts, ~{WORDS} words each")
+    results = {}
+    for name, query in (('full rows', Post.query.order_by(Post.timestamp.desc())),
+                        ('body deferred', Post.feed().order_by(Post.timestamp.desc()))):
+        rows, size, elapsed = measure(query)
+        results[name] = size
+        print(f"{name:>14}: {rows} rows, {size / 1024:9.1f} KiB read, median query {elapsed * 1000:7.2f}ms")
+    print(f"DB bytes saved: {100 * (1 - results['body deferred'] / results['full rows']):.1f}%")
+
+    client = app.test_client()
+    client.post('/login', data={'email': 'bench_writer@example.com', 'password': 'bench-password'})
+    html = client.get('/explore').get_data(as_text=True)
+    # Only the cards actually on the page; the old template printed {{ post.body }} where the excerpt is now
+    rendered = [p for p in Post.query.all() if f'<h2 class="h4 fw-bold mb-1">{escape(p.title)}</h2>' in html]
+    assert rendered, 'the feed rendered no posts; is the bench client logged in?'
+    size = len(html.encode())
+    inline_full = size + sum(len(str(escape(p.body)).encode()) - len(str(escape(p.excerpt)).encode()) for p in rendered)
+    print(f"/explore HTML, {len(rendered)} cards: {size / 1024:.1f} KiB with excerpts vs {inline_full / 1024:.1f} KiB "
+          f"with full bodies ({100 * (1 - size / inline_full):.1f}% smaller)")
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import tempfile
+
+# Benchmark: notification row growth and insert throughput under a like storm.
+# Runs against a throwaway SQLite database unless DATABASE_URL is set.
+#   python bench_notifications.py [events] [posts]
+
+EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+POSTS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+from project import create_app, db
+from project.models import User, Notification
+from project.notifications import NotificationService
+
+app = create_app()
+
+
+def reset():
+    Notification.query.delete()
+    db.session.commit()
+
+
+def naive_storm(author_id):
+    # What like_post used to do: one ORM insert and one commit per event
+    start = time.perf_counter()
+    for i in range(EVENTS):
+        db.session.add(Notification(user_id=author_id, message=f"fan{i} liked your post 'Post {i % POSTS}...'", link='/user/fan'))
+        db.session.commit()
+    return time.perf_counter() - start
+
+
+def aggregated_storm(author_id):
+    service = NotificationService()
+    service.window = app.extensions['notifications'].window
+    service.batch_size = 500
+    start = time.perf_counter()
+    for i in range(EVENTS):
+        post_id = i % POSTS
+        service.notify(author_id, 'like', f'post:{post_id}', i, f'fan{i}', f"liked your post 'Post {post_id}...'", link='/user/fan')
+        # Simulate the request-end flush firing every 100 requests
+        if i % 100 == 99:
+            service.flush()
+    service.flush()
+    return time.perf_counter() - start
+
+
+with app.app_context():
+    author = User.query.filter_by(username='bench_author').first()
+    if author is None:
+        author = User(username='bench_author', email='bench_author@example.com', is_verified=True)
+        db.session.add(author)
+        db.session.commit()
+
+    print(f"Like storm: {EVENTS} likes spread over {POSTS} posts by one author")
+    for name, run in (('per-row inserts', naive_storm), ('aggregated service', aggregated_storm)):
+        reset()
+        elapsed = run(author.id)
+        rows = Notification.query.filter_by(user_id=author.id).count()
+        print(f"{name:>20}: {rows:>6} rows  {elapsed:7.3f}s  {EVENTS / elapsed:10.0f} events/s")
+
+    top = Notification.query.filter_by(user_id=author.id).order_by(Notification.timestamp.desc()).first()
+    print(f"Sample row: {top.message}")
+    reset()
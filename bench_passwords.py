@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from statistics import median, quantiles
+
+# Benchmark: login throughput under concurrency, with password hashing on the
+# request threads (PASSWORD_HASH_WORKERS=0, the old behaviour) and on the
+# bounded pool. `threads` clients log in back to back for `seconds` while one
+# more client keeps loading a cheap page, which shows how much CPU the login
+# burst leaves for everyone else. Logins turned away with 503 are counted.
+# Runs against a throwaway SQLite database.
+#   python bench_passwords.py [threads] [seconds] [method]
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+METHOD = sys.argv[3] if len(sys.argv) > 3 else 'scrypt:32768:8:1'
+USERS = 50
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['PASSWORD_HASH_METHOD'] = METHOD
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+
+from project import create_app, db
+from project.models import User
+from project.passwords import hasher
+
+
+def percentile(values, q):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return quantiles(values, n=100)[q - 1]
+
+
+def run(app, deadline):
+    logins, rejected, pages = [], [], []
+
+    def login_client(i):
+        client = app.test_client()
+        n = i
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            r = client.post('/login', data={'email': f'writer{n % USERS}@example.com', 'password': 'secret1'})
+            (logins if r.status_code == 302 else rejected).append(time.perf_counter() - start)
+            client.get('/logout')
+            n += THREADS
+
+    def page_client():
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            client.get('/login')
+            pages.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=login_client, args=(i,)) for i in range(THREADS)]
+    threads.append(threading.Thread(target=page_client))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return logins, rejected, pages
+
+
+if __name__ == '__main__':
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        hashed = hasher.hash('secret1')
+        db.session.add_all(User(username=f'writer{i}', email=f'writer{i}@example.com', password_hash=hashed,
+                                is_verified=True) for i in range(USERS))
+        db.session.commit()
+        client = app.test_client()
+        start = time.perf_counter()
+        for _ in range(20):
+            client.get('/login')
+        idle = (time.perf_counter() - start) / 20
+
+    print(f"{METHOD}, {THREADS} login threads + 1 page client for {SECONDS:.0f}s on {os.cpu_count()} CPUs; "
+          f"idle page load {idle * 1000:.1f} ms")
+    workers = max(1, (os.cpu_count() or 2) // 2)
+    for label, pool in (('request threads', 0), (f'pool of {workers}', workers)):
+        app.config['PASSWORD_HASH_WORKERS'] = pool
+        hasher.init_app(app)
+        logins, rejected, pages = run(app, time.perf_counter() + SECONDS)
+        print(f"{label:>16}: {len(logins) / SECONDS:6.1f} logins/s, login p50 {median(logins) * 1000:6.0f} ms "
+              f"p95 {percentile(logins, 95) * 1000:6.0f} ms, {len(rejected)} turned away | page p50 "
+              f"{median(pages) * 1000:6.1f} ms p95 {percentile(pages, 95) * 1000:6.1f} ms ({len(pages)} loads)")
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import tempfile
+from multiprocessing import Pool
+from statistics import median
+
+# Benchmark: cost of the rate limiter per request, for both backends.
+# Times Backend.take() on a hot key and across many keys, the whole
+# before_request check, and a full /search request for scale. Then checks
+# that the SQLite backend hands out exactly `capacity` tokens when several
+# processes race for the same bucket.
+# Runs against a throwaway SQLite database unless DATABASE_URL is set.
+#   python bench_ratelimit.py [calls] [processes]
+
+CALLS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+PROCS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+KEYS = 10000
+
+tmp = tempfile.mkdtemp()
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+
+from project import create_app
+from project.ratelimit import MemoryBackend, SQLiteBackend, limiter, parse_limit
+
+LIMIT = parse_limit('1000000/second')
+SHARED_PATH = os.path.join(tmp, 'ratelimit.db')
+
+
+def per_call(fn, calls):
+    # Median of 10 rounds, in microseconds per call
+    rounds = []
+    for _ in range(10):
+        start = time.perf_counter()
+        for i in range(calls // 10):
+            fn(i)
+        rounds.append((time.perf_counter() - start) / (calls // 10))
+    return median(rounds) * 1e6
+
+
+def race(worker):
+    backend = SQLiteBackend(SHARED_PATH)
+    scarce = parse_limit('100/day')
+    return sum(backend.take('race', scarce) == 0 for _ in range(200))
+
+
+if __name__ == '__main__':
+    print(f"{CALLS} calls per measurement, median of 10 rounds")
+    for name, backend in (('memory', MemoryBackend()), ('sqlite', SQLiteBackend(SHARED_PATH))):
+        hot = per_call(lambda i: backend.take('hot', LIMIT), CALLS)
+        spread = per_call(lambda i: backend.take(f'user:{i % KEYS}', LIMIT), CALLS)
+        print(f"{name:>7} take(): {hot:6.2f}us hot key, {spread:6.2f}us across {KEYS} keys")
+
+    app = create_app()
+    for name in ('memory', 'sqlite'):
+        app.config['RATE_LIMIT_BACKEND'] = name
+        app.config['RATE_LIMIT_PATH'] = SHARED_PATH
+        app.config['RATE_LIMITS'] = {'main.search': {'methods': ('GET',), 'ip': '1000000/second'}}
+        limiter.init_app(app)
+        with app.test_request_context('/search?q=poem'):
+            check = per_call(lambda i: limiter.check_request(), CALLS)
+        client = app.test_client()
+        request_cost = per_call(lambda i: client.get('/search?q=poem'), 2000)
+        print(f"{name:>7} before_request check: {check:6.2f}us vs {request_cost / 1000:6.2f}ms for the whole "
+              f"/search request ({100 * check / request_cost:.2f}%)")
+
+    os.remove(SHARED_PATH)
+    with Pool(PROCS) as pool:
+        granted = sum(pool.map(race, range(PROCS)))
+    print(f"{PROCS} processes x 200 requests on a 100-token bucket: {granted} granted "
+          f"({'exact' if granted == 100 else 'WRONG'})")
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import tempfile
+from collections import Counter, defaultdict
+
+# Benchmark: who-to-follow build on a synthetic graph.
+# Follow targets and liked posts are drawn from a Zipf-like distribution so a
+# few accounts are very popular, like a real network. Compares the sparse
+# matrix job with a per-user Python loop timed on a sample and extrapolated.
+# Runs against a throwaway SQLite database unless DATABASE_URL is set.
+#   python bench_suggestions.py [users] [follow_edges] [likes]
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+EDGES = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+LIKES = int(sys.argv[3]) if len(sys.argv) > 3 else 500000
+POSTS = max(USERS // 2, 1)
+SAMPLE = 500
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+import numpy as np
+from sqlalchemy import select
+from project import create_app, db
+from project.models import User, Post, Like, FollowSuggestion, followers
+from project.suggestions import SuggestionJob
+
+app = create_app()
+rng = np.random.default_rng(7)
+
+
+def zipf_ids(size, upper):
+    return (rng.zipf(1.3, size) - 1) % upper
+
+
+def insert(table, rows, chunk=50000):
+    with db.engine.begin() as conn:
+        for i in range(0, len(rows), chunk):
+            conn.execute(table.insert(), rows[i:i + chunk])
+
+
+def seed():
+    start = time.perf_counter()
+    insert(User.__table__, [{'id': i + 1, 'username': f'bench{i}', 'email': f'bench{i}@example.com',
+                             'image_file': 'default.jpg', 'follower_count': 0, 'following_count': 0}
+                            for i in range(USERS)])
+    insert(Post.__table__, [{'id': i + 1, 'title': f'Post {i}', 'body': 'x', 'author_name': 'bench',
+                             'user_id': int(u) + 1} for i, u in enumerate(rng.integers(0, USERS, POSTS))])
+    pairs = np.unique(np.stack([rng.integers(0, USERS, EDGES), zipf_ids(EDGES, USERS)], axis=1), axis=0)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]] + 1
+    insert(followers, [{'follower_id': a, 'followed_id': b} for a, b in pairs.tolist()])
+    likes = np.unique(np.stack([rng.integers(0, USERS, LIKES), zipf_ids(LIKES, POSTS)], axis=1), axis=0) + 1
+    insert(Like.__table__, [{'user_id': a, 'post_id': b} for a, b in likes.tolist()])
+    print(f"Seeded {USERS} users, {len(pairs)} follow edges, {len(likes)} likes "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+def python_loop_estimate():
+    # The obvious implementation: adjacency dicts and a Counter per user
+    start = time.perf_counter()
+    with db.engine.connect() as conn:
+        following = defaultdict(set)
+        for a, b in conn.execute(select(followers.c.follower_id, followers.c.followed_id)):
+            following[a].add(b)
+        likers, liked = defaultdict(set), defaultdict(set)
+        for u, p in conn.execute(select(Like.user_id, Like.post_id)):
+            likers[p].add(u)
+            liked[u].add(p)
+    load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for user_id in rng.integers(1, USERS + 1, SAMPLE).tolist():
+        scores = Counter()
+        for friend in following[user_id]:
+            scores.update(following[friend])
+        for post in liked[user_id]:
+            for other in likers[post]:
+                scores[other] += 0.25
+        for seen in following[user_id] | {user_id}:
+            scores.pop(seen, None)
+        scores.most_common(20)
+    per_user = (time.perf_counter() - start) / SAMPLE
+    return load, per_user
+
+
+with app.app_context():
+    if User.query.count() < USERS:
+        seed()
+
+    job = SuggestionJob(echo=lambda line: None)
+    written = job.run()
+    print(f"{'sparse matrix job':>20}: {written} suggestions, "
+          + ', '.join(f"{name} {seconds:.2f}s" for name, seconds in job.timings.items()))
+
+    load, per_user = python_loop_estimate()
+    print(f"{'per-user loop':>20}: load {load:.2f}s, {per_user * 1000:.2f}ms/user on {SAMPLE} sampled users, "
+          f"~{load + per_user * USERS:.0f}s estimated for all {USERS} users (scoring only, no writes)")
+
+    sample = FollowSuggestion.query.order_by(FollowSuggestion.score.desc()).first()
+    if sample:
+        print(f"Top row: user {sample.user_id} -> {sample.suggested_id} score {sample.score:.2f} "
+              f"({sample.mutual_count} mutual, {sample.shared_likes} shared likes)")
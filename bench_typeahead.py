@@ -0,0 +1,97 @@
+import os
+import random
+import string
+import sys
+import time
+import tempfile
+import tracemalloc
+from statistics import median
+
+# Benchmark: username typeahead from the in-memory prefix index versus the
+# ILIKE scan search used to do. Usernames are random with Zipf-like follower
+# counts; prefixes of 1-5 characters are sampled from real names so every
+# lookup has matches.
+# Runs against a throwaway SQLite database unless DATABASE_URL is set.
+#   python bench_typeahead.py [usernames] [db_rows]
+
+NAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+DB_ROWS = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+LOOKUPS = 2000
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+from project import create_app, db
+from project.models import User
+from project.typeahead import PrefixIndex
+
+rng = random.Random(7)
+SYLLABLES = [a + b for a in 'bcdfghklmnprstvz' for b in 'aeiou']
+
+
+def make_names(count):
+    names = set()
+    while len(names) < count:
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5)))
+        if rng.random() < 0.3:
+            name = name.capitalize()
+        if rng.random() < 0.2:
+            name += str(rng.randint(1, 999))
+        names.add(name)
+    return sorted(names)
+
+
+def timed(fn, args):
+    times = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return median(times) * 1e6, times[int(len(times) * 0.99)] * 1e6
+
+
+names = make_names(NAMES)
+scores = [int(rng.paretovariate(1.2)) - 1 for _ in names]
+
+tracemalloc.start()
+start = time.perf_counter()
+index = PrefixIndex()
+index.load(zip(names, scores))
+build = time.perf_counter() - start
+memory = tracemalloc.get_traced_memory()[0]
+tracemalloc.stop()
+print(f"Index: {len(index)} usernames built in {build:.2f}s, {memory / 2**20:.0f} MiB "
+      f"({memory / len(index):.0f} bytes/name)")
+
+for length in (1, 2, 3, 5):
+    prefixes = [rng.choice(names)[:length] for _ in range(LOOKUPS)]
+    first, _ = timed(lambda p: index.search(p, 8), prefixes[:50])
+    med, p99 = timed(lambda p: index.search(p, 8), prefixes)
+    print(f"  prefix len {length}: median {med:7.1f}us, p99 {p99:7.1f}us (first hits {first:7.1f}us)")
+
+adds = [f'newcomer{i}' for i in range(200)]
+med, p99 = timed(lambda n: index.add(n, 0), adds)
+print(f"  add name: median {med:.1f}us, p99 {p99:.1f}us")
+med, p99 = timed(lambda n: index.rename(n, n + '_x'), adds)
+print(f"  rename: median {med:.1f}us, p99 {p99:.1f}us")
+picks = [rng.choice(names) for _ in range(200)]
+med, p99 = timed(lambda n: index.set_score(n, 10 ** 6), picks)
+print(f"  follower count jump to #1: median {med:.1f}us, p99 {p99:.1f}us")
+med, p99 = timed(lambda n: (index.set_score(n, 0), index.search(n[:1], 8)), picks)
+print(f"  unfollow drop + lookup rebuilding its prefix lists: median {med:.1f}us, p99 {p99:.1f}us")
+
+app = create_app()
+with app.app_context():
+    if User.query.count() < DB_ROWS:
+        with db.engine.begin() as conn:
+            conn.execute(User.__table__.insert(), [
+                {'username': name, 'email': f'{name}@example.com', 'image_file': 'default.jpg',
+                 'follower_count': score, 'following_count': 0}
+                for name, score in zip(names[:DB_ROWS], scores[:DB_ROWS])])
+    prefixes = [rng.choice(names[:DB_ROWS])[:3] for _ in range(50)]
+
+    def ilike(prefix):
+        User.query.filter(User.username.ilike(f'%{prefix}%')).order_by(User.follower_count.desc()).limit(8).all()
+    med, p99 = timed(ilike, prefixes)
+    print(f"ILIKE '%q%' over {DB_ROWS} rows: median {med / 1000:.1f}ms, p99 {p99 / 1000:.1f}ms")
@@ -0,0 +1,41 @@
+"""Add notification archive table
+
+Revision ID: 0ad430dbaf67
+Revises: 2546c1252c36
+Create Date: 2026-10-19 11:20:43.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0ad430dbaf67'
+down_revision = '2546c1252c36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('notification_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('message', sa.String(length=255), nullable=False),
+    sa.Column('link', sa.String(length=255), nullable=True),
+    sa.Column('is_read', sa.Boolean(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('kind', sa.String(length=20), nullable=True),
+    sa.Column('target', sa.String(length=50), nullable=True),
+    sa.Column('actor_count', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('notification_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_notification_archive_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notification_archive', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_notification_archive_user_id'))
+
+    op.drop_table('notification_archive')
@@ -0,0 +1,32 @@
+"""Aggregate notifications by kind and target
+
+Revision ID: 2546c1252c36
+Revises: 0d4239f0cb33
+Create Date: 2026-10-19 10:02:11.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2546c1252c36'
+down_revision = '0d4239f0cb33'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('kind', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('target', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('actor_count', sa.Integer(), nullable=False, server_default='1'))
+        batch_op.create_index('ix_notification_user_target', ['user_id', 'target'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.drop_index('ix_notification_user_target')
+        batch_op.drop_column('actor_count')
+        batch_op.drop_column('target')
+        batch_op.drop_column('kind')
@@ -0,0 +1,27 @@
+"""Keep the ids of the actors counted on an aggregated notification
+
+Revision ID: 4c7e91d2b5a3
+Revises: b8ab9da0a6c0
+Create Date: 2026-10-19 22:14:36.502817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c7e91d2b5a3'
+down_revision = 'b8ab9da0a6c0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows keep actor_ids NULL: their count stands, later actors are added to it
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('actor_ids', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.drop_column('actor_ids')
@@ -0,0 +1,44 @@
+"""Deduplicate likes and saved posts, add unique (user_id, post_id)
+
+Revision ID: 573791aabe03
+Revises: e659a58cc420
+Create Date: 2026-10-19 13:30:52.104477
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '573791aabe03'
+down_revision = 'e659a58cc420'
+branch_labels = None
+depends_on = None
+
+
+def _dedupe(table):
+    # Keep the oldest row of every (user_id, post_id) pair
+    quoted = op.get_bind().dialect.identifier_preparer.quote(table)
+    op.execute(sa.text(
+        f'DELETE FROM {quoted} WHERE id NOT IN '
+        f'(SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM {quoted} GROUP BY user_id, post_id) AS keepers)'
+    ))
+
+
+def upgrade():
+    _dedupe('like')
+    _dedupe('saved_post')
+
+    with op.batch_alter_table('like', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_like_user_post', ['user_id', 'post_id'])
+
+    with op.batch_alter_table('saved_post', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_saved_post_user_post', ['user_id', 'post_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('saved_post', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_saved_post_user_post', type_='unique')
+
+    with op.batch_alter_table('like', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_like_user_post', type_='unique')
@@ -0,0 +1,39 @@
+"""Add follow_suggestion table
+
+Revision ID: 7291c372b036
+Revises: 9f6515deaa46
+Create Date: 2026-10-19 15:10:48.583021
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7291c372b036'
+down_revision = '9f6515deaa46'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('follow_suggestion',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('suggested_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('mutual_count', sa.Integer(), nullable=False),
+    sa.Column('shared_likes', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['suggested_id'], ['user.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'suggested_id')
+    )
+    with op.batch_alter_table('follow_suggestion', schema=None) as batch_op:
+        batch_op.create_index('ix_follow_suggestion_rank', ['user_id', 'score'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('follow_suggestion', schema=None) as batch_op:
+        batch_op.drop_index('ix_follow_suggestion_rank')
+
+    op.drop_table('follow_suggestion')
@@ -0,0 +1,64 @@
+"""Replace message.is_read with per-conversation read watermarks
+
+Revision ID: 7aec0f53afc8
+Revises: bf124a6fc977
+Create Date: 2026-10-19 19:04:52.730118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7aec0f53afc8'
+down_revision = 'bf124a6fc977'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('conversation_read',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('contact_id', sa.Integer(), nullable=False),
+    sa.Column('last_read_message_id', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['contact_id'], ['user.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'contact_id')
+    )
+    with op.batch_alter_table('conversation_read', schema=None) as batch_op:
+        batch_op.create_index('ix_conversation_read_contact_id', ['contact_id'], unique=False)
+
+    # The watermark sits just below the oldest unread message, or at the newest
+    # one when everything was read. A read message above an unread one turns
+    # unread again; the flags were only ever set a whole conversation at a time.
+    op.execute(sa.text('''
+        INSERT INTO conversation_read (user_id, contact_id, last_read_message_id, updated_at)
+        SELECT recipient_id, sender_id,
+               COALESCE(min(CASE WHEN is_read THEN NULL ELSE id END) - 1, max(id)), CURRENT_TIMESTAMP
+        FROM message
+        WHERE recipient_id <> sender_id
+          AND recipient_id IN (SELECT id FROM "user") AND sender_id IN (SELECT id FROM "user")
+        GROUP BY recipient_id, sender_id
+    '''))
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_conversation', ['recipient_id', 'sender_id', 'id'], unique=False)
+        batch_op.drop_column('is_read')
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('is_read', sa.Boolean(), nullable=True))
+        batch_op.drop_index('ix_message_conversation')
+
+    op.execute(sa.text('''
+        UPDATE message SET is_read = (id <= COALESCE(
+            (SELECT r.last_read_message_id FROM conversation_read r
+             WHERE r.user_id = message.recipient_id AND r.contact_id = message.sender_id), id))
+    '''))
+
+    with op.batch_alter_table('conversation_read', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversation_read_contact_id')
+
+    op.drop_table('conversation_read')
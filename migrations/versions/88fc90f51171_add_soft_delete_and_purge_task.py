@@ -0,0 +1,83 @@
+"""Add soft-delete columns, purge_task table and indexes used by the purge job
+
+Revision ID: 88fc90f51171
+Revises: 89061d1142c6
+Create Date: 2026-10-19 16:40:12.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '88fc90f51171'
+down_revision = '89061d1142c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('purge_task',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('target_id', sa.Integer(), nullable=False),
+    sa.Column('stage', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('rows_deleted', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('error', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('purge_task', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_purge_task_finished_at'), ['finished_at'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_user_deleted_at'), ['deleted_at'], unique=False)
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_post_deleted_at'), ['deleted_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_post_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_message_sender_id'), ['sender_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_message_recipient_id'), ['recipient_id'], unique=False)
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_comment_user_id'), ['user_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_comment_post_id'), ['post_id'], unique=False)
+
+    with op.batch_alter_table('like', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_like_post_id'), ['post_id'], unique=False)
+
+    with op.batch_alter_table('saved_post', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_saved_post_post_id'), ['post_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('saved_post', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_saved_post_post_id'))
+
+    with op.batch_alter_table('like', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_like_post_id'))
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_comment_post_id'))
+        batch_op.drop_index(batch_op.f('ix_comment_user_id'))
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_message_recipient_id'))
+        batch_op.drop_index(batch_op.f('ix_message_sender_id'))
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_post_user_id'))
+        batch_op.drop_index(batch_op.f('ix_post_deleted_at'))
+        batch_op.drop_column('deleted_at')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_deleted_at'))
+        batch_op.drop_column('deleted_at')
+
+    op.drop_table('purge_task')
@@ -0,0 +1,69 @@
+"""Add post excerpt, word_count and reading_time, backfilled from body
+
+Revision ID: 89061d1142c6
+Revises: 7291c372b036
+Create Date: 2026-10-19 15:52:19.660148
+
+"""
+import math
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '89061d1142c6'
+down_revision = '7291c372b036'
+branch_labels = None
+depends_on = None
+
+# Frozen copy of project.models.make_excerpt at the time of this revision
+EXCERPT_LENGTH = 500
+WORDS_PER_MINUTE = 200
+BATCH_SIZE = 500
+
+
+def _excerpt(body):
+    if len(body) <= EXCERPT_LENGTH:
+        return body
+    cut = body[:EXCERPT_LENGTH]
+    if not body[EXCERPT_LENGTH].isspace() and any(ch.isspace() for ch in cut):
+        cut = cut.rsplit(None, 1)[0]
+    return cut.rstrip() + '…'
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('excerpt', sa.String(length=501), nullable=True))
+        batch_op.add_column(sa.Column('word_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('reading_time', sa.Integer(), server_default='1', nullable=False))
+
+    post = sa.table('post', sa.column('id', sa.Integer), sa.column('body', sa.Text),
+                    sa.column('excerpt', sa.String), sa.column('word_count', sa.Integer),
+                    sa.column('reading_time', sa.Integer))
+    update = post.update().where(post.c.id == sa.bindparam('b_id')).values(
+        excerpt=sa.bindparam('b_excerpt'), word_count=sa.bindparam('b_words'), reading_time=sa.bindparam('b_minutes'))
+    conn = op.get_bind()
+    last_id = 0
+    # Keyset batches so long bodies are never all in memory at once
+    while True:
+        rows = conn.execute(
+            sa.select(post.c.id, post.c.body).where(post.c.id > last_id).order_by(post.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        params = []
+        for row in rows:
+            body = row.body or ''
+            words = len(body.split())
+            params.append({'b_id': row.id, 'b_excerpt': _excerpt(body), 'b_words': words,
+                           'b_minutes': max(1, math.ceil(words / WORDS_PER_MINUTE))})
+        conn.execute(update, params)
+        last_id = rows[-1].id
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('reading_time')
+        batch_op.drop_column('word_count')
+        batch_op.drop_column('excerpt')
@@ -0,0 +1,55 @@
+"""Add follower/following counters and a composite primary key on followers
+
+Revision ID: 9f6515deaa46
+Revises: b1fbec47491d
+Create Date: 2026-10-19 14:41:35.207716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f6515deaa46'
+down_revision = 'b1fbec47491d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # followers has no id column, so dedupe through a scratch copy of the distinct edges
+    op.execute(sa.text(
+        'CREATE TABLE followers_dedupe AS SELECT DISTINCT follower_id, followed_id FROM followers '
+        'WHERE follower_id IS NOT NULL AND followed_id IS NOT NULL'
+    ))
+    op.execute(sa.text('DELETE FROM followers'))
+    op.execute(sa.text(
+        'INSERT INTO followers (follower_id, followed_id) SELECT follower_id, followed_id FROM followers_dedupe'
+    ))
+    op.execute(sa.text('DROP TABLE followers_dedupe'))
+
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.alter_column('follower_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('followed_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_primary_key('pk_followers', ['follower_id', 'followed_id'])
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute(sa.text(
+        'UPDATE "user" SET '
+        'follower_count = (SELECT count(*) FROM followers WHERE followers.followed_id = "user".id), '
+        'following_count = (SELECT count(*) FROM followers WHERE followers.follower_id = "user".id)'
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('follower_count')
+
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.drop_constraint('pk_followers', type_='primary')
+        batch_op.alter_column('followed_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column('follower_id', existing_type=sa.Integer(), nullable=True)
@@ -0,0 +1,50 @@
+"""Add contact_score table and backfill it from message
+
+Revision ID: b1fbec47491d
+Revises: 573791aabe03
+Create Date: 2026-10-19 14:02:11.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1fbec47491d'
+down_revision = '573791aabe03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('contact_score',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('contact_id', sa.Integer(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('last_message_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['contact_id'], ['user.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'contact_id')
+    )
+    with op.batch_alter_table('contact_score', schema=None) as batch_op:
+        batch_op.create_index('ix_contact_score_rank', ['user_id', 'message_count', 'last_message_at'], unique=False)
+
+    op.execute(sa.text('''
+        INSERT INTO contact_score (user_id, contact_id, message_count, last_message_at)
+        SELECT user_id, contact_id, count(*), max(sent_at)
+        FROM (
+            SELECT sender_id AS user_id, recipient_id AS contact_id, timestamp AS sent_at FROM message
+            UNION ALL
+            SELECT recipient_id, sender_id, timestamp FROM message
+        ) AS pairs
+        WHERE user_id <> contact_id
+          AND user_id IN (SELECT id FROM "user") AND contact_id IN (SELECT id FROM "user")
+        GROUP BY user_id, contact_id
+    '''))
+
+
+def downgrade():
+    with op.batch_alter_table('contact_score', schema=None) as batch_op:
+        batch_op.drop_index('ix_contact_score_rank')
+
+    op.drop_table('contact_score')
@@ -0,0 +1,53 @@
+"""Add a case-insensitive unique index on user.username
+
+Revision ID: b8ab9da0a6c0
+Revises: 7aec0f53afc8
+Create Date: 2026-10-19 20:31:07.164522
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8ab9da0a6c0'
+down_revision = '7aec0f53afc8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    # Names that differ only in case ('Sam' and 'sam') can't share the new index:
+    # the oldest account keeps its name, later ones get the first free number appended
+    clashes = conn.execute(sa.text('''
+        SELECT id, username FROM "user"
+        WHERE lower(username) IN (SELECT lower(username) FROM "user" GROUP BY lower(username) HAVING count(*) > 1)
+        ORDER BY lower(username), id
+    ''')).all()
+    kept = set()
+    for user_id, username in clashes:
+        if username.lower() not in kept:
+            kept.add(username.lower())
+            continue
+        n = 1
+        while conn.execute(sa.text('SELECT 1 FROM "user" WHERE lower(username) = :name'),
+                           {'name': f'{username}{n}'.lower()}).first():
+            n += 1
+        conn.execute(sa.text('UPDATE "user" SET username = :name WHERE id = :id'),
+                     {'name': f'{username}{n}', 'id': user_id})
+        print(f"Renamed user {user_id} from {username} to {username}{n}")
+
+    if conn.dialect.name == 'postgresql':
+        # Byte-order collation, so project.usernames' prefix ranges can use the index; the
+        # included column lets those lookups be index-only scans
+        op.execute('CREATE UNIQUE INDEX ix_user_username_lower ON "user" ((lower(username) COLLATE "C")) INCLUDE (username)')
+    else:
+        with op.batch_alter_table('user', schema=None) as batch_op:
+            batch_op.create_index('ix_user_username_lower', [sa.text('lower(username)')], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_username_lower')
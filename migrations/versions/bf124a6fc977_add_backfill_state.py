@@ -0,0 +1,51 @@
+"""Add backfill_state for batched data migrations, queue the legacy email fixes
+
+Revision ID: bf124a6fc977
+Revises: d8a7241d74ac
+Create Date: 2026-10-19 18:12:30.518204
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bf124a6fc977'
+down_revision = 'd8a7241d74ac'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('backfill_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.String(length=10), server_default='pending', nullable=False),
+    sa.Column('last_key', sa.BigInteger(), nullable=True),
+    sa.Column('rows_scanned', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('rows_changed', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('batches', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('owner', sa.String(length=64), nullable=True),
+    sa.Column('lease_until', sa.DateTime(), nullable=True),
+    sa.Column('error', sa.String(length=255), nullable=True),
+    sa.Column('queued_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+
+    # Formerly the one-shot migrate_emails.py and migrate_email_verification.py;
+    # `flask backfill run --pending` works through them in batches after the upgrade
+    states = sa.table('backfill_state', sa.column('name'), sa.column('status'), sa.column('queued_at'))
+    op.bulk_insert(states, [
+        {'name': 'lowercase_emails', 'status': 'pending', 'queued_at': datetime.utcnow()},
+        {'name': 'verify_legacy_users', 'status': 'pending', 'queued_at': datetime.utcnow()},
+    ])
+
+
+def downgrade():
+    op.drop_table('backfill_state')
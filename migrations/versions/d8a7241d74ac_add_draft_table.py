@@ -0,0 +1,46 @@
+"""Add draft table for server-side autosaved drafts
+
+Revision ID: d8a7241d74ac
+Revises: 88fc90f51171
+Create Date: 2026-10-19 17:05:41.902713
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8a7241d74ac'
+down_revision = '88fc90f51171'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('draft',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=32), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('title', sa.String(length=150), nullable=True),
+    sa.Column('body', sa.Text(), server_default='', nullable=False),
+    sa.Column('author_name', sa.String(length=100), nullable=True),
+    sa.Column('tags', sa.String(length=255), nullable=True),
+    sa.Column('image_file', sa.String(length=500), nullable=True),
+    sa.Column('version', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('key')
+    )
+    with op.batch_alter_table('draft', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_draft_updated_at'), ['updated_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_draft_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('draft', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_draft_user_id'))
+        batch_op.drop_index(batch_op.f('ix_draft_updated_at'))
+
+    op.drop_table('draft')
@@ -0,0 +1,38 @@
+"""Add stream_event table for the shared SSE backend
+
+Revision ID: e659a58cc420
+Revises: 0ad430dbaf67
+Create Date: 2026-10-19 12:41:07.733190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e659a58cc420'
+down_revision = '0ad430dbaf67'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stream_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('channel', sa.String(length=50), nullable=False),
+    sa.Column('event', sa.String(length=30), nullable=False),
+    sa.Column('data', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stream_event', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stream_event_channel'), ['channel'], unique=False)
+        batch_op.create_index(batch_op.f('ix_stream_event_created_at'), ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('stream_event', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stream_event_created_at'))
+        batch_op.drop_index(batch_op.f('ix_stream_event_channel'))
+
+    op.drop_table('stream_event')
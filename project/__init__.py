@@ -33,6 +33,8 @@ def create_app():
     app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
     app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'dev-key-123')
+    # Serverless functions (Vercel) are frozen or recycled between requests, so work can't be left to background threads
+    app.config['SERVERLESS'] = bool(os.environ.get('VERCEL') or os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
     # Default to SQLite if DATABASE_URL is not set (useful for local development)
     # Prefix 'postgresql://' instead of 'postgres://' if using SQLAlchemy >= 1.4
     db_url = os.environ.get('DATABASE_URL', 'sqlite:///site.db')
@@ -51,6 +53,97 @@ def create_app():
     app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_USERNAME')
     if os.environ.get('MAIL_MAX_EMAILS'):
         app.config['MAIL_MAX_EMAILS'] = int(os.environ.get('MAIL_MAX_EMAILS'))
+    # Background threads for notification emails. Default 0 sends them inline, which is the only safe choice
+    # on serverless hosts; asgi.py uses ASGI_MAIL_OUTBOX_WORKERS instead unless this is higher
+    app.config['MAIL_OUTBOX_WORKERS'] = int(os.environ.get('MAIL_OUTBOX_WORKERS', 0))
+    app.config['MAIL_OUTBOX_MAX_PENDING'] = int(os.environ.get('MAIL_OUTBOX_MAX_PENDING', 500))
+
+    # Seconds a logged-in user's session snapshot is served from memory before re-reading the row
+    app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 30))
+    # Followed-id sets answer is_following from memory; users following more than the cap use a query instead
+    app.config['FOLLOWING_CACHE_TTL'] = int(os.environ.get('FOLLOWING_CACHE_TTL', 60))
+    app.config['FOLLOWING_CACHE_MAX_SET'] = int(os.environ.get('FOLLOWING_CACHE_MAX_SET', 2000))
+    # Like/comment/follow notifications are collapsed per target within this window and written in batches
+    app.config['NOTIFICATION_AGGREGATE_HOURS'] = int(os.environ.get('NOTIFICATION_AGGREGATE_HOURS', 24))
+    # Serverless writes each one through (interval 0) instead of buffering it where a frozen function would lose it
+    app.config['NOTIFICATION_FLUSH_INTERVAL'] = float(os.environ.get('NOTIFICATION_FLUSH_INTERVAL', 0 if app.config['SERVERLESS'] else 2))
+    app.config['NOTIFICATION_BATCH_SIZE'] = int(os.environ.get('NOTIFICATION_BATCH_SIZE', 500))
+    # Keys kept in the buffer while flushes fail, e.g. with the database down
+    app.config['NOTIFICATION_MAX_PENDING'] = int(os.environ.get('NOTIFICATION_MAX_PENDING', 5000))
+    # Feed cards show the latest few comments; the rest of a thread loads on demand in pages
+    app.config['COMMENT_PREVIEW_COUNT'] = int(os.environ.get('COMMENT_PREVIEW_COUNT', 3))
+    app.config['COMMENT_PAGE_SIZE'] = int(os.environ.get('COMMENT_PAGE_SIZE', 20))
+    # Defaults for `flask notifications prune`
+    app.config['NOTIFICATION_RETENTION_DAYS'] = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 30))
+    app.config['NOTIFICATION_UNREAD_CAP'] = int(os.environ.get('NOTIFICATION_UNREAD_CAP', 200))
+    # Deleted users and posts are hidden at once and purged in batches by a background thread or `flask purge run`
+    app.config['PURGE_BATCH_SIZE'] = int(os.environ.get('PURGE_BATCH_SIZE', 500))
+    app.config['PURGE_PAUSE'] = float(os.environ.get('PURGE_PAUSE', 0.05))
+    app.config['PURGE_IN_BACKGROUND'] = os.environ.get('PURGE_IN_BACKGROUND', '1') == '1'
+    # Default for `flask drafts prune`: anonymous drafts nobody logged in to claim
+    app.config['DRAFT_RETENTION_DAYS'] = int(os.environ.get('DRAFT_RETENTION_DAYS', 30))
+    # Defaults for `flask backfill run`; a worker's lease on a backfill expires this many seconds after its last batch
+    app.config['BACKFILL_BATCH_SIZE'] = int(os.environ.get('BACKFILL_BATCH_SIZE', 1000))
+    app.config['BACKFILL_PAUSE'] = float(os.environ.get('BACKFILL_PAUSE', 0.0))
+    app.config['BACKFILL_LEASE'] = int(os.environ.get('BACKFILL_LEASE', 60))
+    # Server-sent events: 'memory' for one worker, 'database' to share events between workers
+    app.config['EVENT_BACKEND'] = os.environ.get('EVENT_BACKEND', 'memory')
+    app.config['EVENT_POLL_INTERVAL'] = float(os.environ.get('EVENT_POLL_INTERVAL', 0.5))
+    app.config['SSE_HEARTBEAT'] = int(os.environ.get('SSE_HEARTBEAT', 15))
+    app.config['SSE_MAX_DURATION'] = int(os.environ.get('SSE_MAX_DURATION', 300))
+    app.config['SSE_RETRY_MS'] = int(os.environ.get('SSE_RETRY_MS', 3000))
+    # Whether pages open the /events stream. Off on serverless hosts, where each open tab would hold
+    # a function invocation and events published on other instances never arrive; asgi.py turns it on
+    app.config['LIVE_EVENTS'] = os.environ.get('LIVE_EVENTS', '0' if app.config['SERVERLESS'] else '1') == '1'
+    # In-memory prefix index behind /autocomplete, rebuilt from the database this often (seconds)
+    app.config['TYPEAHEAD_REFRESH'] = int(os.environ.get('TYPEAHEAD_REFRESH', 600))
+    app.config['TYPEAHEAD_MAX_ENTRIES'] = int(os.environ.get('TYPEAHEAD_MAX_ENTRIES', 1000000))
+    # Tag-invalidated cache for profile, user-page and follower-list queries; 'sqlite' shares it between workers
+    app.config['QUERY_CACHE_ENABLED'] = os.environ.get('QUERY_CACHE_ENABLED', '1') == '1'
+    app.config['QUERY_CACHE_BACKEND'] = os.environ.get('QUERY_CACHE_BACKEND', 'memory')
+    app.config['QUERY_CACHE_PATH'] = os.environ.get('QUERY_CACHE_PATH')
+    app.config['QUERY_CACHE_TTL'] = int(os.environ.get('QUERY_CACHE_TTL', 60))
+    app.config['QUERY_CACHE_GRACE'] = int(os.environ.get('QUERY_CACHE_GRACE', 30))
+    app.config['QUERY_CACHE_MAX_ENTRIES'] = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 2000))
+    # Logged-out home and explore pages are served pre-rendered and re-rendered in the background after changes.
+    # Set SNAPSHOT_DIR to share them between workers; otherwise each worker keeps its own and SNAPSHOT_MAX_AGE bounds drift
+    app.config['SNAPSHOT_ENABLED'] = os.environ.get('SNAPSHOT_ENABLED', '1') == '1'
+    app.config['SNAPSHOT_DIR'] = os.environ.get('SNAPSHOT_DIR')
+    app.config['SNAPSHOT_MAX_AGE'] = int(os.environ.get('SNAPSHOT_MAX_AGE', 300))
+    app.config['SNAPSHOT_DEBOUNCE'] = float(os.environ.get('SNAPSHOT_DEBOUNCE', 2))
+    # Password hashes run on a bounded pool so a burst of logins can't take every core; beyond
+    # workers + queue waiting hashes, logins get 503. `flask passwords calibrate` suggests a method for this host
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+    app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 32))
+    app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+    # MX checks on registration and email changes go through a per-domain cache; a form waits at most
+    # EMAIL_DNS_BUDGET seconds for DNS, then accepts the address while the lookup finishes in the background
+    app.config['EMAIL_CHECK_DELIVERABILITY'] = os.environ.get('EMAIL_CHECK_DELIVERABILITY', '1') == '1'
+    app.config['EMAIL_DOMAIN_TTL'] = int(os.environ.get('EMAIL_DOMAIN_TTL', 86400))
+    app.config['EMAIL_DOMAIN_NEGATIVE_TTL'] = int(os.environ.get('EMAIL_DOMAIN_NEGATIVE_TTL', 600))
+    app.config['EMAIL_DOMAIN_CACHE_SIZE'] = int(os.environ.get('EMAIL_DOMAIN_CACHE_SIZE', 10000))
+    app.config['EMAIL_DOMAIN_PREWARM'] = int(os.environ.get('EMAIL_DOMAIN_PREWARM', 200))
+    app.config['EMAIL_DNS_BUDGET'] = float(os.environ.get('EMAIL_DNS_BUDGET', 2))
+    app.config['EMAIL_DNS_TIMEOUT'] = float(os.environ.get('EMAIL_DNS_TIMEOUT', 5))
+    app.config['EMAIL_DNS_WORKERS'] = int(os.environ.get('EMAIL_DNS_WORKERS', 8))
+    # Comma-separated resolver IPs, e.g. a local caching resolver; default is the system's
+    app.config['EMAIL_DNS_NAMESERVERS'] = [ip for ip in os.environ.get('EMAIL_DNS_NAMESERVERS', '').split(',') if ip]
+    # Google's OIDC discovery document and signing keys are cached as files so a cold start doesn't fetch them
+    # before the first sign-in; past the TTL they are refreshed in the background. `flask oidc refresh` pre-fills the cache
+    app.config['GOOGLE_DISCOVERY_URL'] = os.environ.get('GOOGLE_DISCOVERY_URL', 'https://accounts.google.com/.well-known/openid-configuration')
+    app.config['OIDC_CACHE_DIR'] = os.environ.get('OIDC_CACHE_DIR')
+    app.config['OIDC_METADATA_TTL'] = int(os.environ.get('OIDC_METADATA_TTL', 86400))
+    app.config['OIDC_JWKS_TTL'] = int(os.environ.get('OIDC_JWKS_TTL', 21600))
+    app.config['OIDC_MAX_STALE'] = int(os.environ.get('OIDC_MAX_STALE', 7 * 86400))
+    # Token-bucket limits per endpoint (see project/ratelimit.py); 'sqlite' shares buckets between workers
+    app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    app.config['RATE_LIMIT_BACKEND'] = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    app.config['RATE_LIMIT_PATH'] = os.environ.get('RATE_LIMIT_PATH')
+    # asgi.py: threads running the Flask views, and how many response chunks a slow client may leave buffered
+    app.config['ASGI_THREADS'] = int(os.environ.get('ASGI_THREADS', 16))
+    app.config['ASGI_SEND_BUFFER'] = int(os.environ.get('ASGI_SEND_BUFFER', 16))
+    app.config['ASGI_MAIL_OUTBOX_WORKERS'] = int(os.environ.get('ASGI_MAIL_OUTBOX_WORKERS', 2))
 
     db.init_app(app)
     login_manager.init_app(app)
@@ -58,28 +151,59 @@ def create_app():
     oauth.init_app(app)
     mail.init_app(app)
     csrf.init_app(app)
+
+    from project.notifications import notifier
+    from project.events import broker
+    from project.purge import purger
+    from project.ratelimit import limiter
+    from project.typeahead import typeahead
+    from project.query_cache import query_cache
+    from project.snapshots import snapshots
+    from project.passwords import hasher
+    from project.deliverability import deliverability
+    from project.oidc import oidc_cache, CachedOAuth2App
+    from project.outbox import outbox
+    notifier.init_app(app)
+    broker.init_app(app)
+    purger.init_app(app)
+    limiter.init_app(app)
+    typeahead.init_app(app)
+    query_cache.init_app(app)
+    snapshots.init_app(app)
+    hasher.init_app(app)
+    deliverability.init_app(app)
+    oidc_cache.init_app(app)
+    outbox.init_app(app)
     
     # Register Google OAuth
     oauth.register(
         name='google',
         client_id=os.environ.get('GOOGLE_CLIENT_ID'),
         client_secret=os.environ.get('GOOGLE_CLIENT_SECRET'),
-        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+        server_metadata_url=app.config['GOOGLE_DISCOVERY_URL'],
         client_kwargs={
             'scope': 'openid email profile'
-        }
+        },
+        client_cls=CachedOAuth2App,
     )
     
     login_manager.login_view = 'main.login_page'
     
-    from project.models import User
+    from project.user_cache import user_cache, following_cache, load_cached_user
+    user_cache.ttl = app.config['USER_CACHE_TTL']
+    following_cache.ttl = app.config['FOLLOWING_CACHE_TTL']
+    following_cache.max_set_size = app.config['FOLLOWING_CACHE_MAX_SET']
+
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return load_cached_user(int(user_id))
 
     from project.routes import main
     app.register_blueprint(main)
 
+    from project.commands import register_commands
+    register_commands(app)
+
     # Note: We usually stop using db.create_all() once using Migrations
     # but it doesn't hurt to keep it for the very first initialization.
     with app.app_context():
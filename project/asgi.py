@@ -0,0 +1,235 @@
+import asyncio
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from tempfile import SpooledTemporaryFile
+
+from project.events import EventStream
+from project.outbox import outbox
+
+# Marks the end of a response on the chunk queue
+_DONE = object()
+
+
+class ClientGone(Exception):
+    pass
+
+
+class AsgiApp:
+    """Serves the Flask app to an ASGI server (`uvicorn asgi:app`).
+
+    Each request runs the unchanged WSGI app on a pool of `threads`, like a
+    threaded WSGI worker, and its response is streamed back to the event
+    loop through a queue of at most `send_buffer` chunks, so a slow client
+    holds up its own thread rather than buffering the whole body. Request
+    bodies are read on the loop into a spooled temporary file before a
+    thread is taken.
+
+    A view that returns an EventStream (the /events endpoint) gives its
+    thread back as soon as the headers are out: the stream then waits for
+    events on the loop, so open streams cost a coroutine each instead of a
+    thread each. That is what lets one worker hold thousands of them.
+
+    The process is long-lived, so pages open the live event stream
+    (LIVE_EVENTS) and notification emails go out from the background outbox
+    (ASGI_MAIL_OUTBOX_WORKERS threads) rather than inline.
+    """
+
+    def __init__(self, app, threads=None, send_buffer=None):
+        self.app = app
+        self.threads = threads or app.config.get('ASGI_THREADS', 16)
+        self.send_buffer = send_buffer or app.config.get('ASGI_SEND_BUFFER', 16)
+        self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='asgi')
+        self.open_streams = 0
+        app.config['LIVE_EVENTS'] = True
+        mail_workers = app.config.get('ASGI_MAIL_OUTBOX_WORKERS', 2)
+        if mail_workers > outbox.workers:
+            outbox.start(mail_workers)
+        app.extensions['asgi'] = self
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            body = await self._read_body(receive)
+            if body is not None:
+                await self._respond(self._environ(scope, body), receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        """The request body as a file, or None if the client went away while sending it."""
+        body = SpooledTemporaryFile(max_size=1024 * 1024)
+        more = True
+        while more:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            more = message.get('more_body', False)
+        body.seek(0)
+        return body
+
+    def _environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        root_path = scope.get('root_path', '')
+        path = scope['path']
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            # WSGI strings carry the raw bytes as latin-1
+            'SCRIPT_NAME': root_path.encode().decode('latin-1'),
+            'PATH_INFO': path.encode().decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1] or 80),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', ()):
+            name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f'HTTP_{name}'
+            if name in environ:
+                value = f"{environ[name]}{'; ' if name == 'HTTP_COOKIE' else ','}{value}"
+            environ[name] = value
+        # The body is all here, so its length is known even if it came chunked
+        environ['CONTENT_LENGTH'] = str(body.seek(0, 2))
+        body.seek(0)
+        return environ
+
+    async def _respond(self, environ, receive, send):
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(self.send_buffer)
+        gone = threading.Event()
+        watcher = asyncio.ensure_future(self._watch_disconnect(receive, gone))
+        run = loop.run_in_executor(self._executor, self._run, environ, loop, chunks, gone)
+        try:
+            while (message := await chunks.get()) is not _DONE:
+                await send(message)
+            stream = await run
+            if stream is not None:
+                await self._relay(stream, send, watcher)
+            elif not gone.is_set():
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            # Lets the thread stop if we leave early; it checks between chunks
+            gone.set()
+            watcher.cancel()
+
+    def _run(self, environ, loop, chunks, gone):
+        """Runs the WSGI app on a pool thread, queueing ASGI messages for `_respond`.
+
+        Returns the EventStream if the view produced one, for the loop to relay.
+        """
+        def put(message):
+            # Waits while the client is `send_buffer` chunks behind
+            future = asyncio.run_coroutine_threadsafe(chunks.put(message), loop)
+            while True:
+                try:
+                    return future.result(timeout=1)
+                except TimeoutError:
+                    if gone.is_set():
+                        future.cancel()
+                        raise ClientGone()
+
+        head = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and head and head[0] is None:
+                raise exc_info[1].with_traceback(exc_info[2])
+            head[:] = [{
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            }]
+            return write
+
+        def send_head():
+            if head and head[0] is not None:
+                put(head[0])
+                head[0] = None
+
+        def write(data):
+            send_head()
+            put({'type': 'http.response.body', 'body': bytes(data), 'more_body': True})
+
+        iterable = None
+        try:
+            iterable = self.app(environ, start_response)
+            if isinstance(iterable, EventStream):
+                send_head()
+                stream, iterable = iterable, None
+                return stream
+            for data in iterable:
+                if data:
+                    write(data)
+                if gone.is_set():
+                    break
+            send_head()
+        except ClientGone:
+            pass
+        finally:
+            environ['wsgi.input'].close()
+            try:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+            finally:
+                try:
+                    put(_DONE)
+                except (ClientGone, RuntimeError):
+                    # RuntimeError: the loop has already shut down
+                    pass
+
+    async def _relay(self, stream, send, watcher):
+        """Sends an EventStream from the loop until it ends or the client disconnects."""
+        self.open_streams += 1
+        events = stream.__aiter__()
+        try:
+            while True:
+                step = asyncio.ensure_future(events.__anext__())
+                await asyncio.wait((step, watcher), return_when=asyncio.FIRST_COMPLETED)
+                if not step.done():
+                    # The client went away; cancelling the wait ends the generator
+                    step.cancel()
+                    await asyncio.gather(step, return_exceptions=True)
+                    return
+                try:
+                    chunk = step.result()
+                except StopAsyncIteration:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            self.open_streams -= 1
+            await events.aclose()
+            stream.close()
+
+    @staticmethod
+    async def _watch_disconnect(receive, gone):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        gone.set()
+
+    def stats(self):
+        return {'threads': self.threads, 'open_streams': self.open_streams}
@@ -0,0 +1,293 @@
+import math
+import os
+import secrets
+import socket
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy import select, func, or_, bindparam
+from sqlalchemy.exc import IntegrityError
+from project import db
+from project.models import User, Post, BackfillState, make_excerpt, WORDS_PER_MINUTE
+
+# A registered data migration: `apply(conn, lo, hi)` rewrites the rows of `table`
+# whose `key` is in (lo, hi] and returns how many it changed. `revision` is the
+# Alembic revision whose schema it needs, if any.
+Backfill = namedtuple('Backfill', 'name table key apply description revision')
+
+BACKFILLS = {}
+
+
+def backfill(name, table, description, key='id', revision=None):
+    """Registers the decorated function as the batch step of backfill `name`."""
+    def register(apply):
+        BACKFILLS[name] = Backfill(name, table, table.c[key], apply, description, revision)
+        return apply
+    return register
+
+
+def enqueue(conn, name):
+    """Queues backfill `name` for `flask backfill run --pending` unless it is already known.
+
+    For code that runs against a live database. Alembic revisions shouldn't
+    import the app, which changes under them: they insert the row themselves
+    with a `sa.table` of name, status and queued_at (see bf124a6fc977).
+    """
+    states = sa.table('backfill_state', sa.column('name'), sa.column('status'), sa.column('queued_at'))
+    if conn.execute(select(states.c.name).where(states.c.name == name)).first() is None:
+        conn.execute(states.insert().values(name=name, status='pending', queued_at=datetime.utcnow()))
+
+
+def applied_revisions(conn):
+    """Ids of every Alembic revision the database is at or past, or None if it isn't under Alembic."""
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    heads = MigrationContext.configure(conn).get_current_heads()
+    migrate = current_app.extensions.get('migrate')
+    if not heads or migrate is None or not os.path.isdir(migrate.directory):
+        return None
+    script = ScriptDirectory.from_config(migrate.migrate.get_config(migrate.directory))
+    return {revision.revision for revision in script.iterate_revisions(heads, 'base')}
+
+
+class BackfillJob:
+    """Runs a registered backfill as a series of keyset batches.
+
+    Each batch takes the next `batch_size` keys after the checkpoint, lets the
+    backfill rewrite that key range and moves the checkpoint on, all in one
+    short transaction: a crash loses at most the batch in flight and a rerun
+    carries on from there. Only rows that existed when the run started are
+    visited; rows written later go through the application's own code path.
+
+    A worker owns a backfill through a lease it renews with every checkpoint.
+    A second worker started meanwhile finds the lease held and leaves; one
+    that finds it expired takes over, and the old owner's next checkpoint
+    then fails and rolls its batch back, so no range is committed twice.
+
+    With `dry_run` every batch is applied and rolled back, which reports what
+    a real run would change without writing anything, checkpoint included.
+    """
+
+    def __init__(self, batch_size=1000, pause=0.0, max_rate=None, dry_run=False, lease=60, report_every=5.0,
+                 echo=print):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_rate = max_rate
+        self.dry_run = dry_run
+        self.lease = lease
+        self.report_every = report_every
+        self.echo = echo
+        self.owner = f'{socket.gethostname()[:40]}:{os.getpid()}:{secrets.token_hex(3)}'
+        self.processed = 0
+        self.changed = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def check_schema(self, spec):
+        if spec.revision is None:
+            return
+        with db.engine.connect() as conn:
+            revisions = applied_revisions(conn)
+        if revisions is not None and spec.revision not in revisions:
+            raise RuntimeError(f"{spec.name} needs revision {spec.revision}; run `flask db upgrade` first")
+
+    def _acquire(self, name):
+        """Takes the lease on `name`. Returns its state row, or None if it is done or leased elsewhere."""
+        try:
+            with db.engine.begin() as conn:
+                enqueue(conn, name)
+        except IntegrityError:
+            pass  # another worker queued it at the same moment
+        states = BackfillState.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            taken = conn.execute(
+                states.update()
+                .where(states.c.name == name, states.c.status != 'done',
+                       or_(states.c.owner.is_(None), states.c.lease_until < now))
+                .values(owner=self.owner, lease_until=now + timedelta(seconds=self.lease), status='running',
+                        error=None, started_at=func.coalesce(states.c.started_at, now), updated_at=now)
+            ).rowcount
+            state = conn.execute(select(states).where(states.c.name == name)).one()
+        return state if taken else None
+
+    def _checkpoint(self, conn, name, hi, scanned, changed):
+        """Moves the checkpoint to `hi` if this worker still holds the lease. Returns False if it doesn't."""
+        states = BackfillState.__table__
+        now = datetime.utcnow()
+        return conn.execute(
+            states.update().where(states.c.name == name, states.c.owner == self.owner).values(
+                last_key=hi, rows_scanned=states.c.rows_scanned + scanned,
+                rows_changed=states.c.rows_changed + changed, batches=states.c.batches + 1,
+                lease_until=now + timedelta(seconds=self.lease), updated_at=now)
+        ).rowcount == 1
+
+    def _finish(self, name, status, error=None):
+        states = BackfillState.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            conn.execute(states.update().where(states.c.name == name, states.c.owner == self.owner).values(
+                status=status, error=error, owner=None, lease_until=None, updated_at=now,
+                finished_at=now if status == 'done' else None))
+
+    def run(self, name):
+        """Runs backfill `name` to the end, or until the lease is lost. Returns True if it finished."""
+        spec = BACKFILLS[name]
+        self.check_schema(spec)
+        if self.dry_run:
+            state = BackfillState.query.filter_by(name=name).first()
+            db.session.remove()
+            return self._loop(spec, state.last_key if state else None)
+        state = self._acquire(name)
+        if state is None:
+            current = BackfillState.query.filter_by(name=name).one()
+            db.session.remove()
+            if current.status == 'done':
+                self.echo(f"{name}: already done.")
+            else:
+                self.echo(f"{name}: held by {current.owner} until {current.lease_until:%H:%M:%S}; not starting.")
+            return False
+        if state.last_key is not None:
+            self.echo(f"{name}: resuming after key {state.last_key} ({state.rows_scanned} rows already scanned).")
+        try:
+            finished = self._loop(spec, state.last_key)
+        except Exception as e:
+            self._finish(name, 'failed', str(e)[:255])
+            raise
+        if finished:
+            self._finish(name, 'done')
+        return finished
+
+    def _loop(self, spec, last_key):
+        key = spec.key
+        with db.engine.connect() as conn:
+            first, upper = conn.execute(select(func.min(key), func.max(key))).one()
+        if upper is None or (last_key is not None and last_key >= upper):
+            self.echo(f"{spec.name}: nothing left to do.")
+            return True
+        lo = last_key if last_key is not None else first - 1
+        start_key, run_start, last_report = lo, time.perf_counter(), time.perf_counter()
+        # This backfill's own counts; self.processed and self.changed span every backfill the job runs
+        scanned = changed_total = 0
+        keys_query = (select(key).where(key > bindparam('lo'), key <= upper)
+                      .order_by(key).limit(self.batch_size))
+        while True:
+            start = time.perf_counter()
+            with db.engine.connect() as conn:
+                transaction = conn.begin()
+                keys = conn.execute(keys_query, {'lo': lo}).scalars().all()
+                if not keys:
+                    transaction.rollback()
+                    break
+                hi = keys[-1]
+                changed = spec.apply(conn, lo, hi)
+                if self.dry_run:
+                    transaction.rollback()
+                elif not self._checkpoint(conn, spec.name, hi, len(keys), changed):
+                    transaction.rollback()
+                    self.echo(f"{spec.name}: lease lost to another worker at key {lo}; stopping.")
+                    return False
+                else:
+                    transaction.commit()
+            self.elapsed += time.perf_counter() - start
+            self.processed += len(keys)
+            self.changed += changed
+            scanned += len(keys)
+            changed_total += changed
+            lo = hi
+            now = time.perf_counter()
+            if now - last_report >= self.report_every or len(keys) < self.batch_size:
+                last_report = now
+                self._report(spec.name, start_key, lo, upper, now - run_start, scanned, changed_total)
+            if len(keys) < self.batch_size:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+            if self.max_rate:
+                # Sleep off any lead over the allowed rows/s, measured over the whole run
+                ahead = scanned / self.max_rate - (time.perf_counter() - run_start)
+                if ahead > 0:
+                    time.sleep(ahead)
+        return True
+
+    def _report(self, name, start_key, key, upper, wall, scanned, changed):
+        done = (key - start_key) / (upper - start_key) if upper > start_key else 1.0
+        rate = scanned / wall if wall else 0.0
+        eta = wall * (1 - done) / done if done else 0.0
+        verb = 'would change' if self.dry_run else 'changed'
+        self.echo(f"{name}: {done:.0%} (key {key} of {upper}), {scanned} scanned, "
+                  f"{changed} {verb}, {rate:.0f} rows/s, ~{eta:.0f}s left")
+
+
+def reset(name, force=False):
+    """Puts backfill `name` back to the start. Refuses while a live lease is held unless `force`."""
+    states = BackfillState.__table__
+    query = states.update().where(states.c.name == name)
+    if not force:
+        query = query.where(or_(states.c.owner.is_(None), states.c.lease_until < datetime.utcnow()))
+    with db.engine.begin() as conn:
+        return conn.execute(query.values(
+            status='pending', last_key=None, rows_scanned=0, rows_changed=0, batches=0, owner=None,
+            lease_until=None, error=None, started_at=None, finished_at=None, updated_at=datetime.utcnow())
+        ).rowcount == 1
+
+
+# Registered backfills. Each one must be safe to run twice: a batch rolled back
+# by a crash or a lost lease is simply done again.
+
+@backfill('post_reading_stats', Post.__table__, 'Excerpt, word count and reading time for posts that have none.',
+          revision='89061d1142c6')
+def post_reading_stats(conn, lo, hi):
+    post = Post.__table__
+    rows = conn.execute(select(post.c.id, post.c.body)
+                        .where(post.c.id > lo, post.c.id <= hi, post.c.excerpt.is_(None))).all()
+    if not rows:
+        return 0
+    params = []
+    for row in rows:
+        body = row.body or ''
+        words = len(body.split())
+        params.append({'b_id': row.id, 'b_excerpt': make_excerpt(body), 'b_words': words,
+                       'b_minutes': max(1, math.ceil(words / WORDS_PER_MINUTE))})
+    conn.execute(post.update().where(post.c.id == bindparam('b_id')).values(
+        excerpt=bindparam('b_excerpt'), word_count=bindparam('b_words'), reading_time=bindparam('b_minutes')), params)
+    return len(rows)
+
+
+@backfill('lowercase_emails', User.__table__,
+          'Lowercase stored emails; addresses that would collide with another account are left for review.')
+def lowercase_emails(conn, lo, hi):
+    user = User.__table__
+    rows = conn.execute(select(user.c.id, user.c.email)
+                        .where(user.c.id > lo, user.c.id <= hi, user.c.email != func.lower(user.c.email))).all()
+    if not rows:
+        return 0
+    # One lookup per batch rather than a correlated EXISTS per row; there is no index on lower(email)
+    lowered = {row.id: row.email.lower() for row in rows}
+    taken = conn.execute(select(user.c.id, func.lower(user.c.email))
+                         .where(func.lower(user.c.email).in_(set(lowered.values())))).all()
+    owners = {}
+    for user_id, email in taken:
+        owners.setdefault(email, set()).add(user_id)
+    params = [{'b_id': user_id, 'b_email': email} for user_id, email in lowered.items() if owners[email] == {user_id}]
+    if params:
+        conn.execute(user.update().where(user.c.id == bindparam('b_id')).values(email=bindparam('b_email')), params)
+    return len(params)
+
+
+@backfill('verify_legacy_users', User.__table__,
+          'Mark accounts created before email verification existed (is_verified NULL) as verified.')
+def verify_legacy_users(conn, lo, hi):
+    # migrate_email_verification.py verified every user once, right after adding
+    # the column. Run later, that would also verify new accounts that never
+    # confirmed their address, so only rows the column was added to are touched.
+    user = User.__table__
+    return conn.execute(user.update().where(user.c.id > lo, user.c.id <= hi, user.c.is_verified.is_(None))
+                        .values(is_verified=True)).rowcount
@@ -0,0 +1,331 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+notifications_cli = AppGroup('notifications', help='Notification maintenance jobs.')
+contacts_cli = AppGroup('contacts', help='Share-recipient ranking maintenance.')
+suggestions_cli = AppGroup('suggestions', help='Who-to-follow suggestions.')
+purge_cli = AppGroup('purge', help='Removal of deleted users and posts.')
+drafts_cli = AppGroup('drafts', help='Unpublished post drafts.')
+data_cli = AppGroup('data', help='Export and bulk import.')
+backfill_cli = AppGroup('backfill', help='Batched, resumable data migrations.')
+passwords_cli = AppGroup('passwords', help='Password hashing parameters.')
+oidc_cli = AppGroup('oidc', help='Cached OpenID Connect metadata for Google sign-in.')
+
+
+@notifications_cli.command('prune')
+@click.option('--days', type=int, default=None, help='Remove read notifications older than this many days.')
+@click.option('--unread-cap', type=int, default=None, help='Keep at most this many unread notifications per user.')
+@click.option('--batch-size', type=int, default=1000, show_default=True, help='Rows per transaction.')
+@click.option('--pause', type=float, default=0.0, show_default=True, help='Seconds to sleep between batches.')
+@click.option('--archive/--delete', default=False, help='Copy rows to notification_archive instead of only deleting them.')
+def prune_notifications(days, unread_cap, batch_size, pause, archive):
+    """Apply the notification retention policy in bounded batches."""
+    from project.retention import RetentionJob
+
+    days = days if days is not None else current_app.config['NOTIFICATION_RETENTION_DAYS']
+    unread_cap = unread_cap if unread_cap is not None else current_app.config['NOTIFICATION_UNREAD_CAP']
+
+    job = RetentionJob(batch_size=batch_size, archive=archive, pause=pause, echo=click.echo)
+    pruned = job.prune_read(days)
+    compacted = job.compact_unread(unread_cap) if unread_cap > 0 else 0
+
+    action = 'archived' if archive else 'deleted'
+    click.echo(f"Done: {pruned} read notifications older than {days} days {action}, "
+               f"{compacted} unread beyond {unread_cap} per user compacted. "
+               f"{job.processed} rows in {job.elapsed:.2f}s ({job.rate:.0f} rows/s).")
+
+
+@contacts_cli.command('rebuild')
+def rebuild_contacts():
+    """Recompute every user's frequent-contacts ranking from the message table."""
+    from project import db
+    from project.models import ContactScore
+
+    try:
+        rows = ContactScore.rebuild()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Failed to rebuild contact ranking: {e}")
+    click.echo(f"Done: {rows} contact pairs ranked.")
+
+
+@suggestions_cli.command('build')
+@click.option('--top-k', type=int, default=20, show_default=True, help='Suggestions kept per user.')
+@click.option('--block-size', type=int, default=2000, show_default=True, help='Users scored per matrix block.')
+@click.option('--follow-weight', type=float, default=1.0, show_default=True, help='Weight of each mutual follow.')
+@click.option('--like-weight', type=float, default=0.25, show_default=True, help='Weight of each post liked by both.')
+@click.option('--max-likers', type=int, default=5000, show_default=True, help='Ignore posts liked by more users than this.')
+def build_suggestions(top_k, block_size, follow_weight, like_weight, max_likers):
+    """Rebuild friends-of-friends and co-like suggestions for every user."""
+    from project.suggestions import SuggestionJob
+
+    try:
+        job = SuggestionJob(top_k=top_k, block_size=block_size, follow_weight=follow_weight,
+                            like_weight=like_weight, max_likers=max_likers, echo=click.echo)
+        written = job.run()
+    except Exception as e:
+        raise click.ClickException(f"Failed to build suggestions: {e}")
+    timings = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in job.timings.items())
+    click.echo(f"Done: {written} suggestions written ({timings}).")
+
+
+@purge_cli.command('run')
+@click.option('--batch-size', type=int, default=None, help='Rows per transaction (default PURGE_BATCH_SIZE).')
+@click.option('--pause', type=float, default=0.0, show_default=True, help='Seconds to sleep between batches.')
+@click.option('--limit', type=int, default=None, help='Stop after this many users/posts.')
+@click.option('--retry-failed', is_flag=True, help='Also retry tasks that stopped with an error.')
+def run_purge(batch_size, pause, limit, retry_failed):
+    """Purge soft-deleted users and posts, resuming any half-finished task."""
+    from project import db
+    from project.models import PurgeTask
+    from project.purge import PurgeJob
+
+    if retry_failed:
+        PurgeTask.query.filter(PurgeTask.finished_at.is_(None), PurgeTask.error.isnot(None)).update({PurgeTask.error: None})
+        db.session.commit()
+    batch_size = batch_size or current_app.config['PURGE_BATCH_SIZE']
+    job = PurgeJob(batch_size=batch_size, pause=pause, echo=click.echo)
+    finished = job.run_pending(limit=limit)
+    click.echo(f"Done: {finished} purged, {job.processed} rows in {job.elapsed:.2f}s ({job.rate:.0f} rows/s).")
+
+
+@purge_cli.command('status')
+def purge_status():
+    """List purge tasks that have not finished."""
+    from project.models import PurgeTask
+    from project.purge import STEPS
+
+    tasks = PurgeTask.query.filter(PurgeTask.finished_at.is_(None)).order_by(PurgeTask.id).all()
+    if not tasks:
+        click.echo("Nothing to purge.")
+    for task in tasks:
+        steps = STEPS[task.kind](task.target_id)
+        stage = steps[task.stage].label if task.stage < len(steps) else 'finishing'
+        state = f"failed: {task.error}" if task.error else f"step {task.stage + 1}/{len(steps)} ({stage})"
+        click.echo(f"{task.kind} {task.target_id}: {state}, {task.rows_deleted} rows removed, queued {task.created_at:%Y-%m-%d %H:%M}")
+
+
+@drafts_cli.command('prune')
+@click.option('--days', type=int, default=None, help='Remove anonymous drafts untouched for this many days.')
+@click.option('--batch-size', type=int, default=1000, show_default=True, help='Rows per transaction.')
+def prune_drafts(days, batch_size):
+    """Delete anonymous drafts that were never claimed by logging in."""
+    from datetime import datetime, timedelta
+    from project import db
+    from project.models import Draft
+
+    days = days if days is not None else current_app.config['DRAFT_RETENTION_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    stale = db.select(Draft.id).where(Draft.user_id.is_(None), Draft.updated_at < cutoff).limit(batch_size)
+    removed = 0
+    while True:
+        ids = db.session.execute(stale).scalars().all()
+        if not ids:
+            break
+        removed += Draft.query.filter(Draft.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+    click.echo(f"Done: {removed} anonymous drafts older than {days} days deleted.")
+
+
+@data_cli.command('export')
+@click.option('--user', 'username', default=None, help='Export one user (personal export, no password hash).')
+@click.option('--all', 'everything', is_flag=True, help='Export the whole instance, password hashes included.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), required=True, help='File to write.')
+@click.option('--zip', 'as_zip', is_flag=True, help='Write a zip archive holding the NDJSON.')
+@click.option('--chunk-size', type=int, default=1000, show_default=True, help='Rows fetched per round trip.')
+def export_data(username, everything, output, as_zip, chunk_size):
+    """Stream an NDJSON export of one user or of every live user."""
+    import time
+    from project.export import export_lines, zip_stream
+    from project.models import User
+
+    if bool(username) == everything:
+        raise click.UsageError("Pass exactly one of --user or --all.")
+    user_id = None
+    if username:
+        user = User.live().filter_by(username=username).first()
+        if user is None:
+            raise click.ClickException(f"User {username} not found.")
+        user_id = user.id
+    start = time.perf_counter()
+    lines = export_lines(user_id, include_secrets=everything, chunk_size=chunk_size)
+    written = 0
+    try:
+        with open(output, 'wb') as f:
+            for chunk in (zip_stream(lines) if as_zip else lines):
+                f.write(chunk)
+                written += len(chunk)
+    except Exception as e:
+        raise click.ClickException(f"Failed to export: {e}")
+    click.echo(f"Done: {written / 2**20:.1f} MiB written to {output} in {time.perf_counter() - start:.2f}s.")
+
+
+@data_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', type=int, default=5000, show_default=True, help='Rows per executemany/COPY.')
+def import_data(path, chunk_size):
+    """Load an export (NDJSON or zip) into an empty instance, keeping ids."""
+    import time
+    from project.export import ImportJob, read_records
+
+    start = time.perf_counter()
+    job = ImportJob(chunk_size=chunk_size, echo=click.echo)
+    try:
+        with open(path, 'rb') as f:
+            counts = job.run(read_records(f))
+    except Exception as e:
+        raise click.ClickException(f"Failed to import: {e}")
+    total = sum(counts.values())
+    elapsed = time.perf_counter() - start
+    click.echo(f"Done: {total} rows in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} rows/s). "
+               f"Run `flask contacts rebuild` and `flask suggestions build` to refresh derived tables.")
+
+
+@backfill_cli.command('run')
+@click.argument('names', nargs=-1)
+@click.option('--pending', is_flag=True, help='Run every queued or interrupted backfill, oldest first.')
+@click.option('--batch-size', type=int, default=None, help='Keys per transaction (default BACKFILL_BATCH_SIZE).')
+@click.option('--pause', type=float, default=None, help='Seconds to sleep between batches (default BACKFILL_PAUSE).')
+@click.option('--max-rate', type=int, default=None, help='Scan at most this many rows per second.')
+@click.option('--dry-run', is_flag=True, help='Apply each batch and roll it back; nothing is written.')
+def run_backfill(names, pending, batch_size, pause, max_rate, dry_run):
+    """Run backfills by name, resuming from their last checkpoint.
+
+    Deploys run `flask db upgrade` and then `flask backfill run --pending` for
+    the data changes the new revisions queued.
+    """
+    from project.backfill import BACKFILLS, BackfillJob
+    from project.models import BackfillState
+
+    if pending:
+        queued = (BackfillState.query.filter(BackfillState.status.in_(('pending', 'running')))
+                  .order_by(BackfillState.queued_at, BackfillState.id).all())
+        names = tuple(names) + tuple(state.name for state in queued if state.name not in names)
+    unknown = [name for name in names if name not in BACKFILLS]
+    if unknown:
+        raise click.ClickException(f"Unknown backfill: {', '.join(unknown)}. See `flask backfill status`.")
+    if not names:
+        click.echo("Nothing to run.")
+        return
+    config = current_app.config
+    job = BackfillJob(batch_size=batch_size or config['BACKFILL_BATCH_SIZE'],
+                      pause=config['BACKFILL_PAUSE'] if pause is None else pause,
+                      max_rate=max_rate, dry_run=dry_run, lease=config['BACKFILL_LEASE'], echo=click.echo)
+    for name in names:
+        try:
+            job.run(name)
+        except Exception as e:
+            raise click.ClickException(f"Failed to run backfill {name}: {e}")
+    verb = 'would change' if dry_run else 'changed'
+    click.echo(f"Done: {job.processed} rows scanned, {job.changed} {verb} in {job.elapsed:.2f}s "
+               f"({job.rate:.0f} rows/s).")
+
+
+@backfill_cli.command('status')
+def backfill_status():
+    """List registered backfills and where each one stands."""
+    from project.backfill import BACKFILLS
+    from project.models import BackfillState
+
+    states = {state.name: state for state in BackfillState.query.all()}
+    for name in sorted(set(BACKFILLS) | set(states)):
+        spec, state = BACKFILLS.get(name), states.get(name)
+        if state is None:
+            line = 'not run'
+        else:
+            line = f"{state.status}, {state.rows_scanned} scanned, {state.rows_changed} changed"
+            if state.last_key is not None and state.status != 'done':
+                line += f", checkpoint at key {state.last_key}"
+            if state.owner:
+                line += f", leased by {state.owner} until {state.lease_until:%H:%M:%S}"
+            if state.error:
+                line += f": {state.error}"
+        click.echo(f"{name}: {line}")
+        click.echo(f"    {spec.description if spec else '(no longer registered)'}")
+
+
+@backfill_cli.command('reset')
+@click.argument('name')
+@click.option('--force', is_flag=True, help='Reset even if a worker holds a live lease.')
+def reset_backfill(name, force):
+    """Forget a backfill's checkpoint so the next run starts from the first key."""
+    from project.backfill import reset
+
+    if reset(name, force=force):
+        click.echo(f"{name} reset.")
+    else:
+        click.echo(f"{name} is unknown or running; pass --force to reset it anyway.")
+
+
+@passwords_cli.command('calibrate')
+@click.option('--target-ms', default=250, show_default=True, help='How long one hash should take on this host.')
+@click.option('--algorithm', type=click.Choice(['scrypt', 'pbkdf2']), default='scrypt', show_default=True)
+def calibrate_passwords(target_ms, algorithm):
+    """Time the KDF on this host and suggest a PASSWORD_HASH_METHOD.
+
+    Run it on the production hardware. Existing hashes are replaced with the
+    new method as their owners log in.
+    """
+    from project.passwords import hasher, calibrate
+
+    click.echo(f"Timing {algorithm} against a {target_ms} ms target:")
+    method, elapsed = calibrate(target_ms / 1000, algorithm, echo=click.echo)
+    if elapsed > target_ms / 1000 * 2:
+        click.echo("Even the minimum strength takes well over the target on this host; using the minimum.")
+    workers = current_app.config['PASSWORD_HASH_WORKERS']
+    click.echo(f"\nPASSWORD_HASH_METHOD={method}")
+    click.echo(f"~{elapsed * 1000:.0f} ms per hash, so at most ~{workers / elapsed:.0f} logins/s "
+               f"with PASSWORD_HASH_WORKERS={workers}.")
+    if method == hasher.method:
+        click.echo("This is the method already in use.")
+    else:
+        click.echo(f"Currently {hasher.method}.")
+
+
+@passwords_cli.command('status')
+def password_status():
+    """Count stored hashes per method, to see how far a rehash has got."""
+    from project import db
+    from project.models import User
+    from project.passwords import hasher
+
+    counts = {}
+    for (pwhash,) in db.session.execute(db.select(User.password_hash)).yield_per(1000):
+        method = pwhash.split('$', 1)[0] if pwhash else '(no password)'
+        counts[method] = counts.get(method, 0) + 1
+    for method, count in sorted(counts.items(), key=lambda item: -item[1]):
+        marker = ' (current)' if method == hasher.method else ''
+        click.echo(f"{count:8d}  {method}{marker}")
+
+
+@oidc_cli.command('refresh')
+def refresh_oidc():
+    """Fetch Google's discovery document and signing keys into the on-disk cache.
+
+    Run it as a build or deploy step so new instances start with a warm cache.
+    """
+    from project import oauth
+    from project.oidc import oidc_cache
+
+    client = oauth.create_client('google')
+    try:
+        metadata = client.load_server_metadata(reload=True)
+        keys = client.fetch_jwk_set(reload=True)
+    except Exception as e:
+        raise click.ClickException(f"Failed to refresh OIDC cache: {e}")
+    click.echo(f"Cached metadata for {metadata.get('issuer')} and {len(keys.get('keys', []))} signing keys "
+               f"in {oidc_cache.directory}.")
+
+
+def register_commands(app):
+    app.cli.add_command(notifications_cli)
+    app.cli.add_command(contacts_cli)
+    app.cli.add_command(suggestions_cli)
+    app.cli.add_command(purge_cli)
+    app.cli.add_command(drafts_cli)
+    app.cli.add_command(data_cli)
+    app.cli.add_command(backfill_cli)
+    app.cli.add_command(passwords_cli)
+    app.cli.add_command(oidc_cli)
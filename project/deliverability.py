@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import dns.resolver
+from email_validator import EmailUndeliverableError
+from email_validator.deliverability import validate_email_deliverability
+
+from project import db
+
+# What a lookup found out about a domain: `ok` is False with a user-facing
+# `reason` when it can't receive mail. Kept until `expires` (time.monotonic()).
+Verdict = namedtuple('Verdict', 'ok reason expires')
+
+
+class DeliverabilityCache:
+    """Domain-level cache in front of the MX lookups behind email validation.
+
+    Registration and email changes ask `check(domain)` instead of resolving
+    on every submission. Domains that accept mail are remembered for
+    `positive_ttl` seconds, ones that don't for `negative_ttl`, at most
+    `max_entries` of them (least recently used go first). Lookups run on a
+    small pool with one lookup per domain in flight however many forms ask
+    at once; a form waits at most `budget` seconds and then lets the address
+    through as unknown while the lookup finishes and fills the cache. DNS
+    errors and timeouts are never cached.
+
+    The first registration or settings page a worker serves starts a
+    background lookup of the `prewarm` most common domains among existing
+    users, so typical addresses never wait on DNS at all.
+    """
+
+    def __init__(self, app=None):
+        self._app = None
+        self.enabled = True
+        self.positive_ttl = 86400
+        self.negative_ttl = 600
+        self.max_entries = 10000
+        self.budget = 2.0
+        self.prewarm = 200
+        self.resolver = None
+        self._verdicts = OrderedDict()
+        self._pending = {}  # domain -> Future of the lookup in flight
+        self._lock = threading.Lock()
+        self._executor = None
+        self._warming = False
+        self._stats = Counter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('EMAIL_CHECK_DELIVERABILITY', True)
+        self.positive_ttl = app.config.get('EMAIL_DOMAIN_TTL', 86400)
+        self.negative_ttl = app.config.get('EMAIL_DOMAIN_NEGATIVE_TTL', 600)
+        self.max_entries = app.config.get('EMAIL_DOMAIN_CACHE_SIZE', 10000)
+        self.budget = app.config.get('EMAIL_DNS_BUDGET', 2.0)
+        self.prewarm = app.config.get('EMAIL_DOMAIN_PREWARM', 200)
+        self.resolver = dns.resolver.Resolver(configure=not app.config.get('EMAIL_DNS_NAMESERVERS'))
+        if app.config.get('EMAIL_DNS_NAMESERVERS'):
+            self.resolver.nameservers = app.config['EMAIL_DNS_NAMESERVERS']
+        self.resolver.lifetime = app.config.get('EMAIL_DNS_TIMEOUT', 5.0)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(app.config.get('EMAIL_DNS_WORKERS', 8), thread_name_prefix='email-dns')
+        self.clear()
+        app.extensions['deliverability'] = self
+        self._app = app
+
+    def _cached(self, domain):
+        with self._lock:
+            verdict = self._verdicts.get(domain)
+            if verdict is None:
+                return None
+            if verdict.expires <= time.monotonic():
+                del self._verdicts[domain]
+                return None
+            self._verdicts.move_to_end(domain)
+            return verdict
+
+    def _store(self, domain, verdict):
+        with self._lock:
+            self._verdicts[domain] = verdict
+            self._verdicts.move_to_end(domain)
+            while len(self._verdicts) > self.max_entries:
+                self._verdicts.popitem(last=False)
+
+    def _resolve(self, domain, domain_i18n):
+        try:
+            info = validate_email_deliverability(domain, domain_i18n, dns_resolver=self.resolver)
+        except EmailUndeliverableError as e:
+            verdict = Verdict(False, str(e), time.monotonic() + self.negative_ttl)
+        except Exception as e:
+            print(f"Failed to check mail domain {domain}: {e}")
+            verdict = None
+        else:
+            # The resolver timed out or failed: unknown, not undeliverable
+            verdict = None if info.get('unknown-deliverability') else Verdict(True, None, time.monotonic() + self.positive_ttl)
+        if verdict is not None:
+            self._store(domain, verdict)
+        return verdict
+
+    def _lookup(self, domain, domain_i18n):
+        """The in-flight lookup for `domain`, starting one if there is none."""
+        with self._lock:
+            future = self._pending.get(domain)
+            if future is not None:
+                self._stats['joined'] += 1
+                return future
+            future = self._executor.submit(self._resolve, domain, domain_i18n)
+            self._pending[domain] = future
+        # Outside the lock: a lookup that already finished runs the callback right here
+        future.add_done_callback(lambda _: self._done(domain, future))
+        return future
+
+    def _done(self, domain, future):
+        with self._lock:
+            if self._pending.get(domain) is future:
+                del self._pending[domain]
+
+    def check(self, domain, domain_i18n=None):
+        """The Verdict for `domain` (ASCII form), or None if it couldn't be settled within the budget."""
+        domain = domain.lower()
+        verdict = self._cached(domain)
+        if verdict is not None:
+            self._stats['hits'] += 1
+            return verdict
+        self._stats['misses'] += 1
+        try:
+            return self._lookup(domain, domain_i18n or domain).result(self.budget)
+        except TimeoutError:
+            self._stats['over_budget'] += 1
+            return None
+
+    def warm(self, domains):
+        """Looks up every domain not already cached, in parallel, and waits for them. Returns how many are cached."""
+        futures = [self._lookup(domain, domain) for domain in domains if self._cached(domain) is None]
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+        return sum(1 for domain in domains if self._cached(domain) is not None)
+
+    def common_domains(self, limit):
+        from project.models import User
+        email = User.__table__.c.email
+        if db.engine.dialect.name == 'postgresql':
+            domain = db.func.split_part(email, '@', 2)
+        else:
+            domain = db.func.substr(email, db.func.instr(email, '@') + 1)
+        domain = db.func.lower(domain)
+        rows = db.session.execute(db.select(domain).where(email.contains('@'))
+                                  .group_by(domain).order_by(db.func.count().desc()).limit(limit))
+        return [row[0] for row in rows if row[0]]
+
+    def ensure_warm(self):
+        """Starts the background pre-warm once per process."""
+        if not self.enabled or not self.prewarm or self._warming:
+            return
+        self._warming = True
+        threading.Thread(target=self._warm_from_users, daemon=True).start()
+
+    def _warm_from_users(self):
+        try:
+            with self._app.app_context():
+                domains = self.common_domains(self.prewarm)
+                db.session.remove()
+            start = time.perf_counter()
+            cached = self.warm(domains)
+            print(f"Pre-warmed {cached} of {len(domains)} mail domains in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            print(f"Failed to pre-warm mail domains: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._verdicts.clear()
+            self._stats.clear()
+        self._warming = False
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._verdicts)
+            undeliverable = sum(1 for verdict in self._verdicts.values() if not verdict.ok)
+        return {'cached': cached, 'undeliverable': undeliverable, 'pending': len(self._pending), **self._stats}
+
+
+deliverability = DeliverabilityCache()
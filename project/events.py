@@ -0,0 +1,322 @@
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, or_
+from project import db
+
+Event = namedtuple('Event', 'id channel event data')
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class Subscription:
+    """One open stream. Holds a bounded queue so a stalled client can't grow memory."""
+
+    def __init__(self, broker, channels, maxlen=200):
+        self.broker = broker
+        self.channels = set(channels)
+        self._queue = deque(maxlen=maxlen)
+        self._ready = threading.Event()
+        self._waiter = None  # (loop, asyncio.Event) while get_async() waits
+
+    def put(self, event):
+        self._queue.append(event)
+        self._ready.set()
+        waiter = self._waiter
+        if waiter is not None:
+            loop, ready = waiter
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                pass  # the loop closed while the stream was waiting
+
+    def get(self, timeout):
+        """Returns the next event, or None if nothing arrived within `timeout` seconds."""
+        if not self._queue:
+            self._ready.wait(timeout)
+        self._ready.clear()
+        try:
+            return self._queue.popleft()
+        except IndexError:
+            return None
+
+    async def get_async(self, timeout):
+        """get() for the event loop: waits without holding a thread."""
+        if not self._queue:
+            ready = asyncio.Event()
+            self._waiter = (asyncio.get_running_loop(), ready)
+            try:
+                if not self._queue:  # put() may have run before the waiter was set
+                    await asyncio.wait_for(ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiter = None
+        self._ready.clear()
+        try:
+            return self._queue.popleft()
+        except IndexError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class MemoryBackend:
+    """Single-process backend. Keeps the last `history` events per channel for resume."""
+
+    def __init__(self, broker, history=100):
+        self.broker = broker
+        self.history = history
+        self._rings = defaultdict(deque)
+        self._evicted = {}  # channel -> id of the newest event that fell out of history
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event, data):
+        with self._lock:
+            ev = Event(self._next_id, channel, event, data)
+            self._next_id += 1
+            ring = self._rings[channel]
+            ring.append(ev)
+            if len(ring) > self.history:
+                self._evicted[channel] = ring.popleft().id
+        self.broker.dispatch(ev)
+
+    def replay(self, channels, last_event_id):
+        """Returns (events, complete). `complete` is False if some events already fell out of history."""
+        with self._lock:
+            events, complete = [], True
+            for channel in channels:
+                if self._evicted.get(channel, 0) > last_event_id:
+                    complete = False
+                events.extend(ev for ev in self._rings.get(channel, ()) if ev.id > last_event_id)
+        return sorted(events), complete
+
+    def start(self):
+        pass
+
+
+class DatabaseBackend:
+    """Shares events between workers through the stream_event table.
+
+    Publishing is one INSERT. Each process runs a single poller thread that
+    reads new rows and fans them out to its local subscribers, so the number
+    of open streams does not change the number of queries.
+
+    Ids are handed out when a row is inserted, not when it commits, so on
+    Postgres a row can become visible after one with a higher id. An id the
+    poller skips over is asked for again on each poll for up to `gap_wait`
+    seconds. Cleanup always keeps the newest row, so SQLite never hands out
+    an id again once the table is emptied.
+    """
+
+    MAX_GAPS = 1000
+
+    def __init__(self, broker, app, poll_interval=0.5, retention=timedelta(minutes=10), gap_wait=10.0):
+        self.broker = broker
+        self.app = app
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.gap_wait = gap_wait
+        self._last_id = None
+        self._gaps = {}  # skipped id -> when it was first missed
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event, data):
+        from project.models import StreamEvent
+        with db.engine.begin() as conn:
+            conn.execute(StreamEvent.__table__.insert().values(
+                channel=channel, event=event, data=json.dumps(data), created_at=datetime.utcnow()))
+        self.start()
+
+    def replay(self, channels, last_event_id):
+        from project.models import StreamEvent
+        table = StreamEvent.__table__
+        with db.engine.connect() as conn:
+            oldest = conn.execute(select(table.c.id).order_by(table.c.id).limit(1)).scalar()
+            rows = conn.execute(
+                select(table).where(table.c.channel.in_(channels), table.c.id > last_event_id).order_by(table.c.id)
+            ).all()
+        complete = oldest is None or oldest <= last_event_id + 1
+        return [Event(r.id, r.channel, r.event, json.loads(r.data)) for r in rows], complete
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._poll_loop, daemon=True)
+            self._thread.start()
+
+    def _poll_loop(self):
+        from project.models import StreamEvent
+        table = StreamEvent.__table__
+        last_cleanup = 0.0
+        while True:
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as conn:
+                        if self._last_id is None:
+                            self._last_id = conn.execute(select(db.func.max(table.c.id))).scalar() or 0
+                        rows = conn.execute(
+                            select(table).where(or_(table.c.id > self._last_id, table.c.id.in_(list(self._gaps))))
+                            .order_by(table.c.id).limit(500)
+                        ).all()
+                        if time.monotonic() - last_cleanup > 60:
+                            newest = select(db.func.max(table.c.id)).scalar_subquery()
+                            conn.execute(table.delete().where(table.c.created_at < datetime.utcnow() - self.retention,
+                                                              table.c.id < newest))
+                            last_cleanup = time.monotonic()
+                now = time.monotonic()
+                for r in rows:
+                    if self._gaps.pop(r.id, None) is None:
+                        for missing in range(max(self._last_id + 1, r.id - self.MAX_GAPS), r.id):
+                            self._gaps[missing] = now
+                        self._last_id = r.id
+                    self.broker.dispatch(Event(r.id, r.channel, r.event, json.loads(r.data)))
+                # Given up on: rolled back, or committed too late to be worth delivering
+                for missing in [i for i, missed_at in self._gaps.items() if now - missed_at > self.gap_wait]:
+                    del self._gaps[missing]
+            except Exception as e:
+                print(f"Event poller error: {e}")
+            time.sleep(self.poll_interval)
+
+
+class EventBroker:
+    """In-process pub/sub for the /events stream.
+
+    The backend decides how events travel between processes:
+    'memory' for a single worker, 'database' when several workers must see
+    each other's events.
+    """
+
+    def __init__(self, app=None):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self.backend = MemoryBackend(self)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config.get('EVENT_BACKEND') == 'database':
+            self.backend = DatabaseBackend(self, app, poll_interval=app.config.get('EVENT_POLL_INTERVAL', 0.5))
+        else:
+            self.backend = MemoryBackend(self)
+        app.extensions['events'] = self
+
+    def publish(self, channel, event, data):
+        try:
+            self.backend.publish(channel, event, data)
+        except Exception as e:
+            print(f"Failed to publish {event} event: {e}")
+
+    def publish_to_user(self, user_id, event, data):
+        self.publish(user_channel(user_id), event, data)
+
+    def subscribe(self, channels):
+        sub = Subscription(self, channels)
+        with self._lock:
+            for channel in sub.channels:
+                self._subscribers[channel].add(sub)
+        self.backend.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            for channel in sub.channels:
+                subs = self._subscribers.get(channel)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subscribers[channel]
+
+    def dispatch(self, event):
+        with self._lock:
+            subs = list(self._subscribers.get(event.channel, ()))
+        for sub in subs:
+            sub.put(event)
+
+    def replay(self, channels, last_event_id):
+        return self.backend.replay(channels, last_event_id)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({sub for subs in self._subscribers.values() for sub in subs})
+
+
+def format_sse(event):
+    return f"id: {event.id}\nevent: {event.event}\ndata: {json.dumps(event.data)}\n\n"
+
+
+class EventStream:
+    """The body of one /events response, as a plain iterator (WSGI) or an async one (ASGI).
+
+    Starts with the retry hint and any replayed events, then relays live
+    events with a comment line every `heartbeat` seconds of silence, and
+    ends after `max_duration` so EventSource reconnects with Last-Event-ID.
+    Unsubscribes when it ends or the client goes away. Yields bytes, so a
+    response can pass it to the server as is (project.asgi relies on that
+    to recognise it).
+    """
+
+    def __init__(self, subscription, replay, complete, heartbeat, max_duration, retry_ms):
+        self.subscription = subscription
+        self.replay = replay
+        self.complete = complete
+        self.heartbeat = heartbeat
+        self.max_duration = max_duration
+        self.retry_ms = retry_ms
+        self.last_sent = 0
+
+    def _preamble(self):
+        yield f"retry: {self.retry_ms}\n\n".encode()
+        if not self.complete:
+            # Too far behind to resume; the page should reload its state
+            yield b"event: reset\ndata: {}\n\n"
+        for event in self.replay:
+            yield format_sse(event).encode()
+            self.last_sent = event.id
+
+    def _format(self, event):
+        if event is None:
+            return b": ping\n\n"
+        if event.id > self.last_sent:
+            return format_sse(event).encode()
+        return None
+
+    def __iter__(self):
+        try:
+            yield from self._preamble()
+            deadline = time.monotonic() + self.max_duration
+            while time.monotonic() < deadline:
+                chunk = self._format(self.subscription.get(timeout=self.heartbeat))
+                if chunk is not None:
+                    yield chunk
+        finally:
+            self.subscription.close()
+
+    async def __aiter__(self):
+        try:
+            for chunk in self._preamble():
+                yield chunk
+            deadline = time.monotonic() + self.max_duration
+            while time.monotonic() < deadline:
+                chunk = self._format(await self.subscription.get_async(timeout=self.heartbeat))
+                if chunk is not None:
+                    yield chunk
+        finally:
+            self.subscription.close()
+
+    def close(self):
+        # WSGI servers call this when the client disconnects mid-stream
+        self.subscription.close()
+
+
+broker = EventBroker()
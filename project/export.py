@@ -0,0 +1,246 @@
+import csv
+import io
+import json
+import zipfile
+from datetime import datetime
+
+from sqlalchemy import select, or_, case, DateTime
+from project import db
+from project.models import User, Post, Comment, Like, SavedPost, Message, ConversationRead, followers
+
+FORMAT_VERSION = 2
+
+# Version 1 carried a per-message is_read flag instead of conversation_read records
+READABLE_VERSIONS = (1, 2)
+
+# Record types in dependency order: importing them in this order never
+# references a row that hasn't been inserted yet.
+SECTIONS = ('user', 'follow', 'post', 'comment', 'like', 'saved_post', 'message', 'conversation_read')
+
+TABLES = {
+    'user': User.__table__,
+    'follow': followers,
+    'post': Post.__table__,
+    'comment': Comment.__table__,
+    'like': Like.__table__,
+    'saved_post': SavedPost.__table__,
+    'message': Message.__table__,
+    'conversation_read': ConversationRead.__table__,
+}
+
+# Never leaves the instance in a personal export
+SECRET_COLUMNS = {'user': ('password_hash',)}
+
+
+def _filters(kind, user_id):
+    """WHERE clause for one section: a single user's rows, or everything live when user_id is None.
+
+    Soft-deleted users and posts stay in their tables until the purge job
+    runs. The whole-instance export leaves out every row that points at
+    one, so it loads into a database that checks foreign keys.
+    """
+    user, post, edge = User.__table__, Post.__table__, followers
+    comment, like, saved, message = Comment.__table__, Like.__table__, SavedPost.__table__, Message.__table__
+    read = ConversationRead.__table__
+    if user_id is None:
+        live_users = _live_users()
+        live_posts = _live_posts()
+        return {
+            'user': lambda: user.c.deleted_at.is_(None),
+            'follow': lambda: edge.c.follower_id.in_(live_users) & edge.c.followed_id.in_(live_users),
+            'post': lambda: post.c.deleted_at.is_(None) & post.c.user_id.in_(live_users),
+            'comment': lambda: comment.c.post_id.in_(live_posts) & comment.c.user_id.in_(live_users),
+            'like': lambda: like.c.post_id.in_(live_posts) & like.c.user_id.in_(live_users),
+            'saved_post': lambda: saved.c.post_id.in_(live_posts) & saved.c.user_id.in_(live_users),
+            'message': lambda: message.c.sender_id.in_(live_users) & message.c.recipient_id.in_(live_users),
+            'conversation_read': lambda: read.c.user_id.in_(live_users) & read.c.contact_id.in_(live_users),
+        }[kind]()
+    return {
+        'user': lambda: user.c.id == user_id,
+        'follow': lambda: edge.c.follower_id == user_id,
+        'post': lambda: (post.c.user_id == user_id) & post.c.deleted_at.is_(None),
+        'comment': lambda: comment.c.user_id == user_id,
+        'like': lambda: like.c.user_id == user_id,
+        'saved_post': lambda: saved.c.user_id == user_id,
+        'message': lambda: or_(message.c.sender_id == user_id, message.c.recipient_id == user_id),
+        'conversation_read': lambda: read.c.user_id == user_id,
+    }[kind]()
+
+
+def _live_users():
+    user = User.__table__
+    return select(user.c.id).where(user.c.deleted_at.is_(None))
+
+
+def _live_posts():
+    # Same rows as the 'post' section exports
+    post = Post.__table__
+    return select(post.c.id).where(post.c.deleted_at.is_(None), post.c.user_id.in_(_live_users()))
+
+
+def _live_column(column):
+    """For the whole-instance export: a message that shared a post that is gone keeps its text, minus the link."""
+    if column is Message.__table__.c.shared_post_id:
+        return case((column.in_(_live_posts()), column), else_=None).label(column.name)
+    return column
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def export_lines(user_id=None, include_secrets=False, chunk_size=1000):
+    """Yields the export as NDJSON lines (bytes): a header, then one record per row.
+
+    Rows are read through a server-side cursor `chunk_size` at a time and
+    written out as they arrive, so memory stays flat however much there is.
+    Pass user_id=None for the whole instance.
+    """
+    encode = json.JSONEncoder(default=_json_default, separators=(',', ':'), ensure_ascii=False).encode
+    yield (encode({'type': 'export', 'version': FORMAT_VERSION, 'user_id': user_id,
+                   'exported_at': datetime.utcnow()}) + '\n').encode()
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, yield_per=chunk_size)
+        for kind in SECTIONS:
+            table = TABLES[kind]
+            skip = () if include_secrets else SECRET_COLUMNS.get(kind, ())
+            columns = [c for c in table.c if c.name not in skip]
+            names = [c.name for c in columns]
+            if user_id is None:
+                columns = [_live_column(c) for c in columns]
+            query = select(*columns).where(_filters(kind, user_id)).order_by(*table.primary_key.columns)
+            for partition in conn.execute(query).partitions():
+                yield ''.join(encode({'type': kind, **dict(zip(names, row))}) + '\n' for row in partition).encode()
+
+
+class _Pipe(io.RawIOBase):
+    """Write-only stream that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks, self.size = [], 0
+        return data
+
+
+def zip_stream(lines, name='export.ndjson', flush_at=1 << 16):
+    """Wraps an iterable of byte chunks in a zip archive, yielding the archive as it is written."""
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(name, 'w', force_zip64=True) as member:
+            for chunk in lines:
+                member.write(chunk)
+                if pipe.size >= flush_at:
+                    yield pipe.drain()
+    yield pipe.drain()
+
+
+def read_records(fileobj):
+    """Yields parsed records from an NDJSON export, or from a zip holding one."""
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            with archive.open(archive.namelist()[0]) as member:
+                yield from read_records(member)
+        return
+    fileobj.seek(0)
+    for line in io.TextIOWrapper(fileobj, encoding='utf-8'):
+        if line.strip():
+            yield json.loads(line)
+
+
+class ImportJob:
+    """Loads an export into this database in chunks of `chunk_size` rows.
+
+    Rows keep their ids, so this is meant for seeding an empty instance or
+    moving a whole one (`flask data export --all`), not merging into a live
+    site. Each chunk is one executemany, or one COPY on PostgreSQL. Follower
+    counters travel with the user rows; contact ranking, suggestions and
+    notifications are not exported and can be rebuilt afterwards.
+    """
+
+    def __init__(self, chunk_size=5000, echo=print):
+        self.chunk_size = chunk_size
+        self.echo = echo
+        self.counts = {}
+        self._converters = {kind: {c.name for c in table.c if isinstance(c.type, DateTime)}
+                            for kind, table in TABLES.items()}
+        self._columns = {kind: {c.name for c in table.c} for kind, table in TABLES.items()}
+        self.version = FORMAT_VERSION
+
+    def run(self, records):
+        kind, rows = None, []
+        with db.engine.begin() as conn:
+            for record in records:
+                record_kind = record.pop('type')
+                if record_kind == 'export':
+                    if record.get('version') not in READABLE_VERSIONS:
+                        raise ValueError(f"Unsupported export version {record.get('version')}")
+                    self.version = record['version']
+                    continue
+                if record_kind not in TABLES:
+                    raise ValueError(f'Unknown record type {record_kind!r}')
+                if record_kind != kind or len(rows) >= self.chunk_size:
+                    self._flush(conn, kind, rows)
+                    if record_kind != kind and kind is not None:
+                        self.echo(f"{kind}: {self.counts[kind]} rows")
+                    kind, rows = record_kind, []
+                for name in self._converters[kind]:
+                    if record.get(name):
+                        record[name] = datetime.fromisoformat(record[name])
+                if self.version < FORMAT_VERSION:
+                    record = {name: value for name, value in record.items() if name in self._columns[kind]}
+                rows.append(record)
+            self._flush(conn, kind, rows)
+            if kind is not None:
+                self.echo(f"{kind}: {self.counts[kind]} rows")
+            if self.version < 2:
+                # Older exports have no watermarks; count the imported history as read
+                self.echo(f"conversation_read: {ConversationRead.mark_all_read(conn)} rows (marked read)")
+            if conn.dialect.name == 'postgresql':
+                self._reset_sequences(conn)
+        return self.counts
+
+    def _flush(self, conn, kind, rows):
+        if not rows:
+            return
+        table = TABLES[kind]
+        if conn.dialect.name == 'postgresql':
+            self._copy(conn, table, rows)
+        else:
+            conn.execute(table.insert(), rows)
+        self.counts[kind] = self.counts.get(kind, 0) + len(rows)
+
+    @staticmethod
+    def _copy(conn, table, rows):
+        names = list(rows[0])
+        buffer = io.StringIO()
+        # Strings are quoted, so an empty string stays '' while None becomes NULL
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+        for row in rows:
+            writer.writerow([row.get(name) for name in names])
+        buffer.seek(0)
+        columns = ', '.join(f'"{name}"' for name in names)
+        cursor = conn.connection.dbapi_connection.cursor()
+        cursor.copy_expert(f'COPY "{table.name}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+    @staticmethod
+    def _reset_sequences(conn):
+        for table in TABLES.values():
+            if 'id' in table.c and table.c.id.autoincrement is not False:
+                conn.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM \"{table.name}\"), 1))")
@@ -4,8 +4,31 @@ from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, Le
 from flask_wtf.file import FileField, FileAllowed
 from flask_login import current_user
 from project.models import User
+from project.usernames import username_taken, UNSAFE_CHARACTERS
+from project.deliverability import deliverability
 from email_validator import validate_email as validate_email_mx, EmailNotValidError
 
+
+def check_deliverable(address):
+    """Raises ValidationError unless `address` is well-formed and its domain accepts mail (MX Record Check).
+
+    The domain lookup goes through the deliverability cache; if it can't be
+    settled within the budget the address is accepted.
+    """
+    try:
+        info = validate_email_mx(address, check_deliverability=False)
+    except EmailNotValidError as e:
+        raise ValidationError(f"Invalid or Fake Email: {str(e)}")
+    if not deliverability.enabled:
+        return
+    verdict = deliverability.check(info.ascii_domain, info.domain)
+    if verdict is not None and not verdict.ok:
+        raise ValidationError(f"Invalid or Fake Email: {verdict.reason}")
+
+def check_username_characters(username):
+    if any(c in UNSAFE_CHARACTERS for c in username):
+        raise ValidationError(f"Usernames can't contain {', '.join(UNSAFE_CHARACTERS)}.")
+
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()], filters=[lambda x: x.lower() if x else x])
     password = PasswordField('Password', validators=[DataRequired()])
@@ -21,8 +44,8 @@ class RegistrationForm(FlaskForm):
     submit = SubmitField('Register')
 
     def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
-        if user:
+        check_username_characters(username.data)
+        if username_taken(username.data):
             raise ValidationError('That username is already taken.')
 
     def validate_email(self, email):
@@ -30,11 +53,7 @@ class RegistrationForm(FlaskForm):
         if user:
             raise ValidationError('That email is already in use.')
         
-        # Globally verify if the domain even exists and accepts emails (MX Record Check)
-        try:
-            validate_email_mx(email.data, check_deliverability=True)
-        except EmailNotValidError as e:
-            raise ValidationError(f"Invalid or Fake Email: {str(e)}")
+        check_deliverable(email.data)
 
 class PostForm(FlaskForm):
     title = StringField('Title', validators=[DataRequired(), Length(min=1, max=150)])
@@ -51,8 +70,8 @@ class UpdateProfileForm(FlaskForm):
 
     def validate_username(self, username):
         if username.data != current_user.username:
-            user = User.query.filter_by(username=username.data).first()
-            if user:
+            check_username_characters(username.data)
+            if username_taken(username.data, exclude_id=current_user.id):
                 raise ValidationError('That username is already taken. Please choose a different one.')
 
 from wtforms.validators import Optional
@@ -91,11 +110,7 @@ class UpdateEmailForm(FlaskForm):
             if user:
                 raise ValidationError('That email is already in use. Please choose a different one.')
                 
-            # Globally verify if the domain even exists and accepts emails (MX Record Check)
-            try:
-                validate_email_mx(email.data, check_deliverability=True)
-            except EmailNotValidError as e:
-                raise ValidationError(f"Invalid or Fake Email: {str(e)}")
+            check_deliverable(email.data)
 
 
 class DeleteAccountForm(FlaskForm):
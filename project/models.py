@@ -1,12 +1,16 @@
+import math
+from collections import namedtuple
 from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.orm import validates
 from project import db
+from project.passwords import hasher
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 
 # Association table for followers
 followers = db.Table('followers',
-    db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
+    db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True)
 )
 
 # User model for the database
@@ -18,6 +22,16 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(256)) # Increased length for stronger hashes
     image_file = db.Column(db.String(500), nullable=False, default='default.jpg', server_default='default.jpg')
     is_verified = db.Column(db.Boolean, default=False)
+
+    __table_args__ = (
+        # Usernames are unique regardless of case; also serves project.usernames' lookups and prefix scans.
+        # Same definitions as migration b8ab9da0a6c0: on PostgreSQL in the "C" collation that
+        # project.usernames compares in, with username included for index-only scans
+        db.Index('ix_user_username_lower', db.func.lower(username).collate('C'), unique=True,
+                 postgresql_include=['username']).ddl_if(dialect='postgresql'),
+        db.Index('ix_user_username_lower', db.func.lower(username), unique=True)
+            .ddl_if(callable_=lambda ddl, target, bind, dialect=None, **kw: dialect.name != 'postgresql'),
+    )
     
     def get_verification_token(self, expires_sec=1800):
         from itsdangerous.url_safe import URLSafeTimedSerializer as Serializer
@@ -56,6 +70,11 @@ class User(UserMixin, db.Model):
     feed_sorting = db.Column(db.String(20), default='latest') # latest, popular
     accent_color = db.Column(db.String(20), default='purple')
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    # Kept in step with the followers table by follow()/unfollow()
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Set when the account is deleted; the purge job removes the row and its data afterwards
+    deleted_at = db.Column(db.DateTime, nullable=True, index=True)
 
     # Followers relationship
     followed = db.relationship(
@@ -73,69 +92,111 @@ class User(UserMixin, db.Model):
     notifications = db.relationship('Notification', backref='user', lazy='dynamic', cascade="all, delete-orphan")
 
     def follow(self, user):
-        if not self.is_following(user):
-            self.followed.append(user)
+        """Adds the edge and bumps both counters. Returns False if it already existed."""
+        added = db.session.execute(text(
+            'INSERT INTO followers (follower_id, followed_id) VALUES (:follower_id, :followed_id) '
+            'ON CONFLICT (follower_id, followed_id) DO NOTHING'),
+            {'follower_id': self.id, 'followed_id': user.id}).rowcount
+        if added:
+            User._adjust_follow_counts(self.id, user.id, 1)
+        return bool(added)
 
     def unfollow(self, user):
-        if self.is_following(user):
-            self.followed.remove(user)
+        removed = db.session.execute(followers.delete().where(
+            followers.c.follower_id == self.id, followers.c.followed_id == user.id)).rowcount
+        if removed:
+            User._adjust_follow_counts(self.id, user.id, -removed)
+        return bool(removed)
+
+    @staticmethod
+    def _adjust_follow_counts(follower_id, followed_id, delta):
+        User.query.filter_by(id=follower_id).update(
+            {User.following_count: User.following_count + delta}, synchronize_session=False)
+        User.query.filter_by(id=followed_id).update(
+            {User.follower_count: User.follower_count + delta}, synchronize_session=False)
+
+    @classmethod
+    def live(cls):
+        """Accounts that have not been deleted."""
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    def soft_delete(self):
+        """Hides the account and its posts at once and frees its username and email.
+
+        Everything else is left for the purge job, so this is a couple of
+        single-row or indexed updates however much the user has posted.
+        """
+        now = datetime.utcnow()
+        self.deleted_at = now
+        from project.usernames import tombstone
+        # Contains '#', which no sign-up can produce, so it can't clash with a real account
+        self.username = tombstone(self.id)
+        self.email = f'deleted_{self.id}@deleted.invalid'
+        self.password_hash = None
+        Post.query.filter(Post.user_id == self.id, Post.deleted_at.is_(None)).update(
+            {Post.deleted_at: now}, synchronize_session=False)
+        db.session.add(PurgeTask(kind='user', target_id=self.id))
 
     def is_following(self, user):
-        return self.followed.filter(
-            followers.c.followed_id == user.id).count() > 0
+        from project.user_cache import is_following
+        return is_following(self.id, user.id)
 
     def followed_posts(self):
-        followed = Post.query.join(
-            followers, (followers.c.followed_id == Post.user_id)).filter(
-                followers.c.follower_id == self.id)
-        own = Post.query.filter_by(user_id=self.id)
-        return followed.union(own).order_by(Post.timestamp.desc())
+        followed_ids = db.select(followers.c.followed_id).where(followers.c.follower_id == self.id)
+        return Post.live().filter(db.or_(Post.user_id == self.id, Post.user_id.in_(followed_ids))).order_by(Post.timestamp.desc())
 
+    # The helpers below only touch self.id so the cached session user can reuse them
     def get_recent_notifications(self, limit=10):
-        # We can safely order_by text inside the model file imported components
-        return self.notifications.order_by(db.desc('timestamp')).limit(limit).all()
+        return Notification.query.filter_by(user_id=self.id).order_by(Notification.timestamp.desc()).limit(limit).all()
+
+    def unread_notification_count(self):
+        return Notification.query.filter_by(user_id=self.id, is_read=False).count()
 
     def new_messages(self):
-        return Message.query.filter_by(recipient=self, is_read=False).count()
+        return ConversationRead.unread_count(self.id)
 
     def get_top_chat_users(self, limit=10):
-        messages = Message.query.filter(
-            db.or_(Message.sender_id == self.id, Message.recipient_id == self.id)
-        ).all()
-        
-        counts = {}
-        for msg in messages:
-            other_id = msg.recipient_id if msg.sender_id == self.id else msg.sender_id
-            counts[other_id] = counts.get(other_id, 0) + 1
-            
-        sorted_user_ids = sorted(counts, key=counts.get, reverse=True)[:limit]
-        
-        # Fill remaining slots with followers
-        if len(sorted_user_ids) < limit:
-            followers = self.followers.all()
-            for f in followers:
-                if f.id not in sorted_user_ids and f.id != self.id:
-                    sorted_user_ids.append(f.id)
-                if len(sorted_user_ids) >= limit:
-                    break
-                    
-        if not sorted_user_ids:
-            return []
-            
-        users = User.query.filter(User.id.in_(sorted_user_ids)).all()
-        users_dict = {user.id: user for user in users}
-        return [users_dict[uid] for uid in sorted_user_ids if uid in users_dict]
+        """Frequent contacts first (from contact_score), then followers to fill the list."""
+        users = (User.query.join(ContactScore, ContactScore.contact_id == User.id)
+                 .filter(ContactScore.user_id == self.id, User.id != self.id, User.deleted_at.is_(None))
+                 .order_by(ContactScore.message_count.desc(), ContactScore.last_message_at.desc())
+                 .limit(limit).all())
+        if len(users) < limit:
+            seen = [u.id for u in users] + [self.id]
+            users += (User.query.join(followers, followers.c.follower_id == User.id)
+                      .filter(followers.c.followed_id == self.id, User.id.notin_(seen), User.deleted_at.is_(None))
+                      .limit(limit - len(users)).all())
+        return users
 
     def __repr__(self):
         return f'<User {self.username}>'
 
     def set_password(self, password):
-        """Hashes and sets the user's password."""
-        self.password_hash = generate_password_hash(password)
+        """Hashes and sets the user's password (on the hashing pool; may raise HasherBusy)."""
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        """Checks if the provided password matches the hash."""
-        return check_password_hash(self.password_hash, password)
+        """Checks if the provided password matches the hash (on the hashing pool; may raise HasherBusy)."""
+        return hasher.verify(self.password_hash, password)
+
+    def rehash_password(self, password):
+        """After a successful check: re-hashes with the current method if the stored hash is older. Returns True if it did."""
+        if not hasher.needs_rehash(self.password_hash):
+            return False
+        self.set_password(password)
+        return True
+
+EXCERPT_LENGTH = 500
+WORDS_PER_MINUTE = 200
+
+def make_excerpt(body, limit=EXCERPT_LENGTH):
+    """First `limit` characters of body, cut at a word boundary and ending in an ellipsis if shortened."""
+    if len(body) <= limit:
+        return body
+    cut = body[:limit]
+    if not body[limit].isspace() and any(ch.isspace() for ch in cut):
+        cut = cut.rsplit(None, 1)[0]
+    return cut.rstrip() + '…'
 
 # Post model for the database
 class Post(db.Model):
@@ -147,38 +208,237 @@ class Post(db.Model):
     tags = db.Column(db.String(255), nullable=True) # Comma-separated tags
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     
+    # Derived from body whenever it is set, so feeds never need to load the body itself
+    excerpt = db.Column(db.String(EXCERPT_LENGTH + 1), nullable=True)
+    word_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    reading_time = db.Column(db.Integer, nullable=False, default=1, server_default='1') # minutes
+
+    deleted_at = db.Column(db.DateTime, nullable=True, index=True)
+
     # Foreign key to link posts to users
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     
     likes = db.relationship('Like', backref='post', lazy='dynamic', cascade="all, delete-orphan")
     comments = db.relationship('Comment', backref='post', lazy='dynamic', cascade="all, delete-orphan")
     saved_by = db.relationship('SavedPost', backref='post', lazy='dynamic', cascade="all, delete-orphan")
 
+    @validates('body')
+    def _derive_summary(self, key, body):
+        self.excerpt = make_excerpt(body or '')
+        self.word_count = len((body or '').split())
+        self.reading_time = max(1, math.ceil(self.word_count / WORDS_PER_MINUTE))
+        return body
+
+    @property
+    def excerpt_truncated(self):
+        return (self.excerpt or '').endswith('…')
+
+    @classmethod
+    def live(cls):
+        """Posts that have not been deleted."""
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    @classmethod
+    def feed(cls):
+        """Post query for lists: everything but the body, which only loads when a post is expanded."""
+        return cls.live().options(db.defer(cls.body))
+
+    def soft_delete(self):
+        self.deleted_at = datetime.utcnow()
+        db.session.add(PurgeTask(kind='post', target_id=self.id))
+
     def __repr__(self):
         return f'<Post {self.title}>'
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     body = db.Column(db.String(500))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     is_edited = db.Column(db.Boolean, default=False)
-    is_read = db.Column(db.Boolean, default=False)
     image_file = db.Column(db.String(500), nullable=True)
     shared_post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=True)
 
     shared_post = db.relationship('Post', foreign_keys=[shared_post_id], backref='shared_in_messages')
 
+    __table_args__ = (
+        # One conversation's incoming messages in id order: unread counts are range scans past the watermark
+        db.Index('ix_message_conversation', 'recipient_id', 'sender_id', 'id'),
+    )
+
     def __repr__(self):
         return f'<Message {self.id}>'
 
+class ContactScore(db.Model):
+    """How many messages a user has exchanged with each contact, kept up to date on send."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    contact_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_contact_score_rank', 'user_id', 'message_count', 'last_message_at'),
+    )
+
+    @staticmethod
+    def record(sender_id, recipient_id, at=None):
+        """Counts one message for both participants. Runs in the caller's transaction."""
+        if sender_id is None or recipient_id is None or sender_id == recipient_id:
+            return
+        at = at or datetime.utcnow()
+        db.session.execute(text('''
+            INSERT INTO contact_score (user_id, contact_id, message_count, last_message_at)
+            VALUES (:a, :b, 1, :at), (:b, :a, 1, :at)
+            ON CONFLICT (user_id, contact_id) DO UPDATE
+            SET message_count = contact_score.message_count + 1,
+                last_message_at = excluded.last_message_at
+        '''), {'a': sender_id, 'b': recipient_id, 'at': at})
+
+    @staticmethod
+    def rebuild():
+        """Recomputes every ranking from the message table with one GROUP BY."""
+        db.session.execute(text('DELETE FROM contact_score'))
+        result = db.session.execute(text(CONTACT_SCORE_REBUILD_SQL))
+        return result.rowcount
+
+    def __repr__(self):
+        return f'<ContactScore user:{self.user_id} contact:{self.contact_id} {self.message_count}>'
+
+# How far each participant has read a conversation. A message from contact_id
+# to user_id is unread while its id is above last_read_message_id. The row is
+# created when the first message arrives, so opening a chat is one UPDATE.
+class ConversationRead(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    contact_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    last_read_message_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_conversation_read_contact_id', 'contact_id'),
+    )
+
+    @staticmethod
+    def open(recipient_id, sender_id):
+        """Makes sure the recipient has a watermark for this conversation. Runs in the caller's transaction."""
+        if recipient_id is None or sender_id is None or recipient_id == sender_id:
+            return
+        db.session.execute(text('''
+            INSERT INTO conversation_read (user_id, contact_id, last_read_message_id, updated_at)
+            VALUES (:user, :contact, 0, :now)
+            ON CONFLICT (user_id, contact_id) DO NOTHING
+        '''), {'user': recipient_id, 'contact': sender_id, 'now': datetime.utcnow()})
+
+    @staticmethod
+    def mark_read(user_id, contact_id, up_to=None):
+        """Moves user_id's watermark with contact_id up to message `up_to`, or to contact_id's latest
+        message. Never moves it back. Returns True if anything became read."""
+        latest = '''(SELECT max(id) FROM message WHERE recipient_id = :user AND sender_id = :contact)'''
+        target = ':up_to' if up_to is not None else latest
+        return db.session.execute(text(f'''
+            UPDATE conversation_read SET last_read_message_id = {target}, updated_at = :now
+            WHERE user_id = :user AND contact_id = :contact AND last_read_message_id < {target}
+        '''), {'user': user_id, 'contact': contact_id, 'up_to': up_to, 'now': datetime.utcnow()}).rowcount > 0
+
+    @staticmethod
+    def unread_counts(user_id):
+        """{contact_id: unread messages from them} for every conversation with something unread."""
+        rows = db.session.execute(text('''
+            SELECT r.contact_id, count(m.id) FROM conversation_read r
+            JOIN message m ON m.recipient_id = r.user_id AND m.sender_id = r.contact_id
+                          AND m.id > r.last_read_message_id
+            WHERE r.user_id = :user
+            GROUP BY r.contact_id
+        '''), {'user': user_id}).all()
+        return dict(rows)
+
+    @staticmethod
+    def unread_count(user_id):
+        return sum(ConversationRead.unread_counts(user_id).values())
+
+    @staticmethod
+    def read_by(user_id):
+        """{contact_id: id of the last message of user_id's that contact has read}."""
+        rows = db.session.execute(db.select(ConversationRead.user_id, ConversationRead.last_read_message_id)
+                                  .where(ConversationRead.contact_id == user_id)).all()
+        return dict(rows)
+
+    @staticmethod
+    def mark_all_read(conn):
+        """Gives every conversation without a watermark one at its latest message, i.e. treats it as read."""
+        return conn.execute(text('''
+            INSERT INTO conversation_read (user_id, contact_id, last_read_message_id, updated_at)
+            SELECT m.recipient_id, m.sender_id, max(m.id), :now FROM message m
+            WHERE m.recipient_id IS NOT NULL AND m.sender_id IS NOT NULL AND m.recipient_id != m.sender_id
+              AND NOT EXISTS (SELECT 1 FROM conversation_read r
+                              WHERE r.user_id = m.recipient_id AND r.contact_id = m.sender_id)
+            GROUP BY m.recipient_id, m.sender_id
+        '''), {'now': datetime.utcnow()}).rowcount
+
+    def __repr__(self):
+        return f'<ConversationRead user:{self.user_id} contact:{self.contact_id} at {self.last_read_message_id}>'
+
+CONTACT_SCORE_REBUILD_SQL = '''
+    INSERT INTO contact_score (user_id, contact_id, message_count, last_message_at)
+    SELECT user_id, contact_id, count(*), max(sent_at)
+    FROM (
+        SELECT sender_id AS user_id, recipient_id AS contact_id, timestamp AS sent_at FROM message
+        UNION ALL
+        SELECT recipient_id, sender_id, timestamp FROM message
+    ) AS pairs
+    WHERE user_id <> contact_id
+      AND user_id IN (SELECT id FROM "user") AND contact_id IN (SELECT id FROM "user")
+    GROUP BY user_id, contact_id
+'''
+
+def toggle_user_post(model, user_id, post_id):
+    """Adds or removes the (user_id, post_id) row of a Like/SavedPost-style table atomically.
+
+    Returns (present, changed): whether the row exists afterwards, and whether
+    this call inserted or deleted it. Relies on the unique (user_id, post_id)
+    constraint, so concurrent toggles can never create duplicates. If two
+    requests race, one of them inserts and the other reports present without
+    changing anything.
+    """
+    table = db.session.get_bind().dialect.identifier_preparer.quote(model.__tablename__)
+    params = {'user_id': user_id, 'post_id': post_id, 'now': datetime.utcnow()}
+    if db.session.get_bind().dialect.name == 'postgresql':
+        removed, added = db.session.execute(text(f'''
+            WITH deleted AS (
+                DELETE FROM {table} WHERE user_id = :user_id AND post_id = :post_id RETURNING id
+            ), inserted AS (
+                INSERT INTO {table} (user_id, post_id, timestamp)
+                SELECT :user_id, :post_id, :now WHERE NOT EXISTS (SELECT 1 FROM deleted)
+                ON CONFLICT (user_id, post_id) DO NOTHING
+                RETURNING id
+            )
+            SELECT (SELECT count(*) FROM deleted), (SELECT count(*) FROM inserted)
+        '''), params).one()
+    else:
+        # SQLite holds the write lock from the DELETE until commit, so the pair is atomic
+        removed = len(db.session.execute(text(
+            f'DELETE FROM {table} WHERE user_id = :user_id AND post_id = :post_id RETURNING id'), params).all())
+        added = 0
+        if not removed:
+            added = len(db.session.execute(text(
+                f'INSERT INTO {table} (user_id, post_id, timestamp) VALUES (:user_id, :post_id, :now) '
+                f'ON CONFLICT (user_id, post_id) DO NOTHING RETURNING id'), params).all())
+    return not removed, bool(removed or added)
+
 class Like(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False, index=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', name='uq_like_user_post'),
+    )
+
+    @classmethod
+    def toggle(cls, user_id, post_id):
+        return toggle_user_post(cls, user_id, post_id)
+
     def __repr__(self):
         return f'<Like user:{self.user_id} post:{self.post_id}>'
 
@@ -186,12 +446,41 @@ class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False, index=True)
 
     def __repr__(self):
         return f'<Comment {self.body[:20]}>'
 
+CommentPreview = namedtuple('CommentPreview', 'comments total')
+
+def comment_previews(post_ids, per_post=3):
+    """Latest `per_post` comments of every post plus each post's total, in one windowed query.
+
+    Returns {post_id: CommentPreview}, with comments oldest first and authors
+    already loaded. Posts without comments map to an empty preview.
+    """
+    previews = {post_id: CommentPreview([], 0) for post_id in post_ids}
+    if not previews:
+        return previews
+    ranked = db.select(
+        Comment.id.label('id'),
+        db.func.row_number().over(partition_by=Comment.post_id, order_by=Comment.id.desc()).label('position'),
+        db.func.count().over(partition_by=Comment.post_id).label('total'),
+    ).where(Comment.post_id.in_(previews)).subquery()
+    rows = db.session.execute(
+        db.select(Comment, ranked.c.total)
+        .join(ranked, ranked.c.id == Comment.id)
+        .where(ranked.c.position <= per_post)
+        .options(db.joinedload(Comment.author))
+        .order_by(Comment.post_id, Comment.id)
+    ).all()
+    for comment, total in rows:
+        preview = previews[comment.post_id]
+        preview.comments.append(comment)
+        previews[comment.post_id] = preview._replace(total=total)
+    return previews
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -199,15 +488,170 @@ class Notification(db.Model):
     link = db.Column(db.String(255), nullable=True) # URL to redirect to when clicked
     is_read = db.Column(db.Boolean, default=False)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    # Aggregation key: repeated events of the same kind on the same target share one row
+    kind = db.Column(db.String(20), nullable=True) # like, comment, follow
+    target = db.Column(db.String(50), nullable=True) # e.g. 'post:12', 'user:3'
+    actor_count = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Space-separated ids of the users counted in actor_count, so each person counts once
+    actor_ids = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_notification_user_target', 'user_id', 'target'),
+    )
 
     def __repr__(self):
         return f'<Notification {self.message[:20]}>'
 
+# Read or overflowed notifications moved out of the hot table by `flask notifications prune --archive`
+# No foreign key on user_id so archived rows never block account deletion
+class NotificationArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    message = db.Column(db.String(255), nullable=False)
+    link = db.Column(db.String(255), nullable=True)
+    is_read = db.Column(db.Boolean, default=False)
+    timestamp = db.Column(db.DateTime)
+    kind = db.Column(db.String(20), nullable=True)
+    target = db.Column(db.String(50), nullable=True)
+    actor_count = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<NotificationArchive {self.message[:20]}>'
+
 class SavedPost(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False, index=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', name='uq_saved_post_user_post'),
+    )
+
+    @classmethod
+    def toggle(cls, user_id, post_id):
+        return toggle_user_post(cls, user_id, post_id)
+
+    def __repr__(self):
+        return f'<SavedPost user:{self.user_id} post:{self.post_id}>'
+
+# Shared outbox for the /events stream when EVENT_BACKEND=database; rows only live a few minutes
+class StreamEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(50), nullable=False, index=True)
+    event = db.Column(db.String(30), nullable=False)
+    data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StreamEvent {self.channel} {self.event}>'
+
+# Who-to-follow rows, rebuilt offline by `flask suggestions build`
+class FollowSuggestion(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    suggested_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    mutual_count = db.Column(db.Integer, nullable=False, default=0) # people you follow who follow them
+    shared_likes = db.Column(db.Integer, nullable=False, default=0) # posts you both liked
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    suggested = db.relationship('User', foreign_keys=[suggested_id])
+
+    __table_args__ = (
+        db.Index('ix_follow_suggestion_rank', 'user_id', 'score'),
+    )
+
+    def __repr__(self):
+        return f'<FollowSuggestion user:{self.user_id} suggested:{self.suggested_id}>'
+
+# A soft-deleted user or post whose rows are still being removed; see project/purge.py
+class PurgeTask(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False) # user, post
+    target_id = db.Column(db.Integer, nullable=False)
+    stage = db.Column(db.Integer, nullable=False, default=0, server_default='0') # index of the next purge step
+    rows_deleted = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True, index=True)
+
+    def __repr__(self):
+        return f'<PurgeTask {self.kind}:{self.target_id} stage {self.stage}>'
+
+DRAFT_FIELDS = ('title', 'author_name', 'tags')
+
+# An unpublished post, saved as the writer types. Anonymous drafts have no user_id
+# and are found through the opaque key kept in the session until login claims them.
+class Draft(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(32), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=True, index=True)
+    title = db.Column(db.String(150), nullable=True)
+    body = db.Column(db.Text, nullable=False, default='', server_default='')
+    author_name = db.Column(db.String(100), nullable=True)
+    tags = db.Column(db.String(255), nullable=True)
+    image_file = db.Column(db.String(500), nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0') # bumped by every save
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    # Saves UPDATE ... WHERE version = <the version read>, so of two tabs saving from the same
+    # version only the first succeeds; the other gets StaleDataError. apply_patch() bumps it
+    __mapper_args__ = {'version_id_col': version, 'version_id_generator': False}
+
+    def apply_patch(self, patch):
+        """Applies an autosave patch and bumps the version.
+
+        `patch` carries any changed short fields plus either the whole `body` or
+        a `splice` ({start, end, text}) that replaces body[start:end], which is
+        all the editor sends while someone is typing. Raises ValueError if the
+        splice does not fit the stored body.
+        """
+        for field in DRAFT_FIELDS:
+            if field in patch:
+                setattr(self, field, (patch[field] or '')[:getattr(Draft, field).type.length])
+        if 'body' in patch:
+            self.body = patch['body'] or ''
+        elif 'splice' in patch:
+            splice = patch['splice']
+            start, end, text = int(splice['start']), int(splice['end']), splice.get('text') or ''
+            body = self.body or ''
+            if not 0 <= start <= end <= len(body):
+                raise ValueError('Splice is outside the draft body.')
+            self.body = body[:start] + text + body[end:]
+        self.version += 1
+        self.updated_at = datetime.utcnow()
+
+    @staticmethod
+    def claim(key, user_id):
+        """Hands the anonymous draft with this key to a user. One UPDATE; returns True if it was claimed."""
+        if not key:
+            return False
+        return Draft.query.filter(Draft.key == key, Draft.user_id.is_(None)).update(
+            {Draft.user_id: user_id}, synchronize_session=False) > 0
+
+    def __repr__(self):
+        return f'<Draft {self.key} v{self.version}>'
+
+# Checkpoint of one data backfill (see project/backfill.py). The worker holding
+# the lease advances last_key in the same transaction as each batch it writes.
+class BackfillState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), unique=True, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending', server_default='pending') # pending, running, done, failed
+    last_key = db.Column(db.BigInteger, nullable=True) # highest key processed so far
+    rows_scanned = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rows_changed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    batches = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    owner = db.Column(db.String(64), nullable=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.String(255), nullable=True)
+    queued_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
     def __repr__(self):
-        return f'<SavedPost user:{self.user_id} post:{self.post_id}>'
\ No newline at end of file
+        return f'<BackfillState {self.name} {self.status} at {self.last_key}>'
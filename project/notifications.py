@@ -0,0 +1,241 @@
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, bindparam
+from project import db
+from project.models import Notification
+from project.events import broker
+
+# pg_advisory_xact_lock key that makes flushes from every process take turns
+WRITE_LOCK_KEY = 0x6e6f7469
+
+
+def _parse_actors(actor_ids):
+    return {int(i) for i in actor_ids.split()} if actor_ids else set()
+
+
+def _format_actors(actors):
+    return ' '.join(str(i) for i in sorted(actors))
+
+
+def _actors_label(actor, count):
+    if count <= 1:
+        return actor
+    others = count - 1
+    return f"{actor} and {others} other{'s' if others > 1 else ''}"
+
+
+class NotificationService:
+    """Buffers notification events and writes them in bulk.
+
+    Events with the same (recipient, kind, target) collapse into a single
+    unread row inside the aggregation window, so a post that receives 42
+    likes shows "alice and 41 others liked your post" instead of 42 rows.
+    The row keeps the ids of the people counted, so someone who likes,
+    unlikes and likes again, or comments five times, counts once.
+
+    With `flush_interval` 0 every event is written at once; serverless
+    deployments use that, since a frozen function never runs the flusher.
+
+    A flush reads the open rows and then updates them, so flushes from
+    different threads and workers take turns: a transaction-level advisory
+    lock on PostgreSQL, the write lock taken up front on SQLite. Events
+    from a flush that fails go back in the buffer for the next one, up to
+    `max_pending` keys.
+    """
+
+    def __init__(self, app=None):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._app = None
+        self._flusher = None
+        self.window = timedelta(hours=24)
+        self.flush_interval = 2.0
+        self.batch_size = 500
+        self.max_pending = 5000
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.window = timedelta(hours=app.config.get('NOTIFICATION_AGGREGATE_HOURS', 24))
+        self.flush_interval = app.config.get('NOTIFICATION_FLUSH_INTERVAL', 2.0)
+        self.batch_size = app.config.get('NOTIFICATION_BATCH_SIZE', 500)
+        self.max_pending = app.config.get('NOTIFICATION_MAX_PENDING', 10 * self.batch_size)
+        app.extensions['notifications'] = self
+        self._app = app
+
+        @app.teardown_request
+        def flush_due_notifications(exc):
+            if self.is_due():
+                self.flush()
+
+        def flush_at_exit():
+            with app.app_context():
+                self.flush()
+        atexit.register(flush_at_exit)
+
+    def notify(self, user_id, kind, target, actor_id, actor, text, link=None):
+        """Queues one event by user `actor_id`, named `actor`. `text` follows the actor names, e.g. "liked your post 'Hi...'"."""
+        key = (user_id, kind, target)
+        with self._lock:
+            event = self._pending.get(key)
+            if event is None:
+                self._pending[key] = {'actor': actor, 'text': text, 'link': link, 'actors': {actor_id}}
+            else:
+                event.update(actor=actor, text=text, link=link)
+                event['actors'].add(actor_id)
+            size = len(self._pending)
+        if size >= self.batch_size or self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        # Quiet periods still get flushed by a background thread, not just by the next request
+        if self._app is None or (self._flusher is not None and self._flusher.is_alive()):
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self.is_due():
+                with self._app.app_context():
+                    self.flush()
+
+    def is_due(self):
+        with self._lock:
+            return bool(self._pending) and time.monotonic() - self._last_flush >= self.flush_interval
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Writes all buffered events. Returns the number of rows inserted or updated."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            return self._write(pending)
+        except Exception as e:
+            dropped = self._requeue(pending)
+            print(f"Failed to flush notifications, {len(pending) - dropped} kept for the next flush: {e}")
+            return 0
+
+    def _requeue(self, pending):
+        """Puts events from a failed flush back under the ones queued since. Returns how many keys didn't fit."""
+        with self._lock:
+            for key, event in self._pending.items():
+                # The newer event keeps its label; the actors add up
+                older = pending.get(key)
+                if older is not None:
+                    event['actors'] |= older['actors']
+            requeued = [(key, event) for key, event in pending.items() if key not in self._pending]
+            room = max(self.max_pending - len(self._pending), 0)
+            self._pending.update(requeued[:room])
+            return max(len(requeued) - room, 0)
+
+    def _lock_writers(self, conn):
+        if conn.dialect.name == 'postgresql':
+            conn.execute(select(db.func.pg_advisory_xact_lock(WRITE_LOCK_KEY)))
+        else:
+            # Deferred SQLite transactions would both read and then one fail to write; this one waits its turn
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+    def _write(self, pending):
+        table = Notification.__table__
+        now = datetime.utcnow()
+        cutoff = now - self.window
+        keys = list(pending)
+
+        with db.engine.begin() as conn:
+            self._lock_writers(conn)
+            # Find the open (unread, recent) aggregate row for every key in one query per chunk
+            existing = {}
+            for start in range(0, len(keys), self.batch_size):
+                chunk = keys[start:start + self.batch_size]
+                rows = conn.execute(
+                    select(table.c.id, table.c.user_id, table.c.kind, table.c.target, table.c.actor_count, table.c.actor_ids)
+                    .where(
+                        table.c.user_id.in_({k[0] for k in chunk}),
+                        table.c.target.in_({k[2] for k in chunk}),
+                        table.c.is_read == False,
+                        table.c.timestamp >= cutoff,
+                    )
+                    .order_by(table.c.timestamp)
+                ).all()
+                for row in rows:
+                    existing[(row.user_id, row.kind, row.target)] = row
+
+            inserts, updates = [], []
+            existing_by_id = {row.id: row.user_id for row in existing.values()}
+            for key, event in pending.items():
+                row = existing.get(key)
+                if row is None:
+                    count = len(event['actors'])
+                    inserts.append({
+                        'user_id': key[0], 'kind': key[1], 'target': key[2],
+                        'message': f"{_actors_label(event['actor'], count)} {event['text']}"[:255],
+                        'link': event['link'], 'is_read': False,
+                        'timestamp': now, 'actor_count': count,
+                        'actor_ids': _format_actors(event['actors']),
+                    })
+                else:
+                    # Rows from before actor_ids was kept have none stored; their actors count as new
+                    counted = _parse_actors(row.actor_ids)
+                    new_actors = event['actors'] - counted
+                    if not new_actors:
+                        # Same people again (a re-like, a second comment): nothing new to tell
+                        continue
+                    count = row.actor_count + len(new_actors)
+                    updates.append({
+                        'b_id': row.id,
+                        'b_message': f"{_actors_label(event['actor'], count)} {event['text']}"[:255],
+                        'b_link': event['link'], 'b_timestamp': now, 'b_actor_count': count,
+                        'b_actor_ids': _format_actors(counted | new_actors),
+                    })
+
+            if inserts:
+                # Ids come back in parameter order; the live dropdown needs them to replace items later
+                ids = conn.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), inserts).scalars().all()
+                for row, notification_id in zip(inserts, ids):
+                    row['id'] = notification_id
+            if updates:
+                conn.execute(
+                    table.update().where(table.c.id == bindparam('b_id')).values(
+                        message=bindparam('b_message'),
+                        link=bindparam('b_link'),
+                        timestamp=bindparam('b_timestamp'),
+                        actor_count=bindparam('b_actor_count'),
+                        actor_ids=bindparam('b_actor_ids'),
+                    ),
+                    updates,
+                )
+
+            recipients = {key[0] for key in pending}
+            unread = dict(conn.execute(
+                select(table.c.user_id, db.func.count())
+                .where(table.c.user_id.in_(recipients), table.c.is_read == False)
+                .group_by(table.c.user_id)
+            ).all())
+
+        for row in inserts:
+            broker.publish_to_user(row['user_id'], 'notification', {'id': row['id'], 'message': row['message'], 'link': row['link'], 'timestamp': now.isoformat() + 'Z'})
+        for row in updates:
+            broker.publish_to_user(existing_by_id[row['b_id']], 'notification', {'id': row['b_id'], 'message': row['b_message'], 'link': row['b_link'], 'timestamp': now.isoformat() + 'Z'})
+        for user_id in recipients:
+            broker.publish_to_user(user_id, 'unread', {'notifications': unread.get(user_id, 0)})
+        return len(inserts) + len(updates)
+
+
+notifier = NotificationService()
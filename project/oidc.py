@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from authlib.integrations.flask_client import FlaskOAuth2App
+
+
+class CachedDocument:
+    __slots__ = ('body', 'fetched_at')
+
+    def __init__(self, body, fetched_at):
+        self.body = body
+        self.fetched_at = fetched_at
+
+
+class OIDCCache:
+    """OIDC discovery documents and JWKS, cached in memory and as JSON files.
+
+    A fresh instance reads Google's metadata and signing keys from
+    `directory` instead of fetching them before its first sign-in. Past
+    `ttl` a document is still served while a background thread fetches a
+    new one (one fetch per URL at a time); past `max_stale`, or when there
+    is no copy at all, the caller fetches it. A failed background fetch
+    keeps the old copy. JWKS get a forced refresh when a token is signed
+    with a key id they don't have, which is how key rotation shows up, but
+    at most once every `min_refetch` seconds.
+
+    `flask oidc refresh` fills the directory ahead of time, e.g. as a build
+    step, so even the first instance after a deploy skips the network.
+    """
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.metadata_ttl = 86400
+        self.jwks_ttl = 21600
+        self.max_stale = 7 * 86400
+        self.min_refetch = 60
+        self._documents = {}  # url -> CachedDocument
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('OIDC_CACHE_DIR') or os.path.join(app.instance_path, 'oidc')
+        self.metadata_ttl = app.config.get('OIDC_METADATA_TTL', 86400)
+        self.jwks_ttl = app.config.get('OIDC_JWKS_TTL', 21600)
+        self.max_stale = app.config.get('OIDC_MAX_STALE', 7 * 86400)
+        self._documents.clear()
+        app.extensions['oidc_cache'] = self
+
+    def _file(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest() + '.json')
+
+    def _read(self, url):
+        try:
+            with open(self._file(url), encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stored.get('url') != url:
+            return None
+        return CachedDocument(stored['body'], stored['fetched_at'])
+
+    def _write(self, url, document):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._file(url)
+            temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump({'url': url, 'fetched_at': document.fetched_at, 'body': document.body}, f)
+            os.replace(temporary, path)
+        except OSError as e:
+            # A read-only deploy still works, it just refetches on every cold start
+            print(f"Failed to write OIDC cache for {url}: {e}")
+
+    def _fetch(self, url, fetch):
+        document = CachedDocument(fetch(url), time.time())
+        self._documents[url] = document
+        self._write(url, document)
+        return document
+
+    def get(self, url, fetch, ttl, force=False):
+        """The document at `url`; `fetch(url)` returns it parsed when the cache can't.
+
+        `force` fetches it now unless the copy is under `min_refetch` seconds old.
+        """
+        document = self._documents.get(url) or self._read(url)
+        if document is None:
+            return self._fetch(url, fetch).body
+        self._documents[url] = document
+        age = time.time() - document.fetched_at
+        if age > self.max_stale or (force and age > self.min_refetch):
+            return self._fetch(url, fetch).body
+        if age > ttl:
+            self.refresh(url, fetch)
+        return document.body
+
+    def reload(self, url, fetch):
+        """Fetches `url` now and stores it, whatever the cached copy's age."""
+        return self._fetch(url, fetch).body
+
+    def refresh(self, url, fetch):
+        """Fetches `url` again on a background thread unless that is already under way."""
+        with self._lock:
+            if url in self._refreshing:
+                return
+            self._refreshing.add(url)
+        threading.Thread(target=self._refresh, args=(url, fetch), daemon=True).start()
+
+    def _refresh(self, url, fetch):
+        try:
+            self._fetch(url, fetch)
+        except Exception as e:
+            print(f"Failed to refresh OIDC document {url}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(url)
+
+    def clear(self):
+        self._documents.clear()
+
+
+oidc_cache = OIDCCache()
+
+
+class CachedOAuth2App(FlaskOAuth2App):
+    """Authlib's Flask client with discovery metadata and JWKS read through `oidc_cache`."""
+
+    def _get_json(self, url):
+        with self.client_cls(**self.client_kwargs) as session:
+            response = session.request('GET', url, withhold_token=True, timeout=10)
+            response.raise_for_status()
+            return response.json()
+
+    def load_server_metadata(self, reload=False):
+        """Authlib's metadata loader; `reload` fetches it now whatever the cached copy's age."""
+        if self._server_metadata_url:
+            if reload:
+                metadata = oidc_cache.reload(self._server_metadata_url, self._get_json)
+            else:
+                metadata = oidc_cache.get(self._server_metadata_url, self._get_json, oidc_cache.metadata_ttl)
+            self.server_metadata.update(metadata)
+            self.server_metadata['_loaded_at'] = time.time()
+        return self.server_metadata
+
+    def fetch_jwk_set(self, force=False, reload=False):
+        uri = self.load_server_metadata().get('jwks_uri')
+        if not uri:
+            raise RuntimeError('Missing "jwks_uri" in metadata')
+        if reload:
+            return oidc_cache.reload(uri, self._get_json)
+        return oidc_cache.get(uri, self._get_json, oidc_cache.jwks_ttl, force=force)
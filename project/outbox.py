@@ -0,0 +1,80 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from project import mail
+
+
+class MailOutbox:
+    """Sends notification emails on a small pool instead of the request thread.
+
+    With `workers` threads, `send(msg)` returns at once and the message
+    goes out on one of them inside an app context, so a like, comment,
+    follow or chat message doesn't wait for the SMTP round trip. Failures
+    are logged, as they were before. At most `max_pending` messages wait;
+    beyond that they are sent inline, so a dead SMTP server slows the
+    requests down rather than growing the queue without bound.
+
+    With no workers, the default, messages are sent inline: a serverless
+    function may be frozen as soon as its response is out, and a queued
+    message would never be sent. The ASGI entry point runs in a long-lived
+    process and starts the pool (see project.asgi).
+    """
+
+    def __init__(self, app=None):
+        self._app = None
+        self.workers = 0
+        self.max_pending = 500
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_pending = app.config.get('MAIL_OUTBOX_MAX_PENDING', 500)
+        self.start(app.config.get('MAIL_OUTBOX_WORKERS', 0))
+        app.extensions['mail_outbox'] = self
+        self._app = app
+
+    def start(self, workers):
+        """Sends from `workers` background threads from now on; 0 sends inline."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='mail-outbox') if workers else None
+
+    def send(self, msg):
+        with self._lock:
+            queued = self._executor is not None and self._pending < self.max_pending
+            if queued:
+                self._pending += 1
+        if not queued:
+            self._stats['inline'] += 1
+            self._deliver(msg)
+            return
+        self._stats['queued'] += 1
+        self._executor.submit(self._send_queued, msg)
+
+    def _send_queued(self, msg):
+        try:
+            with self._app.app_context():
+                self._deliver(msg)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _deliver(self, msg):
+        try:
+            mail.send(msg)
+            self._stats['sent'] += 1
+        except Exception as e:
+            self._stats['failed'] += 1
+            print(f"Failed to send notification email: {e}")
+
+    def stats(self):
+        return {'pending': self._pending, **self._stats}
+
+
+outbox = MailOutbox()
@@ -0,0 +1,169 @@
+import hmac
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+# Calibration never suggests less work than this, however slow the host
+MIN_SCRYPT_N = 2 ** 14
+MIN_PBKDF2_ITERATIONS = 600000
+
+
+class HasherBusy(Exception):
+    """The hashing pool's queue is full, or a hash waited longer than the timeout."""
+
+    def __init__(self, retry_after=1):
+        super().__init__('Password hashing is saturated')
+        self.retry_after = retry_after
+
+
+def normalize_method(method):
+    """The full Werkzeug method string, e.g. 'scrypt' -> 'scrypt:32768:8:1', as it appears in stored hashes."""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f"Invalid hash method '{method}'.")
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords on a small, bounded thread pool.
+
+    A KDF is meant to be slow, and run on the request thread a burst of
+    logins takes every core and every worker thread with it. Here at most
+    `workers` hashes run at once (hashlib releases the GIL, so they do run in
+    parallel) and at most `queue_size` more wait for a slot; beyond that, or
+    after `timeout` seconds of waiting, callers get HasherBusy and the
+    request answers 503 instead of piling up. Everything else the worker
+    serves keeps its share of the CPU.
+
+    `method` is the Werkzeug method new hashes use; hashes made with any
+    other method still verify, and `needs_rehash()` tells the login view to
+    replace them while it has the plain password. `workers=0` hashes on the
+    calling thread.
+    """
+
+    def __init__(self, app=None):
+        self.method = DEFAULT_METHOD
+        self.workers = 0
+        self.queue_size = 0
+        self.timeout = 10.0
+        self._executor = None
+        self._slots = None
+        self._stats = Counter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = normalize_method(app.config.get('PASSWORD_HASH_METHOD') or DEFAULT_METHOD)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', 1)
+        self.queue_size = app.config.get('PASSWORD_HASH_QUEUE', 32)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', 10.0)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self.workers > 0:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+            self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._stats.clear()
+        app.extensions['passwords'] = self
+
+    def _run(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self._stats['rejected'] += 1
+            raise HasherBusy()
+        start = time.perf_counter()
+        try:
+            future = self._executor.submit(fn, *args)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result = future.result(self.timeout)
+        except TimeoutError:
+            # Still counts against the bound until it finishes; the caller just stops waiting
+            future.cancel()
+            self._stats['timed_out'] += 1
+            raise HasherBusy()
+        self._stats['hashed'] += 1
+        self._stats['wait_ms'] += (time.perf_counter() - start) * 1000
+        return result
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if `pwhash` was made with other parameters than new hashes get."""
+        return bool(pwhash) and not hmac.compare_digest(pwhash.split('$', 1)[0], self.method)
+
+    def stats(self):
+        hashed = self._stats['hashed']
+        return {
+            'method': self.method,
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'hashed': hashed,
+            'rejected': self._stats['rejected'],
+            'timed_out': self._stats['timed_out'],
+            'avg_ms': round(self._stats['wait_ms'] / hashed, 1) if hashed else None,
+        }
+
+
+def time_method(method, rounds=3):
+    """Median seconds one hash with `method` takes on this host."""
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        generate_password_hash('calibration-password', method)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def calibrate(target, algorithm='scrypt', echo=print):
+    """The method for `algorithm` whose hash time on this host is closest to `target` seconds.
+
+    scrypt doubles N (r=8, p=1) from the floor until a hash takes at least
+    `target`; pbkdf2 scales the iteration count linearly from a trial run.
+    Neither goes below the MIN_* floors. Returns (method, seconds per hash).
+    """
+    if algorithm == 'scrypt':
+        n, previous = MIN_SCRYPT_N, None
+        while True:
+            method = f'scrypt:{n}:8:1'
+            elapsed = time_method(method)
+            echo(f"  {method}: {elapsed * 1000:.0f} ms, {128 * n * 8 // 2**20} MiB")
+            if elapsed >= target or n >= 2 ** 20:
+                break
+            previous, n = (method, elapsed), n * 2
+        if previous is not None and target - previous[1] < elapsed - target:
+            return previous
+        return method, elapsed
+    if algorithm == 'pbkdf2':
+        trial = 100000
+        per_iteration = time_method(f'pbkdf2:sha256:{trial}') / trial
+        iterations = max(MIN_PBKDF2_ITERATIONS, round(target / per_iteration, -4))
+        method = f'pbkdf2:sha256:{int(iterations)}'
+        elapsed = time_method(method)
+        echo(f"  {method}: {elapsed * 1000:.0f} ms")
+        return method, elapsed
+    raise ValueError(f"Unknown algorithm '{algorithm}'.")
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,211 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import select, or_, tuple_
+from project import db
+from project.models import (User, Post, Like, Comment, SavedPost, Message, Notification, NotificationArchive,
+                            ContactScore, ConversationRead, FollowSuggestion, PurgeTask, Draft, followers)
+
+# One set-based purge step: rows of `table` matching `where`, addressed by `keys`.
+# `unlink` nulls that column instead of deleting the row; `after` runs with the removed keys.
+Step = namedtuple('Step', 'label table keys where unlink after', defaults=(None, None))
+
+
+def _adjust_counts(column, delta):
+    table = User.__table__
+
+    def after(conn, ids):
+        conn.execute(table.update().where(table.c.id.in_(ids)).values({column: table.c[column] + delta}))
+    return after
+
+
+def user_steps(user_id):
+    post, like, comment, saved = Post.__table__, Like.__table__, Comment.__table__, SavedPost.__table__
+    message, notification = Message.__table__, Notification.__table__
+    archive, contact, suggestion = NotificationArchive.__table__, ContactScore.__table__, FollowSuggestion.__table__
+    read = ConversationRead.__table__
+    own_posts = select(post.c.id).where(post.c.user_id == user_id)
+    return [
+        Step('likes on their posts', like, [like.c.id], like.c.post_id.in_(own_posts)),
+        Step('comments on their posts', comment, [comment.c.id], comment.c.post_id.in_(own_posts)),
+        Step('saves of their posts', saved, [saved.c.id], saved.c.post_id.in_(own_posts)),
+        Step('shares of their posts', message, [message.c.id], message.c.shared_post_id.in_(own_posts),
+             unlink=message.c.shared_post_id),
+        Step('likes', like, [like.c.id], like.c.user_id == user_id),
+        Step('comments', comment, [comment.c.id], comment.c.user_id == user_id),
+        Step('saved posts', saved, [saved.c.id], saved.c.user_id == user_id),
+        Step('notifications', notification, [notification.c.id], notification.c.user_id == user_id),
+        Step('archived notifications', archive, [archive.c.id], archive.c.user_id == user_id),
+        Step('messages', message, [message.c.id],
+             or_(message.c.sender_id == user_id, message.c.recipient_id == user_id)),
+        Step('contact ranking', contact, [contact.c.user_id, contact.c.contact_id],
+             or_(contact.c.user_id == user_id, contact.c.contact_id == user_id)),
+        Step('read markers', read, [read.c.user_id, read.c.contact_id],
+             or_(read.c.user_id == user_id, read.c.contact_id == user_id)),
+        Step('suggestions', suggestion, [suggestion.c.user_id, suggestion.c.suggested_id],
+             or_(suggestion.c.user_id == user_id, suggestion.c.suggested_id == user_id)),
+        Step('followers', followers, [followers.c.follower_id, followers.c.followed_id],
+             followers.c.followed_id == user_id, after=_adjust_counts('following_count', -1)),
+        Step('following', followers, [followers.c.followed_id, followers.c.follower_id],
+             followers.c.follower_id == user_id, after=_adjust_counts('follower_count', -1)),
+        Step('posts', post, [post.c.id], post.c.user_id == user_id),
+        Step('drafts', Draft.__table__, [Draft.__table__.c.id], Draft.__table__.c.user_id == user_id),
+        Step('account', User.__table__, [User.__table__.c.id], User.__table__.c.id == user_id),
+    ]
+
+
+def post_steps(post_id):
+    post, like, comment, saved = Post.__table__, Like.__table__, Comment.__table__, SavedPost.__table__
+    message, notification = Message.__table__, Notification.__table__
+    author_id = select(post.c.user_id).where(post.c.id == post_id).scalar_subquery()
+    return [
+        Step('likes', like, [like.c.id], like.c.post_id == post_id),
+        Step('comments', comment, [comment.c.id], comment.c.post_id == post_id),
+        Step('saves', saved, [saved.c.id], saved.c.post_id == post_id),
+        Step('shares', message, [message.c.id], message.c.shared_post_id == post_id, unlink=message.c.shared_post_id),
+        Step('notifications', notification, [notification.c.id],
+             (notification.c.user_id == author_id) & (notification.c.target == f'post:{post_id}')),
+        Step('post', post, [post.c.id], post.c.id == post_id),
+    ]
+
+
+STEPS = {'user': user_steps, 'post': post_steps}
+
+
+class PurgeJob:
+    """Removes soft-deleted users and posts in bounded, set-based batches.
+
+    Each batch claims at most `batch_size` keys, deletes (or unlinks) exactly
+    those rows and records progress on the PurgeTask row in the same short
+    transaction, so the job can be stopped and resumed at any point and never
+    holds locks for long. Rows are deleted with RETURNING, so follower counters
+    are only adjusted for edges this batch really removed.
+    """
+
+    def __init__(self, batch_size=500, pause=0.0, echo=print):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.echo = echo
+        self.processed = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def _batch(self, conn, task_id, stage, step):
+        key = tuple_(*step.keys) if len(step.keys) > 1 else step.keys[0]
+        claim = select(*step.keys).where(step.where)
+        if step.unlink is not None:
+            claim = claim.where(step.unlink.isnot(None))
+        claim = claim.limit(self.batch_size)
+        if conn.dialect.name == 'postgresql':
+            claim = claim.with_for_update(skip_locked=True)
+        claimed = [tuple(row) if len(step.keys) > 1 else row[0] for row in conn.execute(claim)]
+        if not claimed:
+            return 0, True
+        if step.unlink is not None:
+            done = conn.execute(step.table.update().where(key.in_(claimed)).values({step.unlink.name: None})).rowcount
+        else:
+            removed = conn.execute(step.table.delete().where(key.in_(claimed)).returning(step.keys[0])).scalars().all()
+            if step.after and removed:
+                step.after(conn, removed)
+            done = len(removed)
+        tasks = PurgeTask.__table__
+        conn.execute(tasks.update().where(tasks.c.id == task_id).values(
+            stage=stage, rows_deleted=tasks.c.rows_deleted + done))
+        return done, len(claimed) < self.batch_size
+
+    def run_task(self, task):
+        steps = STEPS[task.kind](task.target_id)
+        tasks = PurgeTask.__table__
+        with db.engine.begin() as conn:
+            conn.execute(tasks.update().where(tasks.c.id == task.id, tasks.c.started_at.is_(None))
+                         .values(started_at=datetime.utcnow()))
+        for stage in range(task.stage, len(steps)):
+            step = steps[stage]
+            total = 0
+            while True:
+                start = time.perf_counter()
+                with db.engine.begin() as conn:
+                    done, finished = self._batch(conn, task.id, stage, step)
+                self.elapsed += time.perf_counter() - start
+                self.processed += done
+                total += done
+                if finished:
+                    break
+                if self.pause:
+                    time.sleep(self.pause)
+            if total:
+                self.echo(f"{task.kind} {task.target_id}: {step.label}: {total} rows")
+            with db.engine.begin() as conn:
+                conn.execute(tasks.update().where(tasks.c.id == task.id).values(stage=stage + 1))
+        with db.engine.begin() as conn:
+            conn.execute(tasks.update().where(tasks.c.id == task.id).values(finished_at=datetime.utcnow(), error=None))
+
+    def run_pending(self, limit=None):
+        """Purges queued tasks oldest first. Returns how many finished."""
+        finished = 0
+        while limit is None or finished < limit:
+            task = (PurgeTask.query.filter(PurgeTask.finished_at.is_(None), PurgeTask.error.is_(None))
+                    .order_by(PurgeTask.id).first())
+            db.session.remove()
+            if task is None:
+                break
+            try:
+                self.run_task(task)
+            except Exception as e:
+                print(f"Failed to purge {task.kind} {task.target_id}: {e}")
+                with db.engine.begin() as conn:
+                    conn.execute(PurgeTask.__table__.update().where(PurgeTask.__table__.c.id == task.id)
+                                 .values(error=str(e)[:255]))
+                continue
+            finished += 1
+        return finished
+
+
+class PurgeService:
+    """Runs PurgeJob on a daemon thread right after a delete is committed."""
+
+    def __init__(self, app=None):
+        self._app = None
+        self._worker = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self.batch_size = 500
+        self.pause = 0.05
+        self.enabled = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.batch_size = app.config.get('PURGE_BATCH_SIZE', 500)
+        self.pause = app.config.get('PURGE_PAUSE', 0.05)
+        self.enabled = app.config.get('PURGE_IN_BACKGROUND', True)
+        app.extensions['purge'] = self
+        self._app = app
+
+    def schedule(self):
+        if not self.enabled or self._app is None:
+            return
+        self._wake.set()
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run_loop, daemon=True)
+            self._worker.start()
+
+    def _run_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                with self._app.app_context():
+                    PurgeJob(batch_size=self.batch_size, pause=self.pause, echo=lambda line: None).run_pending()
+            except Exception as e:
+                print(f"Purge worker error: {e}")
+
+
+purger = PurgeService()
@@ -0,0 +1,317 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+
+from project import db
+
+# A cached result: `value` is pickled so later changes to the request's ORM
+# objects never reach the cache. `versions` are the tag versions it was built
+# from; it is served until `fresh_until`, and while one caller reloads it,
+# others may still get it until `stale_until`.
+Entry = namedtuple('Entry', 'value versions fresh_until stale_until')
+
+
+def attach(instances):
+    """Merges cached (detached) ORM rows into this request's session without querying."""
+    return [db.session.merge(instance, load=False) for instance in instances]
+
+
+class MemoryStore:
+    """Tag versions for a single worker; the LRU in front is the only copy of results."""
+
+    shared = False
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def versions(self, tags):
+        return {tag: self._versions.get(tag, 0) for tag in tags}
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def get(self, key):
+        return None
+
+    def set(self, key, entry):
+        pass
+
+    def try_lock(self, key, seconds):
+        return True
+
+    def unlock(self, key, lock):
+        pass
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+
+
+class SQLiteStore:
+    """Results, tag versions and reload locks in a SQLite file shared by every worker on the host.
+
+    Invalidating a tag bumps its version here, so every worker's LRU sees it
+    on the next read. Same file-per-host approach as the rate limiter's
+    backend, with its own connection per thread.
+    """
+
+    shared = True
+
+    def __init__(self, path, sweep_every=1000):
+        self.path = path
+        self.sweep_every = sweep_every
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS entry (key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                         'versions TEXT NOT NULL, fresh_until REAL NOT NULL, stale_until REAL NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS tag (tag TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS reload (key TEXT PRIMARY KEY, until REAL NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def versions(self, tags):
+        if not tags:
+            return {}
+        tags = list(tags)
+        rows = self._connect().execute(
+            f"SELECT tag, version FROM tag WHERE tag IN ({','.join('?' * len(tags))})", tags).fetchall()
+        return {**dict.fromkeys(tags, 0), **dict(rows)}
+
+    def bump(self, tags):
+        self._connect().executemany(
+            'INSERT INTO tag (tag, version) VALUES (?, 1) ON CONFLICT (tag) DO UPDATE SET version = version + 1',
+            [(tag,) for tag in tags])
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value, versions, fresh_until, stale_until FROM entry WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return Entry(row[0], json.loads(row[1]), row[2], row[3])
+
+    def set(self, key, entry):
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO entry (key, value, versions, fresh_until, stale_until) '
+                     'VALUES (?, ?, ?, ?, ?)',
+                     (key, entry.value, json.dumps(entry.versions), entry.fresh_until, entry.stale_until))
+        self._writes += 1
+        if self._writes % self.sweep_every == 0:
+            conn.execute('DELETE FROM entry WHERE stale_until < ?', (time.time(),))
+
+    def try_lock(self, key, seconds):
+        """Claims the right to reload `key` for `seconds`; a token for unlock(), or None if another worker holds it."""
+        now = time.time()
+        row = self._connect().execute(
+            'INSERT INTO reload (key, until) VALUES (?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET until = excluded.until WHERE until < ? RETURNING until',
+            (key, now + seconds, now)).fetchone()
+        return row[0] if row else None
+
+    def unlock(self, key, lock):
+        # Only the claim we made: if it expired and another worker took over, theirs stays
+        self._connect().execute('DELETE FROM reload WHERE key = ? AND until = ?', (key, lock))
+
+    def clear(self):
+        # Tag versions stay: resetting them could make another worker's outdated copy look current
+        conn = self._connect()
+        conn.execute('DELETE FROM entry')
+        conn.execute('DELETE FROM reload')
+
+
+class QueryCache:
+    """Read-through cache for query results, invalidated by tags.
+
+    `get_or_load(key, loader, tags)` returns what `loader()` returned last
+    time, as long as none of `tags` (e.g. 'user:42:posts') was invalidated
+    since and the TTL hasn't run out. Writers call `invalidate(tag)` after
+    committing. Results live in a per-process LRU, and with the 'sqlite'
+    backend also in a file every worker shares.
+
+    Only one caller per key reloads at a time. While it does, other callers
+    get the expired result if it is within the grace period, or wait for the
+    reload otherwise; an invalidated result is never served. Hits, misses and
+    waits are counted per key prefix (the part before the first ':').
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.ttl = 60
+        self.grace = 30
+        self.max_entries = 2000
+        self.lock_timeout = 5.0
+        self.store = MemoryStore()
+        self._entries = OrderedDict()
+        self._loading = {}  # key -> Event set when its reload finishes
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('QUERY_CACHE_ENABLED', True)
+        self.ttl = app.config.get('QUERY_CACHE_TTL', 60)
+        self.grace = app.config.get('QUERY_CACHE_GRACE', 30)
+        self.max_entries = app.config.get('QUERY_CACHE_MAX_ENTRIES', 2000)
+        if app.config.get('QUERY_CACHE_BACKEND') == 'sqlite':
+            path = app.config.get('QUERY_CACHE_PATH') or os.path.join(app.instance_path, 'query_cache.db')
+            self.store = SQLiteStore(path)
+        else:
+            self.store = MemoryStore()
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+        app.extensions['query_cache'] = self
+
+    def _count(self, namespace, event, amount=1):
+        self._stats[namespace, event] += amount
+
+    def _lookup(self, key):
+        """The entry for `key` if its tags are still current, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.store.shared:
+            entry = self.store.get(key)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is not None and self.store.versions(entry.versions) != entry.versions:
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['*', 'evictions'] += 1
+
+    def get_or_load(self, key, loader, tags=(), ttl=None):
+        """The cached result for `key`, calling `loader()` on a miss. `tags` are the tags that invalidate it."""
+        if not self.enabled:
+            return loader()
+        try:
+            return self._get_or_load(key, loader, tags, ttl)
+        except sqlite3.Error as e:
+            # The shared file is unavailable; serve from the database rather than fail the page
+            print(f"Query cache error: {e}")
+            return loader()
+
+    def _get_or_load(self, key, loader, tags, ttl):
+        namespace = key.split(':', 1)[0]
+        entry = self._lookup(key)
+        now = time.time()
+        if entry is not None and now < entry.fresh_until:
+            self._count(namespace, 'hits')
+            return pickle.loads(entry.value)
+        stale = entry if entry is not None and now < entry.stale_until else None
+
+        with self._lock:
+            done = self._loading.get(key)
+            if done is None:
+                self._loading[key] = threading.Event()
+        if done is not None:
+            # Another thread of this worker is already reloading it
+            if stale is not None:
+                self._count(namespace, 'stale_hits')
+                return pickle.loads(stale.value)
+            self._count(namespace, 'waits')
+            done.wait(self.lock_timeout)
+            entry = self._lookup(key)
+            if entry is not None and time.time() < entry.fresh_until:
+                self._count(namespace, 'hits')
+                return pickle.loads(entry.value)
+            self._count(namespace, 'misses')
+            return loader()
+
+        lock = None
+        try:
+            lock = self.store.try_lock(key, self.lock_timeout)
+            if not lock:
+                # Another worker is reloading it
+                if stale is not None:
+                    self._count(namespace, 'stale_hits')
+                    return pickle.loads(stale.value)
+                self._count(namespace, 'waits')
+                deadline = time.time() + self.lock_timeout
+                while time.time() < deadline:
+                    time.sleep(0.02)
+                    entry = self._lookup(key)
+                    if entry is not None and time.time() < entry.fresh_until:
+                        self._count(namespace, 'hits')
+                        return pickle.loads(entry.value)
+            self._count(namespace, 'misses')
+            # Versions are read before loading, so an invalidation that lands mid-load still wins
+            versions = self.store.versions(tags)
+            start = time.perf_counter()
+            value = loader()
+            self._count(namespace, 'load_ms', (time.perf_counter() - start) * 1000)
+            now = time.time()
+            ttl = self.ttl if ttl is None else ttl
+            entry = Entry(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), versions, now + ttl, now + ttl + self.grace)
+            self._remember(key, entry)
+            self.store.set(key, entry)
+            return value
+        finally:
+            # Only our own lock: releasing another worker's would let a third start the same reload
+            if lock:
+                self.store.unlock(key, lock)
+            with self._lock:
+                self._loading.pop(key).set()
+
+    def invalidate(self, *tags):
+        try:
+            self.store.bump(tags)
+        except Exception as e:
+            # A missed bump would serve stale results, so drop everything this worker holds
+            print(f"Failed to invalidate query cache tags {tags}: {e}")
+            with self._lock:
+                self._entries.clear()
+        self._stats['*', 'invalidations'] += len(tags)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+        self.store.clear()
+
+    def stats(self):
+        """Counters for this worker, per key prefix, with hit ratios."""
+        namespaces = {}
+        for (namespace, event), value in self._stats.items():
+            if namespace != '*':
+                namespaces.setdefault(namespace, {})[event] = round(value, 1)
+        for counts in namespaces.values():
+            served = counts.get('hits', 0) + counts.get('stale_hits', 0)
+            total = served + counts.get('misses', 0)
+            counts['hit_ratio'] = round(served / total, 3) if total else None
+        return {
+            'backend': 'sqlite' if self.store.shared else 'memory',
+            'entries': len(self._entries),
+            'evictions': self._stats['*', 'evictions'],
+            'invalidations': self._stats['*', 'invalidations'],
+            'namespaces': namespaces,
+        }
+
+
+query_cache = QueryCache()
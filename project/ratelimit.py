@@ -0,0 +1,226 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+from flask import request, jsonify, make_response
+from flask_login import current_user
+
+# A token bucket: `capacity` requests at once, refilled at `rate` tokens per second
+Limit = namedtuple('Limit', 'rate capacity')
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Endpoint -> methods it applies to and a bucket per caller kind. Signed-in
+# callers use the 'user' bucket, everyone else the 'ip' bucket.
+# Specs read "<count>/<period>", optionally ";burst=<n>" for a bucket smaller
+# or larger than one period's worth of requests.
+DEFAULT_LIMITS = {
+    'main.search': {'methods': ('GET',), 'user': '60/minute;burst=20', 'ip': '30/minute;burst=10'},
+    'main.comment_post': {'methods': ('POST',), 'user': '20/minute;burst=10'},
+    'main.chat': {'methods': ('POST',), 'user': '60/minute;burst=20'},
+    'main.share_post': {'methods': ('POST',), 'user': '30/minute;burst=10'},
+    'main.register_page': {'methods': ('POST',), 'ip': '10/hour;burst=5'},
+    'main.login_page': {'methods': ('POST',), 'ip': '20/minute;burst=10'},
+    'main.autocomplete': {'methods': ('GET',), 'user': '600/minute;burst=60', 'ip': '300/minute;burst=30'},
+    'main.export_data': {'methods': ('GET',), 'user': '5/hour;burst=3'},
+    'main.autosave_draft': {'methods': ('POST',), 'user': '120/minute;burst=30', 'ip': '60/minute;burst=20'},
+}
+
+
+def parse_limit(spec):
+    """'30/minute;burst=10' -> Limit(rate=0.5, capacity=10)."""
+    rate_part, _, options = spec.partition(';')
+    count, _, period = rate_part.strip().partition('/')
+    count = int(count)
+    seconds = PERIODS[period.strip() or 'second']
+    capacity = count
+    for option in filter(None, (o.strip() for o in options.split(';'))):
+        name, _, value = option.partition('=')
+        if name.strip() != 'burst':
+            raise ValueError(f'Unknown rate limit option {name!r} in {spec!r}')
+        capacity = int(value)
+    return Limit(count / seconds, capacity)
+
+
+class MemoryBackend:
+    """Buckets in a dict; right for a single worker process.
+
+    A bucket that has refilled to capacity behaves exactly like a missing one,
+    so once the dict reaches `max_keys` the full ones are dropped. If that
+    doesn't make room, e.g. under a burst from many addresses at once, the
+    least recently used buckets go too, down to 90% of `max_keys`. Those
+    callers start again with a full bucket.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated, full_at], least recently used first
+        self._lock = threading.Lock()
+
+    def take(self, key, limit, cost=1):
+        """Returns 0 if the request may go ahead, else seconds until it would."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._sweep(now)
+                tokens = limit.capacity
+            else:
+                tokens = min(limit.capacity, bucket[0] + (now - bucket[1]) * limit.rate)
+                self._buckets.move_to_end(key)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / limit.rate
+            self._buckets[key] = [tokens, now, now + (limit.capacity - tokens) / limit.rate]
+        return wait
+
+    def _sweep(self, now):
+        for key in [key for key, bucket in self._buckets.items() if bucket[2] <= now]:
+            del self._buckets[key]
+        # Leaves some room so the next new keys don't each trigger a sweep
+        while len(self._buckets) > self.max_keys * 9 // 10:
+            self._buckets.popitem(last=False)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBackend:
+    """Buckets in a small SQLite file shared by every worker on the host.
+
+    Each check is one upsert that refills, spends and reports in a single
+    statement, so concurrent workers can't both spend the last token. Uses
+    its own file and connection per thread rather than the app database so
+    limiting never queues behind application queries.
+    """
+
+    TAKE_SQL = """
+        INSERT INTO bucket (key, tokens, updated, full_at, allowed)
+        VALUES (:key, :capacity - :cost, :now, :now + :cost / :rate, 1)
+        ON CONFLICT (key) DO UPDATE SET
+            allowed = min(:capacity, tokens + (:now - updated) * :rate) >= :cost,
+            tokens = min(:capacity, tokens + (:now - updated) * :rate)
+                     - CASE WHEN min(:capacity, tokens + (:now - updated) * :rate) >= :cost THEN :cost ELSE 0 END,
+            full_at = :now + (:capacity - min(:capacity, tokens + (:now - updated) * :rate)
+                     + CASE WHEN min(:capacity, tokens + (:now - updated) * :rate) >= :cost THEN :cost ELSE 0 END) / :rate,
+            updated = :now
+        RETURNING tokens, allowed
+    """
+
+    def __init__(self, path, sweep_every=10000):
+        self.path = path
+        self.sweep_every = sweep_every
+        self._local = threading.local()
+        self._calls = 0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS bucket ('
+                         'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, '
+                         'full_at REAL NOT NULL, allowed INTEGER NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, limit, cost=1):
+        conn = self._connect()
+        now = time.time()
+        tokens, allowed = conn.execute(self.TAKE_SQL, {
+            'key': key, 'capacity': float(limit.capacity), 'rate': limit.rate, 'cost': float(cost), 'now': now,
+        }).fetchone()
+        self._calls += 1
+        if self._calls % self.sweep_every == 0:
+            conn.execute('DELETE FROM bucket WHERE full_at <= ?', (now,))
+        return 0.0 if allowed else (cost - tokens) / limit.rate
+
+    def reset(self):
+        self._connect().execute('DELETE FROM bucket')
+
+
+class RateLimiter:
+    """Per-endpoint token buckets, checked before the view runs.
+
+    Rejected requests get 429 with Retry-After and never reach the database.
+    If the shared backend fails the request is let through: a broken limiter
+    should not take the site down with it.
+    """
+
+    def __init__(self, app=None):
+        self.backend = MemoryBackend()
+        self.enabled = True
+        self.rules = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATE_LIMIT_ENABLED', True)
+        if app.config.get('RATE_LIMIT_BACKEND') == 'sqlite':
+            path = app.config.get('RATE_LIMIT_PATH') or os.path.join(app.instance_path, 'ratelimit.db')
+            self.backend = SQLiteBackend(path)
+        else:
+            self.backend = MemoryBackend()
+        self.rules = {}
+        for endpoint, rule in {**DEFAULT_LIMITS, **app.config.get('RATE_LIMITS', {})}.items():
+            self.rules[endpoint] = {
+                'methods': frozenset(rule.get('methods', ('GET', 'POST'))),
+                'user': parse_limit(rule['user']) if rule.get('user') else None,
+                'ip': parse_limit(rule['ip']) if rule.get('ip') else None,
+            }
+        if 'ratelimit' not in app.extensions:
+            app.before_request(self.check_request)
+        app.extensions['ratelimit'] = self
+
+    def bucket_for(self, endpoint):
+        """(key, Limit) for the current caller, or None if the endpoint is not limited for them."""
+        rule = self.rules.get(endpoint)
+        if rule is None or request.method not in rule['methods']:
+            return None
+        if rule['user'] is not None and current_user.is_authenticated:
+            return f'{endpoint}:user:{current_user.id}', rule['user']
+        if rule['ip'] is not None:
+            return f'{endpoint}:ip:{request.remote_addr}', rule['ip']
+        return None
+
+    def check_request(self):
+        if not self.enabled:
+            return None
+        bucket = self.bucket_for(request.endpoint)
+        if bucket is None:
+            return None
+        try:
+            wait = self.backend.take(*bucket)
+        except Exception as e:
+            print(f"Rate limiter error: {e}")
+            return None
+        if wait <= 0:
+            return None
+        return too_many_requests(wait)
+
+
+def too_many_requests(wait):
+    retry_after = max(1, math.ceil(wait))
+    message = f'Too many requests. Please try again in {retry_after} seconds.'
+    if request.accept_mimetypes.best == 'application/json':
+        response = jsonify({"status": "error", "message": message})
+    else:
+        response = make_response(message)
+        response.mimetype = 'text/plain'
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+limiter = RateLimiter()
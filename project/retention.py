@@ -0,0 +1,136 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, or_
+from project import db
+from project.models import Notification, NotificationArchive
+
+ARCHIVE_COLUMNS = ('id', 'user_id', 'message', 'link', 'is_read', 'timestamp', 'kind', 'target', 'actor_count')
+
+
+class RetentionJob:
+    """Moves old read notifications and unread overflow out of the notification table.
+
+    Every batch is its own short transaction that touches at most `batch_size`
+    rows picked by primary key, so the job can run next to live traffic. On
+    Postgres the batch is claimed with FOR UPDATE SKIP LOCKED so rows that a
+    request is currently updating are left for the next run.
+    """
+
+    def __init__(self, batch_size=1000, archive=False, pause=0.0, echo=print):
+        self.batch_size = batch_size
+        self.archive = archive
+        self.pause = pause
+        self.echo = echo
+        self.processed = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def _claim(self, conn, query):
+        query = query.limit(self.batch_size)
+        if conn.dialect.name == 'postgresql':
+            query = query.with_for_update(skip_locked=True)
+        return [row[0] for row in conn.execute(query)]
+
+    def _move(self, conn, ids):
+        table = Notification.__table__
+        if self.archive:
+            archive = NotificationArchive.__table__
+            columns = [table.c[name] for name in ARCHIVE_COLUMNS]
+            conn.execute(
+                archive.insert().from_select(
+                    list(ARCHIVE_COLUMNS) + ['archived_at'],
+                    select(*columns, func.now()).where(table.c.id.in_(ids)),
+                )
+            )
+        conn.execute(table.delete().where(table.c.id.in_(ids)))
+
+    def _run_batches(self, label, build_query, after_batch=None):
+        table_total = 0
+        while True:
+            start = time.perf_counter()
+            with db.engine.begin() as conn:
+                ids = self._claim(conn, build_query())
+                if ids:
+                    self._move(conn, ids)
+                    if after_batch:
+                        after_batch(conn, len(ids))
+            if not ids:
+                break
+            batch_time = time.perf_counter() - start
+            self.processed += len(ids)
+            self.elapsed += batch_time
+            table_total += len(ids)
+            self.echo(f"{label}: {table_total} rows ({len(ids) / batch_time:.0f} rows/s this batch)")
+            if len(ids) < self.batch_size:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+        return table_total
+
+    def prune_read(self, older_than_days):
+        """Archives or deletes read notifications older than `older_than_days`."""
+        table = Notification.__table__
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        return self._run_batches(
+            'read notifications',
+            lambda: select(table.c.id).where(table.c.is_read == True, table.c.timestamp < cutoff).order_by(table.c.id),
+        )
+
+    def compact_unread(self, cap):
+        """Keeps each user's newest `cap` unread notifications and folds the rest into one digest row."""
+        table = Notification.__table__
+        not_digest = or_(table.c.kind.is_(None), table.c.kind != 'digest')
+        with db.engine.connect() as conn:
+            users = conn.execute(
+                select(table.c.user_id)
+                .where(table.c.is_read == False, not_digest)
+                .group_by(table.c.user_id)
+                .having(func.count() > cap)
+            ).scalars().all()
+
+        total = 0
+        for user_id in users:
+            # The newest row past the cap, found before anything is locked: an OFFSET under
+            # SKIP LOCKED would not count rows another run holds and so reach into the kept ones
+            with db.engine.connect() as conn:
+                boundary = conn.execute(
+                    select(table.c.timestamp, table.c.id)
+                    .where(table.c.user_id == user_id, table.c.is_read == False, not_digest)
+                    .order_by(table.c.timestamp.desc(), table.c.id.desc())
+                    .offset(cap).limit(1)
+                ).first()
+            if boundary is None:
+                continue
+
+            def overflow():
+                return (
+                    select(table.c.id)
+                    .where(table.c.user_id == user_id, table.c.is_read == False, not_digest,
+                           or_(table.c.timestamp < boundary.timestamp,
+                               (table.c.timestamp == boundary.timestamp) & (table.c.id <= boundary.id)))
+                    .order_by(table.c.timestamp.desc(), table.c.id.desc())
+                )
+
+            def fold_into_digest(conn, count):
+                digest_id = conn.execute(
+                    select(table.c.id, table.c.actor_count)
+                    .where(table.c.user_id == user_id, table.c.kind == 'digest', table.c.is_read == False)
+                ).first()
+                if digest_id is None:
+                    conn.execute(table.insert().values(
+                        user_id=user_id, kind='digest', target='digest', actor_count=count,
+                        message=f"{count} older notifications were cleared", is_read=False,
+                        timestamp=datetime.utcnow(),
+                    ))
+                else:
+                    new_count = digest_id.actor_count + count
+                    conn.execute(table.update().where(table.c.id == digest_id.id).values(
+                        actor_count=new_count, message=f"{new_count} older notifications were cleared",
+                    ))
+
+            total += self._run_batches(f'unread overflow for user {user_id}', overflow, fold_into_digest)
+        return total
@@ -1,9 +1,24 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, abort, current_app, session
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, abort, current_app, session, Response, stream_with_context, make_response
 from flask_login import login_user, logout_user, current_user, login_required
 from sqlalchemy import or_, and_
-from project.models import User, Post, Message as DBMessage, Like, Comment, Notification, SavedPost
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from project.models import User, Post, Message as DBMessage, Like, Comment, SavedPost, ContactScore, ConversationRead, Draft, comment_previews
 from project.forms import LoginForm, RegistrationForm, PostForm, UpdateProfileForm, MessageForm, UpdatePasswordForm, UpdateEmailForm, DeleteAccountForm, PreferencesForm
 from project import db, oauth, mail
+from project.user_cache import touch_last_seen, invalidate_user, invalidate_follow
+from project.notifications import notifier
+from project.outbox import outbox
+from project.purge import purger
+from project.typeahead import typeahead
+from project.query_cache import query_cache, attach
+from project.snapshots import snapshots
+from project.passwords import HasherBusy
+from project.deliverability import deliverability
+from project.usernames import add_with_free_username, is_username_conflict
+from project.export import export_lines, zip_stream
+from project.suggestions import suggestions_for
+from project.events import broker, user_channel, EventStream
 from flask_mail import Message
 from flask_wtf.csrf import CSRFError
 import secrets
@@ -17,8 +32,7 @@ from datetime import datetime
 @main.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        touch_last_seen(current_user)
 
 def send_verification_email(user):
     token = user.get_verification_token()
@@ -38,27 +52,122 @@ def send_notification_email(user, subject, body):
         return
     msg = Message(subject, recipients=[user.email])
     msg.body = body
-    try:
-        mail.send(msg)
-    except Exception as e:
-        print(f"Failed to send notification email: {e}")
+    # Sent in the background; the request doesn't wait for SMTP
+    outbox.send(msg)
+
+def get_image_url(image_file, folder):
+    if not image_file:
+        # Fallback if somehow empty
+        return url_for('static', filename=f"{folder}/default.jpg") if folder == 'profile_pics' else ''
+    if image_file.startswith('http'):
+        return image_file
+    return url_for('static', filename=f"{folder}/{image_file}")
 
 @main.app_context_processor
 def inject_image_helper():
-    def get_image_url(image_file, folder):
-        if not image_file:
-            # Fallback if somehow empty
-            return url_for('static', filename=f"{folder}/default.jpg") if folder == 'profile_pics' else ''
-        if image_file.startswith('http'):
-            return image_file
-        return url_for('static', filename=f"{folder}/{image_file}")
     return dict(get_image_url=get_image_url)
 
+def wants_json():
+    # Buttons enhanced by base.html send Accept: application/json; plain form posts still get a redirect
+    return request.accept_mimetypes.best == 'application/json'
+
+def comment_payload(comment):
+    return {
+        'id': comment.id,
+        'body': comment.body,
+        'author': comment.author.username,
+        'author_image_url': get_image_url(comment.author.image_file, 'profile_pics'),
+        'timestamp': comment.timestamp.isoformat() + 'Z',
+    }
+
+def previews_for(*post_lists):
+    post_ids = {post.id for posts in post_lists for post in posts}
+    return comment_previews(post_ids, current_app.config['COMMENT_PREVIEW_COUNT'])
+
+def cached_posts(user_id):
+    # A user's live posts, newest first; shared by their public page and their profile
+    return attach(query_cache.get_or_load(
+        f'user_posts:{user_id}',
+        lambda: Post.feed().filter_by(user_id=user_id).order_by(Post.timestamp.desc()).all(),
+        tags=(f'user:{user_id}:posts',)))
+
+def cached_saved_posts(user_id):
+    # Saved posts are other people's, so any edit or delete ('posts') invalidates them too
+    return attach(query_cache.get_or_load(
+        f'saved_posts:{user_id}',
+        lambda: Post.feed().join(SavedPost).filter(SavedPost.user_id == user_id)
+                    .order_by(SavedPost.timestamp.desc()).all(),
+        tags=(f'user:{user_id}:saved', 'posts')))
+
+def invalidate_posts(user_id, edited=False):
+    query_cache.invalidate(f'user:{user_id}:posts', *(('posts',) if edited else ()))
+    snapshots.mark_stale()
+
+def current_draft(create=False):
+    """The draft being written in this session; signed-in users fall back to their latest draft."""
+    key = session.get('draft_id')
+    draft = Draft.query.filter_by(key=key).first() if key else None
+    if draft is not None and draft.user_id is not None and (
+            not current_user.is_authenticated or draft.user_id != current_user.id):
+        draft = None
+    if draft is None and current_user.is_authenticated:
+        draft = Draft.query.filter_by(user_id=current_user.id).order_by(Draft.updated_at.desc()).first()
+    if draft is None and create:
+        draft = Draft(key=secrets.token_urlsafe(16), body='', version=0,
+                      user_id=current_user.id if current_user.is_authenticated else None)
+        db.session.add(draft)
+    if draft is None:
+        session.pop('draft_id', None)
+        return None
+    if draft.user_id is None and current_user.is_authenticated:
+        draft.user_id = current_user.id
+    if session.get('draft_id') != draft.key:
+        session['draft_id'] = draft.key
+    return draft
+
+def claim_session_draft(user_id):
+    # Only the draft key lives in the cookie; the text stays in the draft table
+    return Draft.claim(session.get('draft_id'), user_id)
+
+def message_payload(msg):
+    payload = {
+        'id': msg.id,
+        'sender_id': msg.sender_id,
+        'recipient_id': msg.recipient_id,
+        'sender': msg.author.username,
+        'body': msg.body or '',
+        'image_url': get_image_url(msg.image_file, 'message_pics') if msg.image_file else None,
+        'shared_post': None,
+        'timestamp': msg.timestamp.isoformat() + 'Z',
+    }
+    if msg.shared_post:
+        payload['shared_post'] = {
+            'title': msg.shared_post.title,
+            'author': msg.shared_post.author.username,
+            'url': url_for('main.user_posts', username=msg.shared_post.author.username),
+        }
+    return payload
+
+def publish_message(msg):
+    # Both sides get the message so every open tab of either user stays in sync
+    payload = message_payload(msg)
+    broker.publish_to_user(msg.recipient_id, 'message', payload)
+    broker.publish_to_user(msg.sender_id, 'message', payload)
+    broker.publish_to_user(msg.recipient_id, 'unread', {'messages': msg.recipient.new_messages()})
+
 @main.errorhandler(CSRFError)
 def handle_csrf_error(e):
     flash('Security token missing or invalid. Please try again.', 'danger')
     return redirect(request.referrer or url_for('main.main_page'))
 
+@main.errorhandler(HasherBusy)
+def handle_hasher_busy(e):
+    # The password hashing pool is full: turn the burst away rather than queue it behind every other request
+    response = make_response('Too many sign-ins at once. Please try again in a moment.', 503)
+    response.mimetype = 'text/plain'
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 import cloudinary
 import cloudinary.uploader
 
@@ -92,26 +201,37 @@ def save_picture(form_picture, folder):
     # Cloudinary return a JSON blob, we just want the direct image URL string to save to our Database
     return response.get("secure_url")
 
+def explore_feed():
+    return anonymous_feed("Explore Feed")
+
+def anonymous_feed(title=None):
+    # What logged-out visitors see on / and /explore; rendered into page snapshots.
+    # index.html shows them the landing page, not posts, so nothing is queried
+    return render_template('index.html', posts=[], title=title, suggestions=[], previews={})
+
 @main.route('/')
 def main_page():
-    if current_user.is_authenticated:
-        posts_query = current_user.followed_posts()
-        if current_user.feed_sorting == 'popular':
-            from sqlalchemy import func
-            posts = posts_query.outerjoin(Like).group_by(Post.id).order_by(func.count(Like.id).desc(), Post.timestamp.desc()).all()
-        else:
-            posts = posts_query.all()
+    if not current_user.is_authenticated:
+        return snapshots.serve(anonymous_feed) or anonymous_feed()
+    posts_query = current_user.followed_posts().options(db.defer(Post.body))
+    if current_user.feed_sorting == 'popular':
+        from sqlalchemy import func
+        posts = posts_query.outerjoin(Like).group_by(Post.id).order_by(func.count(Like.id).desc(), Post.timestamp.desc()).all()
     else:
-        posts = Post.query.order_by(Post.timestamp.desc()).all()
-    return render_template('index.html', posts=posts)
+        posts = posts_query.all()
+    suggestions = suggestions_for(current_user.id)
+    return render_template('index.html', posts=posts, suggestions=suggestions, previews=previews_for(posts))
 
 @main.route('/explore')
 def explore_page():
-    posts = Post.query.order_by(Post.timestamp.desc()).all()
-    if current_user.is_authenticated and current_user.feed_sorting == 'popular':
+    if not current_user.is_authenticated:
+        return snapshots.serve(explore_feed) or explore_feed()
+    if current_user.feed_sorting == 'popular':
         from sqlalchemy import func
-        posts = Post.query.outerjoin(Like).group_by(Post.id).order_by(func.count(Like.id).desc(), Post.timestamp.desc()).all()
-    return render_template('index.html', posts=posts, title="Explore Feed")
+        posts = Post.feed().outerjoin(Like).group_by(Post.id).order_by(func.count(Like.id).desc(), Post.timestamp.desc()).all()
+    else:
+        posts = Post.feed().order_by(Post.timestamp.desc()).all()
+    return render_template('index.html', posts=posts, title="Explore Feed", previews=previews_for(posts))
 
 @main.route("/register", methods=['GET', 'POST'])
 def register_page():
@@ -119,12 +239,26 @@ def register_page():
         return redirect(url_for('main.main_page'))
     
     form = RegistrationForm() # Step 1: Initialize the form
+    # Resolve the common mail domains while the visitor fills the form in
+    deliverability.ensure_warm()
     
     if form.validate_on_submit(): # Step 2: Use validate_on_submit
         user = User(username=form.username.data, email=form.email.data, is_verified=False)
         user.set_password(form.password.data)
         db.session.add(user)
+        try:
+            db.session.flush()
+        except IntegrityError as e:
+            # Someone registered the same name or email after the form was validated
+            db.session.rollback()
+            if is_username_conflict(e):
+                form.username.errors.append('That username is already taken.')
+            else:
+                form.email.errors.append('That email is already in use.')
+            return render_template('register.html', form=form)
+        claim_session_draft(user.id)
         db.session.commit()
+        typeahead.user_added(user.username)
         
         try:
             send_verification_email(user)
@@ -149,8 +283,9 @@ def verify_token_route(token):
     
     user.is_verified = True
     db.session.commit()
+    invalidate_user(user.id)
     flash('Your account has been verified successfully! You may now log in.', 'success')
-    if 'draft_post' in session:
+    if 'draft_id' in session:
         return redirect(url_for('main.login_page', next=url_for('main.create_post')))
     return redirect(url_for('main.login_page'))
 
@@ -167,8 +302,16 @@ def login_page():
                 flash('Please check your email and click the verification link before logging in.', 'warning')
                 return redirect(url_for('main.login_page'))
             login_user(user, remember=form.remember_me.data)
+            # Stored hashes move to the current PASSWORD_HASH_METHOD as their owners log in.
+            # The user is signed in by now, so a busy hasher just postpones it to a later login
+            try:
+                rehashed = user.rehash_password(form.password.data)
+            except HasherBusy:
+                rehashed = False
+            if claim_session_draft(user.id) or rehashed:
+                db.session.commit()
             next_page = request.args.get('next')
-            if 'draft_post' in session:
+            if 'draft_id' in session:
                 return redirect(url_for('main.create_post'))
             return redirect(next_page) if next_page else redirect(url_for('main.profile_page'))
         else:
@@ -209,32 +352,28 @@ def google_authorize():
         # Create new user
         # Generate a unique username based on email or name
         base_username = user_info.get('name', '').replace(' ', '').lower() or email.split('@')[0]
-        # Ensure username is unique
-        username = base_username
-        counter = 1
-        while User.query.filter_by(username=username).first():
-            username = f"{base_username}{counter}"
-            counter += 1
-            
         user = User(
-            username=username,
             email=email,
             is_verified=True
             # password_hash is optional/nullable, so we can leave it empty
             # or set a random unguessable password if desired
         )
-        db.session.add(user)
-        db.session.commit()
+        # First free name among base_username, base_username1, ... in one query, retried if a concurrent sign-up takes it
+        add_with_free_username(user, base_username)
+        typeahead.user_added(user.username)
         flash('Account created via Google!', 'success')
     else:
         # Guarantee existing Google users are verified retroactively
         if not getattr(user, 'is_verified', True):
             user.is_verified = True
             db.session.commit()
+            invalidate_user(user.id)
         flash('Logged in via Google!', 'success')
 
     login_user(user)
-    if 'draft_post' in session:
+    if claim_session_draft(user.id):
+        db.session.commit()
+    if 'draft_id' in session:
         return redirect(url_for('main.create_post'))
     return redirect(url_for('main.main_page'))
 
@@ -247,18 +386,18 @@ def create_post():
             picture_file = save_picture(form.picture.data, 'post_pics')
             
         if not current_user.is_authenticated:
-            session['draft_post'] = {
-                'title': form.title.data,
-                'body': form.body.data,
-                'author_name': form.author_name.data,
-                'tags': form.tags.data,
-                'picture_file': picture_file
-            }
+            draft = current_draft(create=True)
+            draft.apply_patch({'title': form.title.data, 'body': form.body.data,
+                               'author_name': form.author_name.data, 'tags': form.tags.data})
+            if picture_file:
+                draft.image_file = picture_file
+            db.session.commit()
             flash('Please log in or register to publish your post. Your draft has been saved!', 'info')
             return redirect(url_for('main.login_page', next=url_for('main.create_post')))
 
-        if not picture_file and 'draft_post' in session and session['draft_post'].get('picture_file'):
-            picture_file = session['draft_post']['picture_file']
+        draft = current_draft()
+        if not picture_file and draft is not None:
+            picture_file = draft.image_file
 
         post = Post(
             title=form.title.data, 
@@ -266,28 +405,65 @@ def create_post():
             author_name=form.author_name.data,
             tags=form.tags.data,
             image_file=picture_file,
-            author=current_user
+            user_id=current_user.id
         )
         db.session.add(post)
+        if draft is not None:
+            db.session.delete(draft)
+            session.pop('draft_id', None)
         db.session.commit()
+        invalidate_posts(current_user.id)
+        typeahead.tags_changed(None, post.tags)
         flash('Post created!', 'success')
-        if 'draft_post' in session:
-            session.pop('draft_post')
         return redirect(url_for('main.main_page'))
     
-    if request.method == 'GET' and 'draft_post' in session:
-        draft = session['draft_post']
-        form.title.data = draft.get('title', '')
-        form.body.data = draft.get('body', '')
-        form.author_name.data = draft.get('author_name', '')
-        form.tags.data = draft.get('tags', '')
+    draft = current_draft()
+    if request.method == 'GET' and draft is not None:
+        form.title.data = draft.title or ''
+        form.body.data = draft.body
+        form.author_name.data = draft.author_name or ''
+        form.tags.data = draft.tags or ''
+        db.session.commit() # keeps a draft claimed above
     
-    return render_template('create_post.html', form=form, legend='Create New Post', title='New Post')
+    return render_template('create_post.html', form=form, legend='Create New Post', title='New Post', draft=draft)
+
+@main.route('/drafts/autosave', methods=['POST'])
+def autosave_draft():
+    """Saves the editor's changes since its last save.
+
+    JSON: {"version": <version the editor last saw>, "title"/"author_name"/"tags": ...,
+    "splice": {"start", "end", "text"}} or "body" for the whole text. A version
+    mismatch (another tab saved first) returns 409 with the stored draft so the
+    editor can resend its full body.
+    """
+    patch = request.get_json(silent=True)
+    if not isinstance(patch, dict):
+        return jsonify({"status": "error", "message": "Expected a JSON object."}), 400
+    draft = current_draft(create=True)
+    if draft.id is not None and patch.get('version') != draft.version and 'body' not in patch:
+        return draft_conflict(draft)
+    try:
+        draft.apply_patch(patch)
+    except (KeyError, TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        db.session.commit()
+    except StaleDataError:
+        # Another tab saved after we read the draft; our change was made against an old version
+        db.session.rollback()
+        return draft_conflict(current_draft(create=True))
+    return jsonify({"status": "success", "version": draft.version, "saved_at": draft.updated_at.isoformat() + 'Z'})
+
+def draft_conflict(draft):
+    return jsonify({"status": "conflict", "version": draft.version, "draft": {
+        "title": draft.title, "author_name": draft.author_name, "tags": draft.tags, "body": draft.body,
+    }}), 409
 
 @main.route('/post/<int:post_id>/update', methods=['GET', 'POST'])
 @login_required
 def update_post(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = Post.live().filter_by(id=post_id).first_or_404()
     if post.author != current_user and not current_user.is_developer:
         abort(403)
     form = PostForm()
@@ -298,8 +474,10 @@ def update_post(post_id):
         post.title = form.title.data
         post.body = form.body.data
         post.author_name = form.author_name.data
-        post.tags = form.tags.data
+        old_tags, post.tags = post.tags, form.tags.data
         db.session.commit()
+        invalidate_posts(post.user_id, edited=True)
+        typeahead.tags_changed(old_tags, post.tags)
         flash('Your post has been updated!', 'success')
         return redirect(url_for('main.main_page'))
     elif request.method == 'GET':
@@ -313,12 +491,15 @@ def update_post(post_id):
 @login_required
 def delete_post(post_id):
     print(f"DEBUG: Attempting to delete post {post_id}")
-    post = Post.query.get_or_404(post_id)
+    post = Post.live().filter_by(id=post_id).first_or_404()
     if post.author != current_user and not current_user.is_developer:
         print(f"DEBUG: Permission denied for user {current_user}")
         abort(403)
-    db.session.delete(post)
+    post.soft_delete()
     db.session.commit()
+    invalidate_posts(post.user_id, edited=True)
+    purger.schedule()
+    typeahead.tags_changed(post.tags, None)
     flash('Your post has been deleted!', 'success')
     print(f"DEBUG: Post {post_id} deleted successfully")
     
@@ -335,59 +516,83 @@ def delete_post(post_id):
 @main.route('/post/<int:post_id>/like', methods=['POST'])
 @login_required
 def like_post(post_id):
-    post = Post.query.get_or_404(post_id)
-    like = Like.query.filter_by(user_id=current_user.id, post_id=post_id).first()
-    
-    if like:
-        db.session.delete(like)
-        db.session.commit()
-    else:
-        new_like = Like(user_id=current_user.id, post_id=post_id)
-        db.session.add(new_like)
-        if post.author != current_user:
-            notif = Notification(user_id=post.author.id, message=f"{current_user.username} liked your post '{post.title[:20]}...'", link=url_for('main.user_posts', username=current_user.username))
-            db.session.add(notif)
-            send_notification_email(post.author, 'New Like on Writer\'s Hub', f"{current_user.username} liked your post '{post.title}'.")
-        db.session.commit()
-        
+    post = Post.live().filter_by(id=post_id).first_or_404()
+    liked, changed = Like.toggle(current_user.id, post_id)
+    db.session.commit()
+
+    if liked and changed and post.author != current_user:
+        notifier.notify(post.author.id, 'like', f'post:{post.id}', current_user.id, current_user.username, f"liked your post '{post.title[:20]}...'", link=url_for('main.user_posts', username=current_user.username))
+        send_notification_email(post.author, 'New Like on Writer\'s Hub', f"{current_user.username} liked your post '{post.title}'.")
+
+    if wants_json():
+        return jsonify({"status": "success", "liked": liked, "likes": post.likes.count()})
     return redirect(request.referrer or url_for('main.main_page'))
 
 @main.route('/post/<int:post_id>/comment', methods=['POST'])
 @login_required
 def comment_post(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = Post.live().filter_by(id=post_id).first_or_404()
     body = request.form.get('body')
     
+    if not (body and body.strip()) and wants_json():
+        return jsonify({"status": "error", "message": "Comment cannot be empty."}), 400
+
     if body and body.strip():
         comment = Comment(body=body.strip(), user_id=current_user.id, post_id=post_id)
         db.session.add(comment)
+        db.session.commit()
+        # After the commit: a write-through notification must not wait on this request's transaction
         if post.author != current_user:
-            notif = Notification(user_id=post.author.id, message=f"{current_user.username} commented on your post '{post.title[:20]}...'", link=url_for('main.user_posts', username=current_user.username))
-            db.session.add(notif)
+            notifier.notify(post.author.id, 'comment', f'post:{post.id}', current_user.id, current_user.username, f"commented on your post '{post.title[:20]}...'", link=url_for('main.user_posts', username=current_user.username))
             send_notification_email(post.author, 'New Comment on Writer\'s Hub', f"{current_user.username} commented on your post '{post.title}':\n\n\"{body.strip()}\"")
-        db.session.commit()
+        if wants_json():
+            return jsonify({"status": "success", "comment": comment_payload(comment), "comments": post.comments.count()})
         flash('Comment added successfully!', 'success')
     else:
         flash('Comment cannot be empty.', 'danger')
         
     return redirect(request.referrer or url_for('main.main_page'))
 
+@main.route('/post/<int:post_id>/body')
+def post_body(post_id):
+    """Full text of a post; feeds only render the excerpt and fetch this when a post is expanded."""
+    body = db.session.execute(db.select(Post.body).where(Post.id == post_id, Post.deleted_at.is_(None))).scalar()
+    if body is None:
+        abort(404)
+    return jsonify({"body": body})
+
+@main.route('/post/<int:post_id>/comments')
+def post_comments(post_id):
+    """Older comments of a thread, newest page first: ?before=<comment id>."""
+    Post.live().filter_by(id=post_id).first_or_404()
+    page_size = current_app.config['COMMENT_PAGE_SIZE']
+    query = Comment.query.options(db.joinedload(Comment.author)).filter(Comment.post_id == post_id)
+    before = request.args.get('before', type=int)
+    if before:
+        query = query.filter(Comment.id < before)
+    comments = query.order_by(Comment.id.desc()).limit(page_size + 1).all()
+    has_more = len(comments) > page_size
+    comments = comments[:page_size][::-1]
+    return jsonify({
+        "comments": [comment_payload(c) for c in comments],
+        "has_more": has_more,
+        "next": url_for('main.post_comments', post_id=post_id, before=comments[0].id) if has_more else None,
+    })
+
 @main.route('/post/<int:post_id>/save', methods=['POST'])
 @login_required
 def save_post(post_id):
-    post = Post.query.get_or_404(post_id)
-    saved_post = SavedPost.query.filter_by(user_id=current_user.id, post_id=post_id).first()
-    
-    if saved_post:
-        db.session.delete(saved_post)
-        db.session.commit()
-        flash('Post removed from saved posts.', 'info')
-    else:
-        new_save = SavedPost(user_id=current_user.id, post_id=post_id)
-        db.session.add(new_save)
-        db.session.commit()
+    Post.live().filter_by(id=post_id).first_or_404()
+    saved, _ = SavedPost.toggle(current_user.id, post_id)
+    db.session.commit()
+    query_cache.invalidate(f'user:{current_user.id}:saved')
+
+    if wants_json():
+        return jsonify({"status": "success", "saved": saved})
+    if saved:
         flash('Post saved successfully!', 'success')
-        
+    else:
+        flash('Post removed from saved posts.', 'info')
     return redirect(request.referrer or url_for('main.main_page'))
 
 @main.route('/logout')
@@ -405,16 +610,21 @@ def profile_page():
         if form.picture.data:
             picture_file = save_picture(form.picture.data, 'profile_pics')
             current_user.image_file = picture_file
-        if form.username.data != current_user.username:
+        old_username = current_user.username
+        if form.username.data != old_username:
             current_user.username = form.username.data
         db.session.commit()
+        invalidate_user(current_user.id)
+        snapshots.mark_stale()  # feeds show the author's name and picture
+        if current_user.username != old_username:
+            typeahead.user_renamed(old_username, current_user.username)
         flash('Your profile has been updated!', 'success')
         return redirect(url_for('main.profile_page'))
     elif request.method == 'GET':
         form.username.data = current_user.username
 
     # Fetch only posts belonging to the logged-in user
-    user_posts = Post.query.filter_by(author=current_user).order_by(Post.timestamp.desc()).all()
+    user_posts = cached_posts(current_user.id)
     
     # Check if Cloudinary HTTP or Local Default
     if current_user.image_file and current_user.image_file.startswith('http'):
@@ -424,9 +634,9 @@ def profile_page():
         image_file = url_for('static', filename='profile_pics/' + img_fn)
         
     # Fetch saved posts
-    saved_posts = Post.query.join(SavedPost).filter(SavedPost.user_id == current_user.id).order_by(SavedPost.timestamp.desc()).all()
+    saved_posts = cached_saved_posts(current_user.id)
         
-    return render_template('profile.html', username=current_user.username, posts=user_posts, form=form, image_file=image_file, saved_posts=saved_posts)
+    return render_template('profile.html', username=current_user.username, posts=user_posts, form=form, image_file=image_file, saved_posts=saved_posts, previews=previews_for(user_posts, saved_posts))
 
 @main.route('/settings', methods=['GET', 'POST'])
 @login_required
@@ -438,6 +648,7 @@ def settings_page():
     
     # Pre-populate forms
     if request.method == 'GET':
+        deliverability.ensure_warm()
         email_form.email.data = current_user.email
         prefs_form.msg_preference.data = current_user.msg_preference
         prefs_form.profile_visibility.data = current_user.profile_visibility
@@ -455,6 +666,7 @@ def settings_page():
         current_user.feed_sorting = prefs_form.feed_sorting.data
         current_user.accent_color = prefs_form.accent_color.data
         db.session.commit()
+        invalidate_user(current_user.id)
         flash('Preferences updated successfully!', 'success')
         return redirect(url_for('main.settings_page'))
     if 'submit_password' in request.form and password_form.validate_on_submit():
@@ -469,14 +681,19 @@ def settings_page():
     if 'submit_email' in request.form and email_form.validate_on_submit():
         current_user.email = email_form.email.data
         db.session.commit()
+        invalidate_user(current_user.id)
         flash('Your email address has been updated!', 'success')
         return redirect(url_for('main.settings_page'))
         
     if 'submit_delete' in request.form and delete_form.validate_on_submit():
         user = User.query.get(current_user.id)
         logout_user()
-        db.session.delete(user)
+        typeahead.user_removed(user.username)
+        user.soft_delete()
         db.session.commit()
+        invalidate_user(user.id)
+        invalidate_posts(user.id, edited=True)
+        purger.schedule()
         flash('Your account has been permanently deleted.', 'info')
         return redirect(url_for('main.main_page'))
 
@@ -486,14 +703,45 @@ def settings_page():
                            delete_form=delete_form,
                            prefs_form=prefs_form)
 
+def export_response(user):
+    # Streamed straight from a server-side cursor; ?format=zip wraps the same NDJSON in a zip
+    name = f"writers-hub-{user.username}-{datetime.utcnow():%Y%m%d}"
+    body = export_lines(user.id)
+    if request.args.get('format') == 'zip':
+        body, mimetype, name = zip_stream(body), 'application/zip', name + '.zip'
+    else:
+        mimetype, name = 'application/x-ndjson', name + '.ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
+@main.route('/settings/export')
+@login_required
+def export_data():
+    return export_response(current_user)
+
+@main.route('/user/<int:user_id>/export')
+@login_required
+def admin_export_user(user_id):
+    if not current_user.is_developer:
+        abort(403)
+    return export_response(User.live().filter_by(id=user_id).first_or_404())
+
+@main.route('/admin/cache')
+@login_required
+def cache_stats():
+    """Query cache hit/miss counters for the worker that serves this request."""
+    if not current_user.is_developer:
+        abort(403)
+    return jsonify(query_cache.stats())
+
 @main.route('/search')
 def search():
     query = request.args.get('q')
     if query:
         # Search users by username (case insensitive)
-        users = User.query.filter(User.username.ilike(f'%{query}%')).all()
+        users = User.live().filter(User.username.ilike(f'%{query}%')).all()
         # Search posts by author name or tags
-        posts = Post.query.filter(
+        posts = Post.feed().filter(
             or_(
                 Post.author_name.ilike(f'%{query}%'),
                 Post.tags.ilike(f'%{query}%')
@@ -503,30 +751,55 @@ def search():
         users = []
         posts = []
     
-    return render_template('search_results.html', users=users, posts=posts, query=query)
+    return render_template('search_results.html', users=users, posts=posts, query=query, previews=previews_for(posts))
+
+@main.route('/autocomplete')
+def autocomplete():
+    """Typeahead for the search and share boxes: ?q=<prefix>&kind=users|tags|all, served from memory."""
+    q = (request.args.get('q') or '').strip()
+    kind = request.args.get('kind', 'all')
+    limit = min(request.args.get('limit', 8, type=int), 20)
+    if q[:1] in ('@', '#'):
+        kind = 'users' if q[0] == '@' else 'tags'
+        q = q[1:]
+    if not q:
+        return jsonify({"users": [], "tags": []})
+    typeahead.ensure_built()
+    users = typeahead.users.search(q, limit) if kind in ('users', 'all') else []
+    tags = typeahead.tags.search(q, limit) if kind in ('tags', 'all') else []
+    return jsonify({
+        "users": [{"username": name, "followers": count, "url": url_for('main.user_posts', username=name)}
+                  for name, count in users],
+        "tags": [{"tag": tag, "posts": count, "url": url_for('main.search', q=tag)} for tag, count in tags],
+    })
 
 @main.route('/user/<username>')
 def user_posts(username):
     from urllib.parse import unquote
     username = unquote(username)
-    user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(author=user).order_by(Post.timestamp.desc()).all()
-    return render_template('index.html', posts=posts, user=user, title=f"Posts by {user.username}")
+    user = User.live().filter_by(username=username).first_or_404()
+    posts = cached_posts(user.id)
+    return render_template('index.html', posts=posts, user=user, title=f"Posts by {user.username}", previews=previews_for(posts))
 
 @main.route('/user/<int:user_id>/admin_delete', methods=['POST'])
 @login_required
 def admin_delete_user(user_id):
     if not current_user.is_developer:
         abort(403)
-    user = User.query.get_or_404(user_id)
+    user = User.live().filter_by(id=user_id).first_or_404()
     if user == current_user:
         flash("You cannot delete your own account via this button.", "warning")
         return redirect(request.referrer or url_for('main.main_page'))
     
-    # Cascade delete is handled by database, but we manually delete user
-    db.session.delete(user)
+    # Hidden now; the purge job removes the account's data in batches
+    username = user.username
+    typeahead.user_removed(username)
+    user.soft_delete()
     db.session.commit()
-    flash(f"Account for '{user.username}' and all associated data was permanently deleted.", "success")
+    invalidate_user(user_id)
+    invalidate_posts(user_id, edited=True)
+    purger.schedule()
+    flash(f"Account for '{username}' and all associated data was permanently deleted.", "success")
     return redirect(url_for('main.main_page'))
 
 @main.route('/follow/<username>', methods=['POST'])
@@ -534,18 +807,27 @@ def admin_delete_user(user_id):
 def follow(username):
     from urllib.parse import unquote
     username = unquote(username)
-    user = User.query.filter_by(username=username).first()
+    user = User.live().filter_by(username=username).first()
     if user is None:
+        if wants_json():
+            return jsonify({"status": "error", "message": f'User {username} not found.'}), 404
         flash(f'User {username} not found.', 'danger')
         return redirect(url_for('main.main_page'))
     if user == current_user:
+        if wants_json():
+            return jsonify({"status": "error", "message": 'You cannot follow yourself!'}), 400
         flash('You cannot follow yourself!', 'warning')
         return redirect(url_for('main.user_posts', username=username))
-    current_user.follow(user)
-    notif = Notification(user_id=user.id, message=f"{current_user.username} started following you", link=url_for('main.user_posts', username=current_user.username))
-    db.session.add(notif)
-    send_notification_email(user, 'New Follower on Writer\'s Hub', f"{current_user.username} started following you on Writer's Hub!")
+    followed = current_user.follow(user)
     db.session.commit()
+    if followed:
+        notifier.notify(user.id, 'follow', f'user:{user.id}', current_user.id, current_user.username, "started following you", link=url_for('main.user_posts', username=current_user.username))
+        send_notification_email(user, 'New Follower on Writer\'s Hub', f"{current_user.username} started following you on Writer's Hub!")
+    invalidate_follow(current_user.id, user.id)
+    query_cache.invalidate(f'user:{user.id}:followers', f'user:{current_user.id}:following')
+    typeahead.followers_changed(user.username, user.follower_count)
+    if wants_json():
+        return jsonify({"status": "success", "following": True, "followers": user.follower_count})
     flash(f'You are following {username}!', 'success')
     return redirect(request.referrer or url_for('main.user_posts', username=username))
 
@@ -554,25 +836,48 @@ def follow(username):
 def unfollow(username):
     from urllib.parse import unquote
     username = unquote(username)
-    user = User.query.filter_by(username=username).first()
+    user = User.live().filter_by(username=username).first()
     if user is None:
+        if wants_json():
+            return jsonify({"status": "error", "message": f'User {username} not found.'}), 404
         flash(f'User {username} not found.', 'danger')
         return redirect(url_for('main.main_page'))
     if user == current_user:
+        if wants_json():
+            return jsonify({"status": "error", "message": 'You cannot unfollow yourself!'}), 400
         flash('You cannot unfollow yourself!', 'warning')
         return redirect(url_for('main.user_posts', username=username))
     current_user.unfollow(user)
     db.session.commit()
+    invalidate_follow(current_user.id, user.id)
+    query_cache.invalidate(f'user:{user.id}:followers', f'user:{current_user.id}:following')
+    typeahead.followers_changed(user.username, user.follower_count)
+    if wants_json():
+        return jsonify({"status": "success", "following": False, "followers": user.follower_count})
     flash(f'You are not following {username}.', 'info')
     return redirect(request.referrer or url_for('main.user_posts', username=username))
 
+@main.route('/suggestions')
+@login_required
+def follow_suggestions():
+    limit = min(request.args.get('limit', 5, type=int), 20)
+    return jsonify({"suggestions": [{
+        "username": row.suggested.username,
+        "image_url": get_image_url(row.suggested.image_file, 'profile_pics'),
+        "url": url_for('main.user_posts', username=row.suggested.username),
+        "mutual_count": row.mutual_count,
+        "shared_likes": row.shared_likes,
+    } for row in suggestions_for(current_user.id, limit)]})
+
 @main.route('/user/<username>/followers')
 @login_required
 def followers(username):
     from urllib.parse import unquote
     username = unquote(username)
-    user = User.query.filter_by(username=username).first_or_404()
-    users = user.followers.all()
+    user = User.live().filter_by(username=username).first_or_404()
+    users = attach(query_cache.get_or_load(
+        f'followers:{user.id}', lambda: user.followers.filter(User.deleted_at.is_(None)).all(),
+        tags=(f'user:{user.id}:followers',)))
     return render_template('users_list.html', users=users, user=user, title="Followers")
 
 @main.route('/user/<username>/following')
@@ -580,8 +885,10 @@ def followers(username):
 def following(username):
     from urllib.parse import unquote
     username = unquote(username)
-    user = User.query.filter_by(username=username).first_or_404()
-    users = user.followed.all()
+    user = User.live().filter_by(username=username).first_or_404()
+    users = attach(query_cache.get_or_load(
+        f'following:{user.id}', lambda: user.followed.filter(User.deleted_at.is_(None)).all(),
+        tags=(f'user:{user.id}:following',)))
     return render_template('users_list.html', users=users, user=user, title="Following")
 
 @main.route("/messages")
@@ -603,26 +910,31 @@ def messages():
             if other_user:
                 chat_users.append({'user': other_user, 'last_message': msg})
                 
-    return render_template('messages.html', chat_users=chat_users, title="Messages")
+    return render_template('messages.html', chat_users=chat_users, title="Messages",
+                           unread_counts=ConversationRead.unread_counts(current_user.id),
+                           read_by=ConversationRead.read_by(current_user.id))
 
 @main.route("/chat/<username>", methods=['GET', 'POST'])
 @login_required
 def chat(username):
     from urllib.parse import unquote
     username = unquote(username)
-    user = User.query.filter_by(username=username).first_or_404()
+    user = User.live().filter_by(username=username).first_or_404()
     if user == current_user:
         flash('You cannot chat with yourself.', 'warning')
         return redirect(url_for('main.messages'))
         
     form = MessageForm()
     if form.validate_on_submit():
-        msg = DBMessage(author=current_user, recipient=user, body=form.message.data)
+        msg = DBMessage(sender_id=current_user.id, recipient=user, body=form.message.data)
         if form.picture.data:
             picture_file = save_picture(form.picture.data, 'message_pics')
             msg.image_file = picture_file
         db.session.add(msg)
+        ContactScore.record(current_user.id, user.id)
+        ConversationRead.open(user.id, current_user.id)
         db.session.commit()
+        publish_message(msg)
         
         from datetime import timedelta
         # Send an email notification if the user is offline (not active in last 2 mins)
@@ -643,14 +955,32 @@ def chat(username):
         )
     ).order_by(DBMessage.timestamp.asc()).all()
     
-    # Mark messages as read
-    unread_messages = DBMessage.query.filter_by(sender_id=user.id, recipient_id=current_user.id, is_read=False).all()
-    if unread_messages:
-        for m in unread_messages:
-            m.is_read = True
+    # Mark what was shown as read: one watermark UPDATE, whatever the number of messages
+    received = [m.id for m in chat_messages if m.sender_id == user.id]
+    if received and ConversationRead.mark_read(current_user.id, user.id, up_to=received[-1]):
         db.session.commit()
+        publish_read(user, current_user)
+    # How far the other side has read, for the seen ticks on our own messages
+    read_up_to = ConversationRead.read_by(current_user.id).get(user.id, 0)
     
-    return render_template('chat.html', user=user, chat_messages=chat_messages, form=form, title=f"Chat with {user.username}")
+    return render_template('chat.html', user=user, chat_messages=chat_messages, form=form, read_up_to=read_up_to,
+                           title=f"Chat with {user.username}")
+
+def publish_read(sender, reader):
+    broker.publish_to_user(reader.id, 'unread', {'messages': reader.new_messages()})
+    broker.publish_to_user(sender.id, 'read', {'reader_id': reader.id})
+
+@main.route("/chat/<username>/read", methods=['POST'])
+@login_required
+def chat_read(username):
+    from urllib.parse import unquote
+    username = unquote(username)
+    user = User.live().filter_by(username=username).first_or_404()
+    updated = ConversationRead.mark_read(current_user.id, user.id)
+    db.session.commit()
+    if updated:
+        publish_read(user, current_user)
+    return jsonify({"status": "success", "messages": current_user.new_messages()})
 
 @main.route("/message/<int:message_id>/edit", methods=['POST'])
 @login_required
@@ -685,11 +1015,11 @@ def delete_message(message_id):
 @main.route("/share_post/<int:post_id>", methods=['POST'])
 @login_required
 def share_post(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = Post.live().filter_by(id=post_id).first_or_404()
     recipient_username = request.form.get('recipient')
     message_text = request.form.get('message_text', '')
     
-    recipient = User.query.filter_by(username=recipient_username).first()
+    recipient = User.live().filter_by(username=recipient_username).first()
     if not recipient:
         flash('User not found to share with.', 'danger')
         return redirect(request.referrer or url_for('main.main_page'))
@@ -699,13 +1029,16 @@ def share_post(post_id):
         return redirect(request.referrer or url_for('main.main_page'))
 
     msg = DBMessage(
-        author=current_user,
+        sender_id=current_user.id,
         recipient=recipient,
         body=message_text,
         shared_post_id=post.id
     )
     db.session.add(msg)
+    ContactScore.record(current_user.id, recipient.id)
+    ConversationRead.open(recipient.id, current_user.id)
     db.session.commit()
+    publish_message(msg)
     flash(f'Post successfully shared with {recipient.username}!', 'success')
     return redirect(request.referrer or url_for('main.main_page'))
 
@@ -715,4 +1048,31 @@ def read_notifications():
     for notif in current_user.notifications.filter_by(is_read=False).all():
         notif.is_read = True
     db.session.commit()
+    broker.publish_to_user(current_user.id, 'unread', {'notifications': 0})
     return jsonify({"status": "success"})
+
+@main.route("/events")
+@login_required
+def event_stream():
+    if not current_app.config['LIVE_EVENTS']:
+        # EventSource stops reconnecting on a 204, e.g. in a tab opened before live events were turned off
+        return '', 204
+    channels = [user_channel(current_user.id)]
+    heartbeat = current_app.config['SSE_HEARTBEAT']
+    max_duration = current_app.config['SSE_MAX_DURATION']
+    retry_ms = current_app.config['SSE_RETRY_MS']
+
+    # Subscribe before replaying so nothing published in between is lost
+    subscription = broker.subscribe(channels)
+    replay, complete = [], True
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_event_id and last_event_id.isdigit():
+        replay, complete = broker.replay(channels, int(last_event_id))
+
+    # An idle stream must not pin a pooled DB connection
+    db.session.remove()
+
+    # Passed to the server unwrapped: under asgi.py the stream then waits on the event loop, not a thread
+    return Response(EventStream(subscription, replay, complete, heartbeat, max_duration, retry_ms),
+                    mimetype='text/event-stream', direct_passthrough=True,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
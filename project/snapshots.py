@@ -0,0 +1,205 @@
+import hashlib
+import os
+import threading
+import time
+
+from flask import request, session, g, Response
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+# Rendered into snapshots in place of the CSRF token and swapped for the
+# visitor's own token when served, so forms in a shared page still validate.
+CSRF_PLACEHOLDER = '__snapshot_csrf_token__'
+
+
+class Snapshot:
+    __slots__ = ('html', 'built_at')
+
+    def __init__(self, html, built_at):
+        self.html = html
+        self.built_at = built_at
+
+
+class PageSnapshots:
+    """Pre-rendered copies of the pages logged-out visitors see.
+
+    The first anonymous request for a page renders it once; after that every
+    logged-out visitor and crawler gets the stored HTML without a query.
+    Writes that change what those pages show call `mark_stale()`. The next
+    visitor still gets the old copy while a background thread renders a new
+    one (stale-while-revalidate); changes within `debounce` seconds of each
+    other share one render. `max_age` bounds staleness from anything that
+    doesn't call `mark_stale()`.
+
+    With `SNAPSHOT_DIR` set the pages and the last-change stamp are files, so
+    every worker serves the same snapshot, a worker that starts up serves at
+    once, and only one worker re-renders after a change. Otherwise each
+    worker keeps its own copy in memory.
+    """
+
+    def __init__(self, app=None):
+        self._app = None
+        self.enabled = True
+        self.max_age = 300
+        self.debounce = 2.0
+        self.directory = None
+        self._pages = {}  # key -> Snapshot
+        self._renderers = {}  # key -> (path, base_url, render)
+        self._rendering = set()
+        self._changed_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SNAPSHOT_ENABLED', True)
+        self.max_age = app.config.get('SNAPSHOT_MAX_AGE', 300)
+        self.debounce = app.config.get('SNAPSHOT_DEBOUNCE', 2.0)
+        self.directory = app.config.get('SNAPSHOT_DIR')
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self._pages.clear()
+        self._renderers.clear()
+        self._changed_at = time.time()
+        app.extensions['snapshots'] = self
+        self._app = app
+
+    def _file(self, key, suffix='.html'):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + suffix)
+
+    def _stamp(self):
+        return os.path.join(self.directory, 'changed')
+
+    def changed_at(self):
+        if self.directory:
+            try:
+                return max(self._changed_at, os.stat(self._stamp()).st_mtime)
+            except FileNotFoundError:
+                pass
+        return self._changed_at
+
+    def mark_stale(self):
+        """Call after committing a change that shows on the anonymous pages."""
+        now = time.time()
+        self._changed_at = now
+        if self.directory:
+            try:
+                with open(self._stamp(), 'a'):
+                    pass
+                os.utime(self._stamp(), (now, now))
+            except OSError as e:
+                print(f"Failed to mark page snapshots stale: {e}")
+
+    def _load(self, key):
+        snapshot = self._pages.get(key)
+        if not self.directory:
+            return snapshot
+        path = self._file(key)
+        try:
+            built_at = os.stat(path).st_mtime
+            if snapshot is None or built_at > snapshot.built_at:
+                # Another worker rendered a newer copy
+                with open(path, encoding='utf-8') as f:
+                    snapshot = Snapshot(f.read(), built_at)
+                self._pages[key] = snapshot
+        except FileNotFoundError:
+            pass
+        return snapshot
+
+    def _store(self, key, html, built_at):
+        self._pages[key] = Snapshot(html, built_at)
+        if self.directory:
+            path = self._file(key)
+            temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temporary, 'w', encoding='utf-8') as f:
+                f.write(html)
+            # mtime records when rendering started, so a change made mid-render still counts as newer
+            os.utime(temporary, (built_at, built_at))
+            os.replace(temporary, path)
+
+    def _render(self, render):
+        g.csrf_token = CSRF_PLACEHOLDER  # generate_csrf() returns this instead of touching the session
+        return render()
+
+    def serve(self, render):
+        """The stored page for this path if the visitor is anonymous, else None.
+
+        `render` produces the page's HTML and is also what background
+        refreshes call. Visitors with flashed messages get a live render.
+        """
+        if not self.enabled or current_user.is_authenticated or session.get('_flashes'):
+            return None
+        # Not the full URL: every Host header a client cares to send would get its own copy
+        key = request.path
+        self._renderers[key] = (request.path, request.url_root, render)
+        snapshot = self._load(key)
+        if snapshot is None:
+            built_at = time.time()
+            html = self._render(render)
+            g.pop('csrf_token', None)
+            self._store(key, html, built_at)
+            snapshot, state = self._pages[key], 'miss'
+        elif snapshot.built_at < self.changed_at() or time.time() - snapshot.built_at > self.max_age:
+            self.refresh(key)
+            state = 'stale'
+        else:
+            state = 'fresh'
+        response = Response(snapshot.html.replace(CSRF_PLACEHOLDER, generate_csrf()), mimetype='text/html')
+        response.headers['X-Snapshot'] = state
+        response.headers['X-Snapshot-Age'] = str(int(time.time() - snapshot.built_at))
+        return response
+
+    def refresh(self, key):
+        """Re-renders `key` on a background thread unless that is already under way."""
+        with self._lock:
+            if key in self._rendering or key not in self._renderers:
+                return
+            self._rendering.add(key)
+        threading.Thread(target=self._refresh, args=(key,), daemon=True).start()
+
+    def _claim(self, key):
+        """Only one worker re-renders a shared snapshot; a claim older than a minute is abandoned."""
+        if not self.directory:
+            return True
+        lock = self._file(key, '.lock')
+        try:
+            if time.time() - os.stat(lock).st_mtime > 60:
+                os.remove(lock)
+        except FileNotFoundError:
+            pass
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def _refresh(self, key):
+        claimed = False
+        try:
+            claimed = self._claim(key)
+            if not claimed:
+                return
+            if self.debounce:
+                time.sleep(self.debounce)
+            path, base_url, render = self._renderers[key]
+            with self._app.test_request_context(path, base_url=base_url):
+                built_at = time.time()
+                html = self._render(render)
+            self._store(key, html, built_at)
+        except Exception as e:
+            print(f"Failed to refresh page snapshot {key}: {e}")
+        finally:
+            if claimed and self.directory:
+                try:
+                    os.remove(self._file(key, '.lock'))
+                except FileNotFoundError:
+                    pass
+            with self._lock:
+                self._rendering.discard(key)
+
+    def clear(self):
+        self._pages.clear()
+        self._changed_at = time.time()
+
+
+snapshots = PageSnapshots()
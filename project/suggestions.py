@@ -0,0 +1,162 @@
+import time
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy import select
+from project import db
+from project.models import User, Like, FollowSuggestion, followers
+# Only the offline job needs numpy/scipy; the web app starts without them
+# numpy/scipy are in requirements.txt but only the offline job uses them, so the web app still starts without them
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+
+class SuggestionJob:
+    """Builds who-to-follow suggestions with sparse matrix products.
+
+    F is the user x user follow matrix and L the user x post like matrix.
+    F @ F counts, for every pair, how many people you follow follow them
+    (friends of friends); L @ L.T counts posts you both liked. Rows are
+    processed in blocks of `block_size` users so memory stays bounded, and
+    each block's top `top_k` rows replace that block's old suggestions in
+    one transaction.
+    """
+
+    def __init__(self, top_k=20, block_size=2000, follow_weight=1.0, like_weight=0.25,
+                 max_likers=5000, echo=print):
+        if np is None:
+            raise RuntimeError("numpy and scipy are required: pip install numpy scipy")
+        self.top_k = top_k
+        self.block_size = block_size
+        self.follow_weight = follow_weight
+        self.like_weight = like_weight
+        self.max_likers = max_likers
+        self.echo = echo
+        self.written = 0
+        self.timings = {}
+
+    def _pairs(self, conn, query):
+        result = conn.execution_options(yield_per=100000).execute(query)
+        flat = np.fromiter(chain.from_iterable(chain.from_iterable(result.partitions())), dtype=np.int64)
+        return flat.reshape(-1, 2)
+
+    def _matrices(self):
+        with db.engine.connect() as conn:
+            user_ids = np.fromiter(conn.execute(select(User.id).order_by(User.id)).scalars(), dtype=np.int64)
+            if not len(user_ids):
+                return user_ids, None, None
+            edges = self._pairs(conn, select(followers.c.follower_id, followers.c.followed_id))
+            likes = self._pairs(conn, select(Like.user_id, Like.post_id))
+        n = len(user_ids)
+
+        def dense(values):
+            # Maps user ids to matrix rows; rows pointing at deleted users are dropped
+            pos = np.minimum(np.searchsorted(user_ids, values), n - 1)
+            return pos, user_ids[pos] == values
+
+        src, ok_src = dense(edges[:, 0])
+        dst, ok_dst = dense(edges[:, 1])
+        ok = ok_src & ok_dst & (src != dst)
+        follows = sparse.csr_matrix((np.ones(ok.sum(), dtype=np.float32), (src[ok], dst[ok])), shape=(n, n))
+        follows.sum_duplicates()
+        follows.data[:] = 1
+
+        likers, ok = dense(likes[:, 0])
+        post_ids, posts = np.unique(likes[ok, 1], return_inverse=True)
+        liked = sparse.csr_matrix((np.ones(ok.sum(), dtype=np.float32), (likers[ok], posts)),
+                                  shape=(n, len(post_ids)))
+        liked.sum_duplicates()
+        liked.data[:] = 1
+        # A post liked by thousands of readers says little about any two of them
+        popular = np.asarray(liked.sum(axis=0)).ravel() > self.max_likers
+        if popular.any():
+            liked = liked @ sparse.diags((~popular).astype(np.float32))
+            liked.eliminate_zeros()
+
+        self.echo(f"Loaded {n} users, {follows.nnz} follow edges, {liked.nnz} likes.")
+        return user_ids, follows, liked
+
+    def _top_k(self, scores):
+        """Returns (rows, cols, scores) of the best `top_k` entries of every row, without a Python loop."""
+        coo = scores.tocoo()
+        order = np.lexsort((-coo.data, coo.row))
+        rows, cols, data = coo.row[order], coo.col[order], coo.data[order]
+        counts = np.bincount(rows, minlength=scores.shape[0])
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        keep = np.arange(len(rows)) - starts[rows] < self.top_k
+        return rows[keep], cols[keep], data[keep]
+
+    def _write(self, first_id, last_id, records):
+        table = FollowSuggestion.__table__
+        with db.engine.begin() as conn:
+            conn.execute(table.delete().where(table.c.user_id.between(first_id, last_id)))
+            if records:
+                conn.execute(table.insert(), records)
+
+    def run(self):
+        start = time.perf_counter()
+        user_ids, follows, liked = self._matrices()
+        if not len(user_ids):
+            return 0
+        liked_t = liked.T.tocsr()
+        self.timings['load'] = time.perf_counter() - start
+
+        compute = write = 0.0
+        n = len(user_ids)
+        now = datetime.utcnow()
+        for lo in range(0, n, self.block_size):
+            hi = min(lo + self.block_size, n)
+            t0 = time.perf_counter()
+            block = follows[lo:hi]
+            mutual = block @ follows
+            shared = liked[lo:hi] @ liked_t
+            scores = self.follow_weight * mutual + self.like_weight * shared
+            # Never suggest yourself or someone you already follow
+            exclude = block + sparse.eye(hi - lo, n, k=lo, dtype=np.float32, format='csr')
+            scores = scores - scores.multiply(exclude > 0)
+            scores.eliminate_zeros()
+            rows, cols, best = self._top_k(scores.tocsr())
+            if len(rows):
+                mutual_counts = np.asarray(mutual[rows, cols]).ravel().astype(np.int64)
+                shared_counts = np.asarray(shared[rows, cols]).ravel().astype(np.int64)
+            else:
+                # Fancy indexing with no entries gives back a sparse matrix, not an array
+                mutual_counts = shared_counts = np.zeros(0, dtype=np.int64)
+            t1 = time.perf_counter()
+
+            records = [
+                {'user_id': u, 'suggested_id': s, 'score': sc, 'mutual_count': m, 'shared_likes': sl, 'created_at': now}
+                for u, s, sc, m, sl in zip(user_ids[lo + rows].tolist(), user_ids[cols].tolist(), best.tolist(),
+                                           mutual_counts.tolist(), shared_counts.tolist())
+            ]
+            self._write(int(user_ids[lo]), int(user_ids[hi - 1]), records)
+            t2 = time.perf_counter()
+            compute += t1 - t0
+            write += t2 - t1
+            self.written += len(records)
+            self.echo(f"users {lo + 1}-{hi} of {n}: {len(records)} suggestions")
+
+        self.timings['compute'] = compute
+        self.timings['write'] = write
+        self.timings['total'] = time.perf_counter() - start
+        return self.written
+
+
+def suggestions_for(user_id, limit=5):
+    """Top suggestions for one user, read with their users in one query.
+
+    Rows are only as fresh as the last build, so anyone followed since then
+    is dropped using the cached following set.
+    """
+    from project.user_cache import following_ids
+    rows = (FollowSuggestion.query
+            .join(FollowSuggestion.suggested)
+            .options(db.contains_eager(FollowSuggestion.suggested))
+            .filter(FollowSuggestion.user_id == user_id, User.deleted_at.is_(None))
+            .order_by(FollowSuggestion.score.desc())
+            .limit(limit * 2).all())
+    followed = following_ids(user_id) or ()
+    return [row for row in rows if row.suggested_id not in followed][:limit]
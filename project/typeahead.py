@@ -0,0 +1,267 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+
+from project import db
+
+# Sorts after every character a key can contain, so [prefix, prefix + END) is a prefix's range
+END = chr(0x10FFFF)
+
+
+def split_tags(tags):
+    """'Poem, life ,poem' -> {'poem', 'life'}; the same reading templates use, lowercased."""
+    return {tag.strip().lower() for tag in (tags or '').split(',') if tag.strip()}
+
+
+class PrefixIndex:
+    """Case-insensitive prefix search over names ranked by a score.
+
+    Names are kept as one sorted list of 'lowercase\\0Display' entries, so a
+    prefix is a contiguous slice found with two bisects. Small slices are
+    ranked on the spot; prefixes matching more than `scan_limit` names (one
+    or two letters over a large list) keep a cached top list, built at load
+    time. Score changes patch those lists in place where they can and
+    otherwise drop them to be rebuilt from the children's lists.
+
+    `max_entries` caps memory: once full, a new name only gets in if it
+    outranks the weakest one indexed.
+    """
+
+    def __init__(self, max_entries=1000000, top_k=20, scan_limit=256, cache_size=4096):
+        self.max_entries = max_entries
+        self.top_k = top_k
+        self.scan_limit = scan_limit
+        self.cache_size = cache_size
+        self._entries = []
+        self._scores = {}
+        self._top = OrderedDict()  # prefix -> entries, best first
+        self._cache_limit = cache_size
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _entry(name):
+        return f'{name.lower()}\0{name}'
+
+    def load(self, items):
+        """Replaces the contents with (name, score) pairs and precomputes the top lists of broad prefixes."""
+        scores = {self._entry(name): score for name, score in items}
+        if len(scores) > self.max_entries:
+            scores = dict(heapq.nlargest(self.max_entries, scores.items(), key=lambda item: item[1]))
+        entries = sorted(scores)
+        with self._lock:
+            self._entries, self._scores = entries, scores
+            self._top.clear()
+            self._best('', 0, len(entries))
+            self._cache_limit = self.cache_size + len(self._top)
+
+    def _range(self, key):
+        return bisect_left(self._entries, key), bisect_left(self._entries, key + END)
+
+    def _rank(self, entries, n):
+        return heapq.nlargest(n, entries, key=self._scores.__getitem__)
+
+    def _best(self, key, lo, hi):
+        """Top entries for `key`, whose entries are [lo, hi). Broad prefixes are
+        built from their children's top lists, so a cache miss costs a few small
+        merges rather than a scan of every matching name."""
+        if hi - lo <= self.scan_limit:
+            return self._rank(self._entries[lo:hi], self.top_k)
+        best = self._top.get(key)
+        if best is not None:
+            self._top.move_to_end(key)
+            return best
+        entries, depth = self._entries, len(key)
+        candidates = []
+        i = lo
+        while i < hi and entries[i][depth] == '\0':  # the name equal to the prefix itself
+            candidates.append(entries[i])
+            i += 1
+        while i < hi:
+            child = key + entries[i][depth]
+            j = bisect_left(entries, child + END, i, hi)
+            candidates.extend(self._best(child, i, j))
+            i = j
+        best = self._rank(candidates, self.top_k)
+        self._top[key] = best
+        if len(self._top) > self._cache_limit:
+            self._top.popitem(last=False)
+        return best
+
+    def search(self, prefix, limit=8):
+        """Up to `limit` (name, score) pairs starting with `prefix`, highest score first."""
+        key = prefix.lower()
+        with self._lock:
+            best = self._best(key, *self._range(key))[:limit]
+            return [(entry.split('\0', 1)[1], self._scores[entry]) for entry in best]
+
+    def _cached_prefixes(self, entry):
+        key = entry.split('\0', 1)[0]
+        return [key[:i] for i in range(1, len(key) + 1) if key[:i] in self._top]
+
+    def add(self, name, score=0):
+        entry = self._entry(name)
+        with self._lock:
+            if entry in self._scores:
+                self._set(entry, score)
+                return
+            if len(self._entries) >= self.max_entries:
+                if score <= 0:
+                    return  # scores are never negative, so nothing indexed is weaker
+                weakest = min(self._scores, key=self._scores.__getitem__)
+                if self._scores[weakest] >= score:
+                    return
+                self._remove(weakest)
+            insort(self._entries, entry)
+            self._scores[entry] = score
+            self._raise(entry, score)
+
+    def remove(self, name):
+        with self._lock:
+            self._remove(self._entry(name))
+
+    def _remove(self, entry):
+        if self._scores.pop(entry, None) is None:
+            return
+        i = bisect_left(self._entries, entry)
+        del self._entries[i]
+        for prefix in self._cached_prefixes(entry):
+            if entry in self._top[prefix]:
+                del self._top[prefix]
+
+    def rename(self, old_name, new_name):
+        with self._lock:
+            score = self._scores.get(self._entry(old_name), 0)
+            self._remove(self._entry(old_name))
+        self.add(new_name, score)
+
+    def set_score(self, name, score):
+        with self._lock:
+            entry = self._entry(name)
+            if entry in self._scores:
+                self._set(entry, score)
+
+    def adjust(self, name, delta):
+        """Adds `delta` to a usage count, adding the name or dropping it at zero."""
+        with self._lock:
+            entry = self._entry(name)
+            score = self._scores.get(entry, 0) + delta
+            if score <= 0:
+                self._remove(entry)
+            elif entry in self._scores:
+                self._set(entry, score)
+            else:
+                self.add(name, score)
+
+    def _set(self, entry, score):
+        old = self._scores[entry]
+        self._scores[entry] = score
+        if score >= old:
+            self._raise(entry, score)
+        else:
+            # A lower score may let something uncached into a top list; recompute those lazily
+            for prefix in self._cached_prefixes(entry):
+                if entry in self._top[prefix]:
+                    del self._top[prefix]
+
+    def _raise(self, entry, score):
+        for prefix in self._cached_prefixes(entry):
+            best = self._top[prefix]
+            if entry in best or len(best) < self.top_k or score > self._scores[best[-1]]:
+                members = set(best) | {entry}
+                self._top[prefix] = sorted(members, key=lambda e: (-self._scores[e], e))[:self.top_k]
+
+
+class Typeahead:
+    """Username and tag indexes behind /autocomplete.
+
+    Built on first use and rebuilt in the background every `refresh`
+    seconds; in between, routes push registrations, renames, follows and
+    tag edits so this process stays current. Other workers catch up at
+    their next rebuild.
+    """
+
+    def __init__(self, app=None):
+        self._app = None
+        self.users = PrefixIndex()
+        self.tags = PrefixIndex()
+        self.refresh = 600
+        self.built_at = None
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.refresh = app.config.get('TYPEAHEAD_REFRESH', 600)
+        max_entries = app.config.get('TYPEAHEAD_MAX_ENTRIES', 1000000)
+        self.users = PrefixIndex(max_entries=max_entries)
+        self.tags = PrefixIndex(max_entries=max_entries)
+        self.built_at = None
+        app.extensions['typeahead'] = self
+        self._app = app
+
+    def build(self):
+        from project.models import User, Post
+        users = db.session.execute(
+            db.select(User.username, User.follower_count).where(User.deleted_at.is_(None))
+        ).all()
+        counts = Counter()
+        for tags, in db.session.execute(
+                db.select(Post.tags).where(Post.deleted_at.is_(None), Post.tags.isnot(None))
+                .execution_options(yield_per=5000)):
+            counts.update(split_tags(tags))
+        self.users.load(users)
+        self.tags.load(counts.items())
+        self.built_at = time.monotonic()
+
+    def ensure_built(self):
+        if self.built_at is None:
+            with self._lock:
+                if self.built_at is None:
+                    self.build()
+        elif time.monotonic() - self.built_at > self.refresh and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            with self._app.app_context():
+                self.build()
+        except Exception as e:
+            print(f"Failed to rebuild typeahead index: {e}")
+        finally:
+            self._rebuilding = False
+
+    # Incremental updates; no-ops until the index is first built
+    def user_added(self, username, followers=0):
+        if self.built_at is not None:
+            self.users.add(username, followers)
+
+    def user_renamed(self, old_username, new_username):
+        if self.built_at is not None:
+            self.users.rename(old_username, new_username)
+
+    def user_removed(self, username):
+        if self.built_at is not None:
+            self.users.remove(username)
+
+    def followers_changed(self, username, followers):
+        if self.built_at is not None:
+            self.users.set_score(username, followers)
+
+    def tags_changed(self, old_tags, new_tags):
+        if self.built_at is None:
+            return
+        old, new = split_tags(old_tags), split_tags(new_tags)
+        for tag in old - new:
+            self.tags.adjust(tag, -1)
+        for tag in new - old:
+            self.tags.adjust(tag, 1)
+
+
+typeahead = Typeahead()
@@ -0,0 +1,191 @@
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask_login import UserMixin
+from project import db
+from project.models import User, followers
+
+# Columns the navbar, base template and permission checks read on every request.
+# Anything else (relationships, password hash, follow graph) loads the real row lazily.
+SNAPSHOT_FIELDS = (
+    'id', 'username', 'email', 'image_file', 'is_verified',
+    'msg_preference', 'profile_visibility', 'two_factor_enabled',
+    'email_notif_enabled', 'feed_sorting', 'accent_color', 'last_seen',
+    'follower_count', 'following_count',
+)
+
+# How often the before_request hook is allowed to bump last_seen.
+# The chat route treats anyone seen in the last 2 minutes as online.
+LAST_SEEN_INTERVAL = timedelta(seconds=60)
+
+
+class UserSessionCache:
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return self._copy(snapshot)
+
+    def set(self, user_id, snapshot):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, self._copy(snapshot))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _copy(snapshot):
+        return dict(snapshot)
+
+    def update(self, user_id, **fields):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry[1].update(fields)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FollowingCache(UserSessionCache):
+    """Per-user frozenset of followed ids, bounded by entry count and set size.
+
+    Users who follow more than `max_set_size` accounts are remembered as
+    oversized and answered with an indexed lookup instead.
+    """
+
+    def __init__(self, ttl=60, max_entries=5000, max_set_size=2000):
+        super().__init__(ttl=ttl, max_entries=max_entries)
+        self.max_set_size = max_set_size
+
+    @staticmethod
+    def _copy(ids):
+        return ids
+
+
+user_cache = UserSessionCache()
+following_cache = FollowingCache()
+_OVERSIZED = object()
+
+
+class CachedUser(UserMixin):
+    """Lightweight stand-in for User built from a cached snapshot.
+
+    Snapshot fields are answered from memory. Any other attribute or method
+    loads the full User row on first use and delegates to it.
+    """
+
+    def __init__(self, snapshot):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_user', None)
+
+    @property
+    def orm_user(self):
+        if self._user is None:
+            object.__setattr__(self, '_user', db.session.get(User, self._snapshot['id']))
+        return self._user
+
+    def __getattr__(self, name):
+        snapshot = self.__dict__['_snapshot']
+        if name in snapshot:
+            return snapshot[name]
+        return getattr(self.orm_user, name)
+
+    def __setattr__(self, name, value):
+        # Writes always go through the ORM row so they are flushed on commit
+        if name in self._snapshot:
+            self._snapshot[name] = value
+        setattr(self.orm_user, name, value)
+
+    # These only need the id, so they run without loading the User row
+    is_developer = User.is_developer
+    new_messages = User.new_messages
+    unread_notification_count = User.unread_notification_count
+    get_recent_notifications = User.get_recent_notifications
+    followed_posts = User.followed_posts
+    is_following = User.is_following
+    get_top_chat_users = User.get_top_chat_users
+
+    def __repr__(self):
+        return f'<User {self.username}>'
+
+
+def _fetch_snapshot(user_id):
+    columns = [getattr(User, field) for field in SNAPSHOT_FIELDS]
+    row = db.session.query(*columns).filter(User.id == user_id, User.deleted_at.is_(None)).first()
+    if row is None:
+        return None
+    return dict(zip(SNAPSHOT_FIELDS, row))
+
+
+def load_cached_user(user_id):
+    snapshot = user_cache.get(user_id)
+    if snapshot is None:
+        snapshot = _fetch_snapshot(user_id)
+        if snapshot is None:
+            return None
+        user_cache.set(user_id, snapshot)
+    return CachedUser(snapshot)
+
+
+def touch_last_seen(user):
+    """Bumps last_seen with a single UPDATE, at most once per LAST_SEEN_INTERVAL."""
+    now = datetime.utcnow()
+    last_seen = getattr(user, 'last_seen', None)
+    if last_seen and now - last_seen < LAST_SEEN_INTERVAL:
+        return
+    User.query.filter_by(id=user.id).update({'last_seen': now}, synchronize_session=False)
+    db.session.commit()
+    user_cache.update(user.id, last_seen=now)
+    if isinstance(user, CachedUser):
+        user._snapshot['last_seen'] = now
+
+
+def invalidate_user(user_id):
+    user_cache.invalidate(user_id)
+
+
+def following_ids(user_id):
+    """Ids that `user_id` follows, or None if the set is too large to keep in memory."""
+    ids = following_cache.get(user_id)
+    if ids is None:
+        rows = db.session.execute(
+            db.select(followers.c.followed_id).where(followers.c.follower_id == user_id)
+            .limit(following_cache.max_set_size + 1)).scalars().all()
+        ids = frozenset(rows) if len(rows) <= following_cache.max_set_size else _OVERSIZED
+        following_cache.set(user_id, ids)
+    return None if ids is _OVERSIZED else ids
+
+
+def is_following(follower_id, followed_id):
+    ids = following_ids(follower_id)
+    if ids is not None:
+        return followed_id in ids
+    return db.session.execute(db.select(followers.c.follower_id).where(
+        followers.c.follower_id == follower_id, followers.c.followed_id == followed_id)).first() is not None
+
+
+def invalidate_follow(follower_id, followed_id):
+    """Drops everything a follow/unfollow changed: the follower's set and both users' counters."""
+    following_cache.invalidate(follower_id)
+    user_cache.invalidate(follower_id)
+    user_cache.invalidate(followed_id)
@@ -0,0 +1,82 @@
+from sqlalchemy import func, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from project import db
+from project.models import User
+
+# Leaves room for a numeric suffix within the 80-character column
+MAX_BASE_LENGTH = 70
+# Never part of a chosen username: they break /user/<username> links, and '#' marks deleted accounts
+UNSAFE_CHARACTERS = '#/?'
+
+
+def tombstone(user_id):
+    """The username a deleted account is renamed to; no sign-up can pick it."""
+    return f'deleted#{user_id}'
+
+
+def strip_unsafe(name):
+    return ''.join(c for c in name if c not in UNSAFE_CHARACTERS)
+
+
+def _lowered():
+    """lower(username) as the index ix_user_username_lower stores it."""
+    expression = func.lower(User.username)
+    if db.engine.dialect.name == 'postgresql':
+        # The migration builds the PostgreSQL index in the "C" collation so prefix ranges are byte order
+        expression = expression.collate('C')
+    return expression
+
+
+def username_taken(username, exclude_id=None):
+    """True if another account has this username in any letter case. One index lookup."""
+    query = select(User.id).where(_lowered() == username.lower())
+    if exclude_id is not None:
+        query = query.where(User.id != exclude_id)
+    return db.session.execute(query.limit(1)).first() is not None
+
+
+def allocate_username(base):
+    """`base` if nobody has it, else `base` plus the smallest free number from 1 up.
+
+    Reads every taken `base` and `base<digits>` in one range scan of the
+    lower(username) index, so a popular name costs one query, not one per
+    collision. Case-insensitive, like the index.
+    """
+    base = (strip_unsafe(base) or 'writer')[:MAX_BASE_LENGTH]
+    lowered, key = base.lower(), _lowered()
+    # Everything from '<base>0' up to '<base>:' (':' sorts right after '9'); non-digit tails are dropped below
+    taken = db.session.execute(
+        select(key).where(or_(key == lowered, (key >= lowered + '0') & (key < lowered + ':')))
+    ).scalars().all()
+    suffixes = {name[len(lowered):] for name in taken}
+    if '' not in suffixes:
+        return base
+    numbers = {int(suffix) for suffix in suffixes if suffix.isdigit() and suffix.isascii() and suffix[0] != '0'}
+    n = 1
+    while n in numbers:
+        n += 1
+    return f'{base}{n}'
+
+
+def is_username_conflict(error):
+    return 'username' in str(getattr(error, 'orig', error)).lower()
+
+
+def add_with_free_username(user, base, attempts=5):
+    """Gives `user` a free username derived from `base` and commits it.
+
+    Another sign-up can take the same name between the lookup and the
+    insert; the unique index then rejects ours, and we roll back and
+    allocate again. Other integrity errors are raised as they are.
+    """
+    for attempt in range(attempts):
+        user.username = allocate_username(base)
+        db.session.add(user)
+        try:
+            db.session.commit()
+            return user
+        except IntegrityError as e:
+            db.session.rollback()
+            if not is_username_conflict(e) or attempt == attempts - 1:
+                raise
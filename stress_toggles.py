@@ -0,0 +1,98 @@
+import os
+import sys
+import random
+import tempfile
+import threading
+import time
+
+# Concurrency stress test for Like.toggle / SavedPost.toggle.
+# Many threads hammer one post; afterwards there must be no duplicate rows and
+# every user's final state must match the parity of the toggles that changed it.
+# Runs against a throwaway SQLite database unless DATABASE_URL is set.
+#   python stress_toggles.py [threads] [toggles_per_thread]
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+TOGGLES = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+USERS = 8  # few users so threads constantly collide on the same (user, post) pair
+
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'stress.db')
+
+from sqlalchemy import func
+from project import create_app, db
+from project.models import User, Post, Like, SavedPost
+
+app = create_app()
+
+with app.app_context():
+    users = []
+    for i in range(USERS):
+        user = User.query.filter_by(username=f'stress{i}').first()
+        if user is None:
+            user = User(username=f'stress{i}', email=f'stress{i}@example.com', is_verified=True)
+            db.session.add(user)
+        users.append(user)
+    db.session.commit()
+    post = Post(title='Stress', body='Stress test post', author_name='stress', user_id=users[0].id)
+    db.session.add(post)
+    db.session.commit()
+    user_ids = [u.id for u in users]
+    post_id = post.id
+
+changes = {model: {uid: 0 for uid in user_ids} for model in (Like, SavedPost)}
+changes_lock = threading.Lock()
+errors = []
+
+
+def worker(seed):
+    rng = random.Random(seed)
+    with app.app_context():
+        for _ in range(TOGGLES):
+            model = rng.choice((Like, SavedPost))
+            uid = rng.choice(user_ids)
+            for attempt in range(20):
+                try:
+                    present, changed = model.toggle(uid, post_id)
+                    db.session.commit()
+                    break
+                except Exception as e:
+                    # SQLite may report "database is locked" under heavy contention; retry like a client would
+                    db.session.rollback()
+                    if attempt == 19:
+                        errors.append(e)
+                        changed = False
+                    time.sleep(0.01 * (attempt + 1))
+            if changed:
+                with changes_lock:
+                    changes[model][uid] += 1
+        db.session.remove()
+
+
+start = time.perf_counter()
+threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+elapsed = time.perf_counter() - start
+
+total = THREADS * TOGGLES
+print(f"{total} toggles from {THREADS} threads on one post in {elapsed:.2f}s ({total / elapsed:.0f} toggles/s)")
+
+failed = False
+with app.app_context():
+    for model in (Like, SavedPost):
+        rows = db.session.query(model.user_id, func.count()).filter_by(post_id=post_id).group_by(model.user_id).all()
+        counts = dict(rows)
+        duplicates = {uid: n for uid, n in counts.items() if n > 1}
+        mismatched = {uid for uid in user_ids if counts.get(uid, 0) != changes[model][uid] % 2}
+        print(f"{model.__name__:>10}: {sum(counts.values())} rows, duplicates={duplicates or 'none'}, "
+              f"parity mismatches={sorted(mismatched) or 'none'}")
+        failed = failed or bool(duplicates) or bool(mismatched)
+
+if errors:
+    print(f"{len(errors)} toggles failed after retries: {errors[0]}")
+    failed = True
+
+print("FAILED" if failed else "OK")
+sys.exit(1 if failed else 0)